@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from apify_limiter import call_actor, iter_dataset_items
+from metrics import metrics
+
+# Cache configuration
+CACHE_CONFIG = {
+    "CACHE_DIR": "./.apify_cache",      # Folder holding one JSONL file per cached actor run
+    "MAX_SIZE_MB": 512,                 # Least recently used entries are evicted above this size
+    "DEFAULT_TTL": 7 * 24 * 3600,       # Seconds a cached run stays valid when the actor has no TTL below
+    "ACTOR_TTLS": {
+        "5K30i8aFccKNF5ICs": 24 * 3600,     # TikTok search: results change daily
+        "S5h7zRLfKFEr8pdj7": 3 * 24 * 3600, # Media download: key-value store URLs expire with the run storage
+        "XomSRf7d0qf3mVj1y": 24 * 3600,     # Comments: new comments keep arriving
+    },
+    # Set APIFY_CACHE_BYPASS=1 to always call the actors (results are still written to the cache)
+    "BYPASS": os.environ.get("APIFY_CACHE_BYPASS", "") == "1",
+}
+
+_lock = threading.Lock()
+
+def cache_key(actor_id, run_input):
+    """Build the cache key from the actor ID and a canonical hash of run_input"""
+    canonical = json.dumps(run_input, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    digest = hashlib.sha256(f"{actor_id}:{canonical}".encode('utf-8')).hexdigest()
+    return digest
+
+def cache_path(actor_id, run_input):
+    """Path of the cache file for an actor run"""
+    return os.path.join(CACHE_CONFIG["CACHE_DIR"], actor_id, f"{cache_key(actor_id, run_input)}.jsonl")
+
+def actor_ttl(actor_id):
+    """TTL in seconds for the given actor"""
+    return CACHE_CONFIG["ACTOR_TTLS"].get(actor_id, CACHE_CONFIG["DEFAULT_TTL"])
+
+def _read_header(path):
+    """Read the metadata line of a cache file, or None if it is unreadable"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+        return header.get("_cache")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def is_fresh(path, actor_id):
+    """Check whether a cache file exists and is younger than the actor's TTL"""
+    if not os.path.exists(path):
+        return False
+    header = _read_header(path)
+    if not header:
+        return False
+    return time.time() - header.get("created", 0) < actor_ttl(actor_id)
+
+def evict(max_size_mb=None):
+    """Delete least recently used cache files until the cache fits the size cap"""
+    max_bytes = (max_size_mb or CACHE_CONFIG["MAX_SIZE_MB"]) * 1024 * 1024
+    entries = []
+    total = 0
+    for root, _, files in os.walk(CACHE_CONFIG["CACHE_DIR"]):
+        for name in files:
+            if not name.endswith('.jsonl'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+    # Oldest access time first
+    entries.sort()
+    removed = 0
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            removed += 1
+        except OSError:
+            pass
+    if removed:
+        print(f"Apify cache: evicted {removed} entries")
+    return removed
+
+def iterate_actor_items(client, actor_id, run_input, bypass=False):
+    """
+    Yield the dataset items of an actor run, served from the on-disk cache when possible
+
+    On a miss the actor is called and its items are written to the cache while
+    they are yielded. The entry is only committed once the whole dataset has been read.
+    """
+    path = cache_path(actor_id, run_input)
+    bypass = bypass or CACHE_CONFIG["BYPASS"]
+
+    if not bypass and is_fresh(path, actor_id):
+        print(f"Apify cache hit for actor {actor_id}")
+        metrics.incr("actor_cache_hits_total", actor=actor_id)
+        # Touch the file so LRU eviction sees the access
+        os.utime(path, None)
+        with open(path, 'r', encoding='utf-8') as f:
+            f.readline()
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+
+    metrics.incr("actor_cache_misses_total", actor=actor_id)
+    # Rate-limited, retried on 429/5xx and bounded by the shared run concurrency
+    run = call_actor(client, actor_id, run_input)
+    print(f"Apify run completed for actor {actor_id}, dataset ID: {run['defaultDatasetId']}")
+
+    # Only successful runs are worth caching
+    cacheable = run.get("status", "SUCCEEDED") == "SUCCEEDED"
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    completed = False
+    f = None
+    try:
+        if cacheable:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            f = open(tmp_path, 'w', encoding='utf-8')
+            header = {"_cache": {"actor_id": actor_id, "created": time.time(), "run_id": run.get("id")}}
+            f.write(json.dumps(header) + "\n")
+
+        for item in iter_dataset_items(client, run["defaultDatasetId"]):
+            if f:
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            metrics.incr("actor_items_total", actor=actor_id)
+            yield item
+        completed = True
+    finally:
+        if f:
+            f.close()
+            if completed:
+                with _lock:
+                    os.replace(tmp_path, path)
+                    evict()
+            else:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+def run_actor(client, actor_id, run_input, bypass=False):
+    """Return all dataset items of an actor run as a list, using the cache"""
+    return list(iterate_actor_items(client, actor_id, run_input, bypass=bypass))
@@ -0,0 +1,250 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from metrics import metrics
+
+# Limits shared by every actor call made from this process
+LIMIT_CONFIG = {
+    "API_URL": os.environ.get("APIFY_API_URL"),  # Alternative API base URL (e.g. the local benchmark server)
+    "RATE_PER_SEC": float(os.environ.get("APIFY_RATE_PER_SEC", 2.0)),       # Actor runs started per second (0: no limit)
+    "BURST": int(os.environ.get("APIFY_BURST", 5)),                          # Runs that may start back to back
+    "MAX_CONCURRENT_RUNS": int(os.environ.get("APIFY_MAX_CONCURRENT", 8)),   # Account concurrency ceiling
+    "MIN_CONCURRENT_RUNS": 1,
+    "MAX_RETRIES": 5,             # Attempts after the first one on 429, 5xx and network errors
+    "DATASET_PAGE_SIZE": 1000,    # Items read per dataset request
+    "BACKOFF_BASE": 2.0,          # Seconds before the first retry, doubled each attempt
+    "BACKOFF_MAX": 60.0,          # Longest wait between attempts
+    "ERROR_WINDOW": 20,           # Recent calls the error rate is measured over
+    "DECREASE_ABOVE": 0.2,        # Halve concurrency when the throttling rate exceeds this
+    "INCREASE_BELOW": 0.05,       # Add one run of concurrency when the rate stays below this
+}
+
+def make_client(api_key):
+    """
+    ApifyClient for api_key, pointed at LIMIT_CONFIG["API_URL"] when one is set
+
+    The client's own retries are turned off: a 429 or 5xx must reach call_actor
+    straight away, so the adaptive limiter sees the throttling and the retries
+    are counted against MAX_RETRIES instead of multiplying with the client's.
+    """
+    # Imported on first use so that commands which never call an actor skip the client library
+    from apify_client import ApifyClient
+    options = {"max_retries": 0}
+    if LIMIT_CONFIG["API_URL"]:
+        options["api_url"] = LIMIT_CONFIG["API_URL"]
+    client = ApifyClient(api_key, **options)
+    # apify-client 1.x reads max_retries=0 as "use the default of 8"
+    client.http_client.max_retries = 0
+    return client
+
+class TokenBucket:
+    """Blocking token bucket: acquire() waits until a token is available (rate 0 never waits)"""
+
+    def __init__(self, rate, burst):
+        if rate < 0:
+            raise ValueError(f"Token bucket rate must be 0 (unlimited) or positive, got {rate}")
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit for actor runs that adapts to the throttling rate
+
+    The limit starts at the configured maximum. It is halved when too many recent
+    calls were throttled (429) or failed server-side (5xx), and grows by one when
+    calls succeed, so the number of runs in flight settles just under the account
+    ceiling.
+    """
+
+    def __init__(self, max_limit, min_limit=1, window=20, decrease_above=0.2, increase_below=0.05):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = self.max_limit
+        self.active = 0
+        self.outcomes = deque(maxlen=window)
+        self.decrease_above = decrease_above
+        self.increase_below = increase_below
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.active >= self.limit:
+                self._condition.wait()
+            self.active += 1
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    def record(self, throttled):
+        """Record one call outcome and adjust the limit"""
+        with self._condition:
+            self.outcomes.append(bool(throttled))
+            error_rate = sum(self.outcomes) / len(self.outcomes)
+            if throttled and error_rate > self.decrease_above and self.limit > self.min_limit:
+                self.limit = max(self.min_limit, self.limit // 2)
+                # Judge the new limit on fresh outcomes
+                self.outcomes.clear()
+                print(f"Apify limiter: error rate {error_rate:.0%}, concurrency lowered to {self.limit}")
+            elif (not throttled and len(self.outcomes) == self.outcomes.maxlen
+                  and error_rate < self.increase_below and self.limit < self.max_limit):
+                self.limit += 1
+                self.outcomes.clear()
+                print(f"Apify limiter: concurrency raised to {self.limit}")
+            self._condition.notify_all()
+
+def status_code(error):
+    """HTTP status of an Apify client error, or None"""
+    for attribute in ("status_code", "status"):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
+
+# Network and timeout errors of the HTTP libraries apify-client may use, by module
+# and class name so none of them has to be imported: module -> names in the MRO
+TRANSPORT_ERRORS = {
+    "httpx": ("TimeoutException", "NetworkError", "RemoteProtocolError", "ProxyError"),
+    "impit": ("TimeoutException", "NetworkError", "RemoteProtocolError", "ProxyError"),
+    "requests": ("ConnectionError", "Timeout"),
+    "urllib3": ("ProtocolError", "TimeoutError", "NewConnectionError"),
+}
+
+def is_retryable(error):
+    """429, 5xx, network and timeout errors are worth retrying; other errors are not"""
+    code = status_code(error)
+    if code is not None:
+        return code == 429 or code >= 500
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    names = TRANSPORT_ERRORS.get(type(error).__module__.split('.')[0], ())
+    return any(cls.__name__ in names for cls in type(error).__mro__)
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff for the given retry attempt (0-based)"""
+    ceiling = min(LIMIT_CONFIG["BACKOFF_MAX"], LIMIT_CONFIG["BACKOFF_BASE"] * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+_bucket = None
+_limiter = None
+_init_lock = threading.Lock()
+
+def get_limits():
+    """Return the process-wide (TokenBucket, AdaptiveLimiter) pair, built from LIMIT_CONFIG on first use"""
+    global _bucket, _limiter
+    with _init_lock:
+        if _bucket is None:
+            _bucket = TokenBucket(LIMIT_CONFIG["RATE_PER_SEC"], LIMIT_CONFIG["BURST"])
+            _limiter = AdaptiveLimiter(
+                LIMIT_CONFIG["MAX_CONCURRENT_RUNS"],
+                LIMIT_CONFIG["MIN_CONCURRENT_RUNS"],
+                LIMIT_CONFIG["ERROR_WINDOW"],
+                LIMIT_CONFIG["DECREASE_ABOVE"],
+                LIMIT_CONFIG["INCREASE_BELOW"],
+            )
+    return _bucket, _limiter
+
+def retry_request(fn, description):
+    """
+    Call fn(), retrying 429, 5xx and network errors with jittered exponential backoff
+
+    For requests that start no actor run (status polls, dataset pages), so they
+    take no token or run slot.
+    """
+    retries = LIMIT_CONFIG["MAX_RETRIES"]
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if not is_retryable(e) or attempt == retries:
+                raise
+            delay = backoff_delay(attempt)
+            print(f"{description} failed ({status_code(e) or type(e).__name__}), "
+                  f"retry {attempt + 1}/{retries} in {delay:.1f}s")
+        time.sleep(delay)
+
+def wait_for_run(client, run):
+    """Wait for a started actor run to finish and return its final state"""
+    finished = retry_request(lambda: client.run(run["id"]).wait_for_finish(), f"Waiting for run {run['id']}")
+    if finished is None:
+        raise RuntimeError(f"Actor run {run['id']} not found")
+    return finished
+
+def iter_dataset_items(client, dataset_id):
+    """Yield every item of a dataset, one page of LIMIT_CONFIG["DATASET_PAGE_SIZE"] at a time"""
+    dataset = client.dataset(dataset_id)
+    page_size = LIMIT_CONFIG["DATASET_PAGE_SIZE"]
+    offset = 0
+    while True:
+        page = retry_request(lambda: dataset.list_items(offset=offset, limit=page_size),
+                             f"Reading dataset {dataset_id}")
+        yield from page.items
+        offset += len(page.items)
+        if len(page.items) < page_size:
+            return
+
+def call_actor(client, actor_id, run_input):
+    """
+    Start an actor run and wait for it, within the shared rate and concurrency limits
+
+    Every start attempt takes a token from the bucket and a run slot from the
+    adaptive limiter, and the slot is held until the run finishes. 429, 5xx and
+    network errors are retried with jittered exponential backoff; other errors,
+    or running out of retries, raise. Only the start is retried as a whole, so a
+    failed status poll never launches a second run.
+    """
+    bucket, limiter = get_limits()
+    retries = LIMIT_CONFIG["MAX_RETRIES"]
+
+    for attempt in range(retries + 1):
+        bucket.acquire()
+        limiter.acquire()
+        start = time.perf_counter()
+        try:
+            run = client.actor(actor_id).start(run_input=run_input)
+        except Exception as e:
+            limiter.release()
+            retryable = is_retryable(e)
+            limiter.record(throttled=retryable)
+            if not retryable or attempt == retries:
+                metrics.incr("actor_failures_total", actor=actor_id)
+                raise
+            metrics.incr("actor_retries_total", actor=actor_id)
+            delay = backoff_delay(attempt)
+            print(f"Apify call to {actor_id} failed ({status_code(e) or type(e).__name__}), "
+                  f"retry {attempt + 1}/{retries} in {delay:.1f}s")
+        else:
+            limiter.record(throttled=False)
+            try:
+                run = wait_for_run(client, run)
+            except Exception:
+                metrics.incr("actor_failures_total", actor=actor_id)
+                raise
+            finally:
+                limiter.release()
+            metrics.observe("actor_run_seconds", time.perf_counter() - start, actor=actor_id)
+            metrics.incr("actor_runs_total", actor=actor_id, status=(run or {}).get("status", "UNKNOWN"))
+            return run
+        time.sleep(delay)
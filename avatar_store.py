@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from downloader import get_session
+from metrics import metrics
+
+# Map content type to extension
+EXTENSION_MAP = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/webp': '.webp',
+    'image/gif': '.gif'
+}
+
+class AvatarStore:
+    """
+    Content-addressed avatar store shared by all restaurants
+
+    Every avatar is stored once as <root>/<sha1[:2]>/<sha1><ext>. An index file maps
+    each avatar URL to its stored file, and is held in memory, so an avatar seen on
+    any earlier video is never fetched again and no directory has to be globbed per
+    comment. A commenter who changes their avatar gets a new URL, which is fetched.
+    """
+
+    def __init__(self, root, max_retries=3, timeout=10):
+        self.root = str(root)
+        self.index_path = os.path.join(self.root, "index.json")
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.index = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(self.root, exist_ok=True)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            # Drop entries whose file has been removed from disk, and the username
+            # keys of older indexes
+            self.index = {
+                avatar_url: rel_path for avatar_url, rel_path in index.items()
+                if avatar_url.startswith(('http://', 'https://'))
+                and os.path.exists(os.path.join(self.root, rel_path))
+            }
+        print(f"Avatar store {self.root}: {len(self.index)} avatars on disk")
+
+    def lookup(self, avatar_url):
+        """Return the stored path of an avatar URL, or None"""
+        rel_path = self.index.get(avatar_url)
+        return os.path.join(self.root, rel_path) if rel_path else None
+
+    def _download(self, avatar_url, username):
+        """Download one avatar and store it under its content hash"""
+        response = get_session().get(avatar_url, timeout=self.timeout)
+        response.raise_for_status()
+
+        content_type = response.headers.get('content-type', '').split(';')[0].strip().lower()
+        if 'image' not in content_type:
+            print(f"  Invalid content type for {username}: {content_type}")
+            return None
+
+        content = response.content
+        metrics.incr("download_bytes_total", len(content), kind="avatar")
+        digest = hashlib.sha1(content).hexdigest()
+        rel_path = os.path.join(digest[:2], digest + EXTENSION_MAP.get(content_type, '.jpg'))
+        save_path = os.path.join(self.root, rel_path)
+
+        # Identical images from different commenters are written once
+        if not os.path.exists(save_path):
+            os.makedirs(os.path.dirname(save_path), exist_ok=True)
+            tmp_path = f"{save_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, save_path)
+
+        with self._lock:
+            self.index[avatar_url] = rel_path
+        return save_path
+
+    def fetch(self, avatar_url, username):
+        """Return the local avatar for a commenter, downloading it if it is not stored yet"""
+        existing = self.lookup(avatar_url)
+        if existing:
+            return existing
+
+        # Basic URL validation
+        if not avatar_url or not avatar_url.startswith(('http://', 'https://')):
+            print(f"  Invalid avatar URL for {username}")
+            return None
+
+        for retry in range(self.max_retries):
+            try:
+                return self._download(avatar_url, username)
+            except requests.exceptions.Timeout:
+                print(f"  Timeout downloading avatar for {username}")
+            except requests.exceptions.RequestException as e:
+                print(f"  Network error downloading avatar for {username}: {str(e)}")
+            except Exception as e:
+                print(f"  Error downloading avatar for {username}: {str(e)}")
+            print(f"  Retry {retry + 1}/{self.max_retries} for {username}")
+        return None
+
+    def fetch_many(self, avatars, max_workers=8):
+        """
+        Fetch avatars for many commenters concurrently
+
+        avatars is an iterable of (username, avatar_url). Each avatar URL is fetched
+        at most once. Returns a dict of avatar_url -> local path (or None).
+        """
+        results = {}
+        to_fetch = {}
+        for username, avatar_url in avatars:
+            if not avatar_url or avatar_url in results or avatar_url in to_fetch:
+                continue
+            existing = self.lookup(avatar_url)
+            if existing:
+                results[avatar_url] = existing
+            else:
+                to_fetch[avatar_url] = username
+
+        metrics.incr("avatar_cache_hits_total", len(results))
+        if to_fetch:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    executor.submit(self.fetch, avatar_url, username): avatar_url
+                    for avatar_url, username in to_fetch.items()
+                }
+                for future in as_completed(futures):
+                    results[futures[future]] = future.result()
+            fetched = sum(1 for u in to_fetch if results.get(u))
+            metrics.observe("avatar_fetch_seconds", time.perf_counter() - start)
+            metrics.incr("avatars_fetched_total", fetched)
+            metrics.incr("avatar_failures_total", len(to_fetch) - fetched)
+            print(f"  Fetched {fetched}/{len(to_fetch)} new avatars, "
+                  f"{len(results) - len(to_fetch)} already stored")
+            self.save()
+
+        return results
+
+    def save(self):
+        """Write the URL index to disk atomically"""
+        # The lock is held until the file is replaced, so concurrent saves never
+        # share the temporary file
+        with self._lock:
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.index, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
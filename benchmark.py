@@ -0,0 +1,317 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import apify_cache
+import apify_limiter
+import datastore
+import fake_apify
+from metrics import metrics
+
+# Benchmark configuration; sizes can be overridden on the command line
+BENCH_CONFIG = {
+    "RESTAURANTS": 10,          # Restaurants searched (one search actor run each)
+    "VIDEOS_PER_SEARCH": 10,    # Videos returned per search
+    "MEDIA_FILES": 2,           # Restaurant files run through process_json_file
+    "COMMENT_VIDEOS": 10,       # Videos whose comments are extracted
+    "MAX_COMMENTS": 50,         # Comments returned per video
+    "RESULTS_DIR": "./bench_results",  # Results are saved here as bench_<timestamp>.json
+    "STARTUP_REPEATS": 5,       # Runs per command when timing startup
+    # Sizes used by --smoke: just enough for every stage to run once end to end
+    "SMOKE_SIZES": {"restaurants": 1, "videos": 2, "media_files": 1, "comment_videos": 1, "max_comments": 5},
+}
+
+# Commands whose startup time is measured with --startup: the CLI entry point and
+# the scripts it replaces, all stopping right after argument parsing
+STARTUP_COMMANDS = [
+    ["cli.py", "--help"],
+    ["cli.py", "search", "--help"],
+    ["cli.py", "merge", "--help"],
+    ["cli.py", "media", "--help"],
+    ["cli.py", "comments", "--help"],
+    ["cli.py", "run-all", "--help"],
+    ["extract_cmt4.py", "--help"],
+    ["pipeline.py", "--help"],
+]
+
+# Stages in the order they run; later stages use the files produced by earlier ones
+STAGES = ["search_tiktok_videos", "task1_update_json", "process_json_file", "extract_tiktok_comments"]
+
+def bench_stage(results, name, items, fn):
+    """Run fn once, recording its wall time, item count and the actor/download metrics it produced"""
+    metrics.drain()
+    print(f"\n----- benchmark: {name} ({items} items) -----")
+    start = time.perf_counter()
+    output = fn()
+    seconds = time.perf_counter() - start
+    counters, _ = metrics.drain()
+
+    def total(metric, **labels):
+        return sum(
+            value for (key, key_labels), value in counters.items()
+            if key == metric and all(dict(key_labels).get(k) == v for k, v in labels.items())
+        )
+
+    results[name] = {
+        "items": items,
+        "seconds": seconds,
+        "ms_per_item": seconds * 1000 / items if items else None,
+        "items_per_second": items / seconds if seconds else None,
+        "actor_runs": total("actor_runs_total"),
+        "download_mb": total("download_bytes_total") / 1048576,
+        "failures": sum(value for (key, _), value in counters.items() if key.endswith("_failures_total")),
+    }
+    return output
+
+def smoke_problems(results):
+    """Reasons the smoke run failed: a stage that did not run, failed or (if it uses Apify) made no actor run"""
+    problems = []
+    for name in STAGES:
+        result = results.get(name)
+        if result is None:
+            problems.append(f"{name} did not run")
+            continue
+        if result["failures"]:
+            problems.append(f"{name} recorded {result['failures']:g} failures")
+        if name != "task1_update_json" and not result["actor_runs"]:
+            problems.append(f"{name} made no actor run")
+    return problems
+
+def write_district_inputs(videos_by_restaurant, json_path, excel_path):
+    """Write the district JSON and the filled-in *_v2.xlsx that task1_update_json merges"""
+    from excel_writer import write_excel_rows
+
+    videos = [video for group in videos_by_restaurant.values() for video in group]
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(videos, f, ensure_ascii=False, indent=4)
+
+    rows = (
+        [video.get("usn_time"), video.get("postPage"), eat_name, f"{n} Bench Street", "08:00 - 22:00", "Menu"]
+        for eat_name, group in videos_by_restaurant.items()
+        for n, video in enumerate(group, 1)
+    )
+    write_excel_rows(excel_path, ["usn_time", "postPage", "eat_name", "eat_addr", "open_time", "menu"],
+                     rows, sheet_title="Restaurants")
+    return len(videos)
+
+def run_benchmarks(args):
+    """Run every stage against the local servers and return the results dict"""
+    # Imported here so the stage modules see the redirected API and datastore
+    import upd_orig_json_get_all_quanan2 as search_stage
+    import get_img_vid_each_quanan3 as media_stage
+    import extract_cmt4 as comments_stage
+
+    results = {}
+
+    # search_tiktok_videos: one actor run per restaurant, SEARCH_CONCURRENCY at a time
+    names = [f"Quán Bench {n}" for n in range(1, args.restaurants + 1)]
+    with ThreadPoolExecutor(max_workers=search_stage.CONFIG["SEARCH_CONCURRENCY"]) as executor:
+        searches = bench_stage(results, "search_tiktok_videos", len(names), lambda: list(executor.map(
+            lambda name: search_stage.search_tiktok_videos(name, args.videos), names)))
+    videos_by_restaurant = dict(zip(names, searches))
+
+    os.makedirs(search_stage.CONFIG["OUTPUT_DIR"], exist_ok=True)
+    restaurant_files = [
+        search_stage.save_restaurant_videos(name, videos, search_stage.CONFIG["OUTPUT_DIR"])
+        for name, videos in videos_by_restaurant.items()
+    ]
+
+    # task1_update_json: Excel ingest plus the district JSON merge
+    search_stage.CONFIG["INPUT_JSON_PATH"] = "district.json"
+    search_stage.CONFIG["INPUT_EXCEL_PATH"] = "district_v2.xlsx"
+    video_count = write_district_inputs(videos_by_restaurant, "district.json", "district_v2.xlsx")
+    bench_stage(results, "task1_update_json", video_count, search_stage.task1_update_json)
+
+    # process_json_file: media actor, downloads, frame extraction, dedup and re-encoding
+    media_files = restaurant_files[:args.media_files]
+    media_items = sum(len(videos_by_restaurant[name]) for name in names[:args.media_files])
+    bench_stage(results, "process_json_file", media_items, lambda: [
+        media_stage.process_json_file(media_stage.CONFIG["API_KEY"], json_file) for json_file in media_files
+    ])
+
+    # extract_tiktok_comments: comments actor, streaming top-N, avatars and Excel output
+    post_pages = [video["postPage"] for group in searches for video in group][:args.comment_videos]
+    os.makedirs("comments", exist_ok=True)
+    bench_stage(results, "extract_tiktok_comments", len(post_pages), lambda: [
+        comments_stage.extract_tiktok_comments(
+            comments_stage.CONFIG["API_KEY"], url,
+            max_items=args.max_comments,
+            top_comments=comments_stage.CONFIG["TOP_COMMENTS"],
+            output_file=os.path.join("comments", f"comments_{n}.xlsx"),
+            avatar_dir="avatars",
+            usn_time=f"bench_{n}"
+        )
+        for n, url in enumerate(post_pages, 1)
+    ])
+    return results
+
+def startup_times(commands, repeats):
+    """Wall time of starting each command in a fresh interpreter: {command: {"median_ms", "min_ms"}}"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for command in commands:
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run([sys.executable] + command, cwd=root, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, check=False)
+            samples.append((time.perf_counter() - start) * 1000)
+        results[" ".join(command)] = {"median_ms": statistics.median(samples), "min_ms": min(samples)}
+    return results
+
+def format_startup_table(results, previous=None):
+    """Render startup times, with the change against previous when given"""
+    width = max(len(name) for name in results) + 2
+    header = f"{'command':<{width}}{'median ms':>11}{'min ms':>9}"
+    if previous:
+        header += f"{'prev ms':>10}{'change':>9}"
+    lines = [header, "-" * len(header)]
+    for name, result in results.items():
+        line = f"{name:<{width}}{result['median_ms']:>11.0f}{result['min_ms']:>9.0f}"
+        if previous:
+            before = previous.get(name, {}).get("median_ms")
+            if before:
+                line += f"{before:>10.0f}{(result['median_ms'] - before) / before:>+9.1%}"
+            else:
+                line += f"{'-':>10}{'-':>9}"
+        lines.append(line)
+    return "\n".join(lines)
+
+def format_table(results, previous=None):
+    """Render the results as a fixed-width table, with the change against previous when given"""
+    header = f"{'stage':<26}{'items':>7}{'seconds':>10}{'ms/item':>10}{'items/s':>10}{'runs':>7}{'MB':>9}"
+    if previous:
+        header += f"{'prev s':>10}{'change':>9}"
+    lines = [header, "-" * len(header)]
+    for name in STAGES:
+        result = results.get(name)
+        if result is None:
+            continue
+        line = (f"{name:<26}{result['items']:>7}{result['seconds']:>10.2f}"
+                f"{result['ms_per_item'] or 0:>10.1f}{result['items_per_second'] or 0:>10.2f}"
+                f"{result['actor_runs']:>7}{result['download_mb']:>9.1f}")
+        if previous:
+            before = previous.get(name, {}).get("seconds")
+            if before:
+                line += f"{before:>10.2f}{(result['seconds'] - before) / before:>+9.1%}"
+            else:
+                line += f"{'-':>10}{'-':>9}"
+        lines.append(line)
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline stages offline against a fake Apify API and a synthetic media server")
+    parser.add_argument("--mode", choices=["synthetic", "record", "replay"], default="synthetic",
+                        help="Synthetic actor data, record real responses (needs APIFY_TOKEN) or replay recordings")
+    parser.add_argument("--fixtures", default=os.path.abspath(fake_apify.FAKE_APIFY_CONFIG["FIXTURES_DIR"]),
+                        help="Folder of recorded actor responses")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds each fake actor run takes")
+    parser.add_argument("--restaurants", type=int, default=BENCH_CONFIG["RESTAURANTS"])
+    parser.add_argument("--videos", type=int, default=BENCH_CONFIG["VIDEOS_PER_SEARCH"])
+    parser.add_argument("--media-files", type=int, default=BENCH_CONFIG["MEDIA_FILES"])
+    parser.add_argument("--comment-videos", type=int, default=BENCH_CONFIG["COMMENT_VIDEOS"])
+    parser.add_argument("--max-comments", type=int, default=BENCH_CONFIG["MAX_COMMENTS"])
+    parser.add_argument("--real-limits", action="store_true",
+                        help="Keep the Apify rate limits instead of lifting them for the fake API")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    parser.add_argument("--output", help="Results JSON (default: RESULTS_DIR/bench_<timestamp>.json)")
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark workspace")
+    parser.add_argument("--startup", action="store_true",
+                        help="Only measure how long the CLI and the stage scripts take to start")
+    parser.add_argument("--repeats", type=int, default=BENCH_CONFIG["STARTUP_REPEATS"],
+                        help="Runs per command with --startup")
+    parser.add_argument("--smoke", action="store_true",
+                        help="Run every stage once at BENCH_CONFIG[\"SMOKE_SIZES\"] and exit non-zero if any stage "
+                             "failed; checks the stages still work against the installed apify-client")
+    args = parser.parse_args(argv)
+    if args.smoke:
+        for key, value in BENCH_CONFIG["SMOKE_SIZES"].items():
+            setattr(args, key, value)
+
+    output = os.path.abspath(args.output or os.path.join(
+        BENCH_CONFIG["RESULTS_DIR"],
+        f"{'startup' if args.startup else 'bench'}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"))
+    previous = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)["startup" if args.startup else "stages"]
+
+    if args.startup:
+        results = startup_times(STARTUP_COMMANDS, args.repeats)
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump({"started": datetime.now().isoformat(timespec='seconds'), "startup": results},
+                      f, ensure_ascii=False, indent=4)
+        print("===== STARTUP TIMES =====")
+        print(format_startup_table(results, previous))
+        print(f"\nResults saved to {output}")
+        return 0
+
+    try:
+        client_version = fake_apify.check_client_version()
+    except RuntimeError as e:
+        parser.error(str(e))
+
+    # Renders the synthetic videos with OpenCV, so it is only loaded for stage benchmarks
+    import media_server
+
+    original_cwd = os.getcwd()
+    workspace = tempfile.mkdtemp(prefix="bench_workspace_")
+    media = media_server.start_server(workdir=os.path.join(workspace, "_media_server"))
+    apify = fake_apify.start_server(mode=args.mode, fixtures_dir=args.fixtures,
+                                    run_latency=args.latency, media_base_url=media.url)
+    print(f"Fake Apify API on {apify.url} ({args.mode}, apify-client {client_version}), "
+          f"media server on {media.url}, workspace {workspace}")
+
+    # Every relative path the stages use (caches, outputs, datastore) now lands in the workspace
+    os.chdir(workspace)
+    apify_limiter.LIMIT_CONFIG["API_URL"] = apify.url
+    apify_cache.CACHE_CONFIG["BYPASS"] = True
+    datastore.DATASTORE_CONFIG["PATH"] = os.path.join(workspace, "pipeline.db")
+    if not args.real_limits:
+        apify_limiter.LIMIT_CONFIG["RATE_PER_SEC"] = 1000.0
+        apify_limiter.LIMIT_CONFIG["BURST"] = 1000
+
+    try:
+        results = run_benchmarks(args)
+    finally:
+        os.chdir(original_cwd)
+        apify.shutdown()
+        media.shutdown()
+        media.close()
+        if not args.keep:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            "started": datetime.now().isoformat(timespec='seconds'),
+            "mode": args.mode,
+            "parameters": {key: value for key, value in vars(args).items() if key not in ("compare", "output")},
+            "stages": results,
+        }, f, ensure_ascii=False, indent=4)
+
+    print("\n===== BENCHMARK RESULTS =====")
+    print(format_table(results, previous))
+    print(f"\nResults saved to {output}")
+
+    if args.smoke:
+        problems = smoke_problems(results)
+        for problem in problems:
+            print(f"SMOKE FAILED: {problem}")
+        if problems:
+            return 1
+        print("Smoke run passed")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
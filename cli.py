@@ -0,0 +1,247 @@
+import argparse
+import importlib
+import json
+import os
+import sys
+
+# Only the standard library is imported up front: every stage module (and with it
+# cv2, openpyxl, requests or apify_client) is imported by the subcommand that runs it,
+# so `--help` and light subcommands start without loading the heavy dependencies.
+
+# Config dicts that --set and --config can override: section -> (module, dict name)
+CONFIG_SECTIONS = {
+    "district": ("get_quanngon_orig1", "CONFIG"),
+    "search": ("upd_orig_json_get_all_quanan2", "CONFIG"),
+    "media": ("get_img_vid_each_quanan3", "CONFIG"),
+    "comments": ("extract_cmt4", "CONFIG"),
+    "pipeline": ("pipeline", "PIPELINE_CONFIG"),
+    "limits": ("apify_limiter", "LIMIT_CONFIG"),
+    "cache": ("apify_cache", "CACHE_CONFIG"),
+    "download": ("downloader", "DOWNLOAD_CONFIG"),
+    "excel": ("excel_reader", "EXCEL_CACHE_CONFIG"),
+    "store": ("datastore", "DATASTORE_CONFIG"),
+    "metrics": ("metrics", "METRICS_CONFIG"),
+    "records": ("records", "RECORDS_CONFIG"),
+}
+
+def parse_value(text):
+    """JSON value of a setting (numbers, booleans, lists, null), or the raw string"""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+def parse_setting(text):
+    """Split [section.]KEY=VALUE into (section or None, KEY, value)"""
+    name, sep, value = text.partition('=')
+    if not sep or not name:
+        raise ValueError(f"Expected [section.]KEY=VALUE, got '{text}'")
+    section, _, key = name.rpartition('.')
+    return section or None, key, parse_value(value)
+
+def load_config_file(path):
+    """Settings from a JSON file of {section: {KEY: value}}"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return [(section, key, value) for section, values in data.items() for key, value in values.items()]
+
+def apply_settings(settings, default_section):
+    """
+    Write settings into the module config dicts
+
+    Settings without a section go to default_section. Only the modules of the
+    sections named are imported, and unknown sections or keys raise ValueError so
+    typos are not silently ignored.
+    """
+    for section, key, value in settings:
+        section = section or default_section
+        if section not in CONFIG_SECTIONS:
+            raise ValueError(f"Unknown config section '{section}' (choose from {', '.join(CONFIG_SECTIONS)})")
+        module_name, attribute = CONFIG_SECTIONS[section]
+        config = getattr(importlib.import_module(module_name), attribute)
+        if key not in config:
+            raise ValueError(f"Unknown setting {section}.{key}")
+        config[key] = value
+
+def cmd_search(args):
+    """District keyword search, or the per-restaurant search of a merged JSON with --restaurants"""
+    if args.restaurants:
+        import upd_orig_json_get_all_quanan2 as search_stage
+        if args.max_items:
+            search_stage.CONFIG["MAX_ITEMS"] = args.max_items
+        if args.no_cache:
+            search_stage.CONFIG["BYPASS_CACHE"] = True
+        return search_stage.task2_search_tiktok(args.restaurants)
+
+    import get_quanngon_orig1 as district_search
+    if args.batch or args.districts:
+        districts = None
+        if args.districts:
+            # CODE=NAME, or a CODE whose name is looked up in district.DISTRICTS
+            districts = {}
+            for spec in args.districts:
+                code, _, name = spec.partition('=')
+                districts[code] = name or district_search.CONFIG["DISTRICTS"].get(code, code)
+        if args.project:
+            district_search.CONFIG["PROJECT_FOLDER"] = args.project
+        if args.no_cache:
+            district_search.CONFIG["BYPASS_CACHE"] = True
+        saved, failed = district_search.search_districts(districts, args.keywords, args.max_items, args.concurrency)
+        return bool(saved) and not failed
+
+    if args.keywords:
+        district_search.CONFIG["SEARCH_KEYWORDS"] = args.keywords
+    if args.district:
+        district_search.CONFIG["PROJECT_DIST"] = args.district
+    if args.project:
+        district_search.CONFIG["PROJECT_FOLDER"] = args.project
+    if args.max_items:
+        district_search.CONFIG["MAX_ITEMS"] = args.max_items
+    if args.no_cache:
+        district_search.CONFIG["BYPASS_CACHE"] = True
+    district_search.main()
+
+def cmd_merge(args):
+    """Merge the filled-in Excel details into the district JSON (Task 1)"""
+    import upd_orig_json_get_all_quanan2 as search_stage
+    if args.json:
+        search_stage.CONFIG["INPUT_JSON_PATH"] = args.json
+    if args.excel:
+        search_stage.CONFIG["INPUT_EXCEL_PATH"] = args.excel
+    return search_stage.task1_update_json() is not None
+
+def cmd_media(args):
+    """Download media and extract frames for one JSON file or every JSON file in a folder"""
+    import get_img_vid_each_quanan3 as media_stage
+    from metrics import metrics
+    if args.output:
+        media_stage.CONFIG["OUTPUT_BASE_FOLDER"] = args.output
+    if args.no_cache:
+        media_stage.CONFIG["BYPASS_CACHE"] = True
+    path = args.path or media_stage.CONFIG["INPUT_FOLDER"]
+
+    with metrics.timed("stage_seconds", stage="media"):
+        if os.path.isfile(path):
+            return media_stage.process_json_file(media_stage.CONFIG["API_KEY"], path) is not None
+        return media_stage.batch_process_json_files(path)
+
+def cmd_comments(args):
+    """Extract comments for one processed JSON file or every processed file under a folder"""
+    import extract_cmt4 as comments_stage
+    from metrics import metrics
+    config = comments_stage.CONFIG
+    if args.max_comments:
+        config["MAX_COMMENTS"] = args.max_comments
+    if args.top_comments:
+        config["TOP_COMMENTS"] = args.top_comments
+    if args.incremental:
+        config["INCREMENTAL"] = True
+    if args.no_cache:
+        config["BYPASS_CACHE"] = True
+    path = args.path or config["OUTPUT_BASE_FOLDER"]
+
+    with metrics.timed("stage_seconds", stage="comments"):
+        if os.path.isfile(path):
+            return comments_stage.process_json_file(path, config["API_KEY"], config["MAX_COMMENTS"],
+                                                    config["TOP_COMMENTS"])
+        elif os.path.isdir(path):
+            return comments_stage.process_folder_structure(path)
+        else:
+            print(f"ERROR: {path} is neither a JSON file nor a folder")
+            return False
+
+def cmd_run_all(args):
+    """Merge, search, media and comments streamed through the pipeline runner"""
+    import pipeline
+    if args.json:
+        pipeline.search_stage.CONFIG["INPUT_JSON_PATH"] = args.json
+    if args.excel:
+        pipeline.search_stage.CONFIG["INPUT_EXCEL_PATH"] = args.excel
+    stages = pipeline.run_pipeline(pipeline.restaurant_source(), pipeline.build_stages(),
+                                   queue_size=pipeline.PIPELINE_CONFIG["QUEUE_SIZE"])
+    return not any(stage.failed for stage in stages)
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="cli.py",
+        description="TikTok restaurant pipeline: search, merge, media, comments or everything at once")
+    parser.add_argument("--set", dest="settings", action="append", default=[], metavar="[SECTION.]KEY=VALUE",
+                        help="Override a config value (JSON-parsed, e.g. --set limits.RATE_PER_SEC=1 or "
+                             "--set MAX_ITEMS=20 for the command's own config). Repeatable. "
+                             f"Sections: {', '.join(CONFIG_SECTIONS)}")
+    parser.add_argument("--config", help="JSON file of {section: {KEY: value}} overrides, applied before --set")
+    parser.add_argument("--format", choices=["json", "jsonl"],
+                        help="Output format of the JSON record files (default: records.FORMAT)")
+    parser.add_argument("--no-report", action="store_true", help="Do not write a run report")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+
+    search = commands.add_parser("search", help="Search TikTok by district keywords (or per restaurant)")
+    search.add_argument("--keywords", nargs="+",
+                        help="Search keywords (default: district.SEARCH_KEYWORDS); with --batch, keyword templates "
+                             "where {district} is replaced by each district name (default: district.KEYWORD_TEMPLATES)")
+    search.add_argument("--district", help="District folder name, e.g. q10 (default: district.PROJECT_DIST)")
+    search.add_argument("--batch", action="store_true",
+                        help="Search every keyword x district combination in parallel, one output per district")
+    search.add_argument("--districts", nargs="+", metavar="CODE[=NAME]",
+                        help="Districts of a batch search, e.g. q5 q10 'q11=quận 11' (implies --batch; "
+                             "default: district.DISTRICTS)")
+    search.add_argument("--concurrency", type=int, help="Batch shards in flight (default: district.BATCH_CONCURRENCY)")
+    search.add_argument("--project", help="Project folder (default: district.PROJECT_FOLDER)")
+    search.add_argument("--restaurants", metavar="UPD_JSON",
+                        help="Search every restaurant of a merged (_upd) JSON instead of district keywords")
+    search.add_argument("--max-items", type=int, help="Videos per search")
+    search.add_argument("--no-cache", action="store_true", help="Always call the actor instead of the cache")
+    search.set_defaults(handler=cmd_search, section="district", report="search_district")
+
+    merge = commands.add_parser("merge", help="Merge filled-in Excel details into the district JSON")
+    merge.add_argument("json", nargs="?", help="District JSON (default: search.INPUT_JSON_PATH)")
+    merge.add_argument("excel", nargs="?", help="Excel file, folder of *_v2.xlsx or glob (default: search.INPUT_EXCEL_PATH)")
+    merge.set_defaults(handler=cmd_merge, section="search", report="merge")
+
+    media = commands.add_parser("media", help="Download videos and covers and extract frames")
+    media.add_argument("path", nargs="?", help="JSON file or folder of JSON files (default: media.INPUT_FOLDER)")
+    media.add_argument("--output", help="Output base folder (default: media.OUTPUT_BASE_FOLDER)")
+    media.add_argument("--no-cache", action="store_true", help="Always call the actor instead of the cache")
+    media.set_defaults(handler=cmd_media, section="media", report="media")
+
+    comments = commands.add_parser("comments", help="Extract and rank the comments of processed videos")
+    comments.add_argument("path", nargs="?",
+                          help="Processed JSON file or folder searched for them (default: comments.OUTPUT_BASE_FOLDER)")
+    comments.add_argument("--max-comments", type=int, help="Comments extracted per video")
+    comments.add_argument("--top-comments", type=int, help="Top comments kept per video")
+    comments.add_argument("--incremental", action="store_true", help="Only fetch comments newer than the watermark")
+    comments.add_argument("--no-cache", action="store_true", help="Always call the actor instead of the cache")
+    comments.set_defaults(handler=cmd_comments, section="comments", report="comments")
+
+    run_all = commands.add_parser("run-all", help="Merge, then stream restaurants through search, media and comments")
+    run_all.add_argument("json", nargs="?", help="District JSON (default: search.INPUT_JSON_PATH)")
+    run_all.add_argument("excel", nargs="?", help="Filled-in Excel (default: search.INPUT_EXCEL_PATH)")
+    run_all.set_defaults(handler=cmd_run_all, section="pipeline", report="pipeline")
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    section = "search" if args.command == "search" and args.restaurants else args.section
+    try:
+        settings = [parse_setting(text) for text in args.settings]
+        if args.config:
+            settings = load_config_file(args.config) + settings
+        if args.format:
+            settings.append(("records", "FORMAT", args.format))
+        apply_settings(settings, section)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    try:
+        ok = args.handler(args)
+    finally:
+        if not args.no_report:
+            from metrics import metrics
+            metrics.write_report(args.report)
+    return 1 if ok is False else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
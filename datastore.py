@@ -0,0 +1,254 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Datastore configuration
+DATASTORE_CONFIG = {
+    "PATH": os.environ.get("QUANAN_DB", "./pipeline.db"),  # SQLite file shared by every stage
+}
+
+# Bumped whenever a table changes shape; see PipelineStore._migrate
+SCHEMA_VERSION = 3
+
+# Indexes of earlier versions that nothing queries any more
+DROPPED_INDEXES = (
+    "idx_videos_usn_time", "idx_videos_post_page", "idx_videos_eat_name", "idx_videos_source",
+    "idx_restaurants_eat_name", "idx_media_post_page", "idx_comments_post_page",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    video_key  TEXT NOT NULL,      -- postPage, or usn_time for entries without one
+    eat_name   TEXT NOT NULL DEFAULT '',  -- restaurant the video was found for ('' if none)
+    usn_time   TEXT,
+    postPage   TEXT,
+    source     TEXT,               -- file or search term the entry last came from
+    data       TEXT NOT NULL,      -- the full JSON entry
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (video_key, eat_name)
+);
+
+CREATE TABLE IF NOT EXISTS restaurants (
+    usn_time   TEXT PRIMARY KEY,
+    eat_name   TEXT,
+    eat_addr   TEXT,
+    open_time  TEXT,
+    menu       TEXT,
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS media (
+    usn_time   TEXT PRIMARY KEY,
+    postPage   TEXT,
+    data       TEXT NOT NULL,      -- media fields and folder paths of the item
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS comments (
+    comment_id       TEXT PRIMARY KEY,
+    usn_time         TEXT,
+    postPage         TEXT,
+    createdAt        TEXT,
+    engagement_score REAL,
+    is_top           INTEGER NOT NULL DEFAULT 0,
+    data             TEXT NOT NULL,
+    updated_at       REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_comments_usn_time ON comments (usn_time);
+"""
+
+# Restaurant columns filled from the Excel sheets
+RESTAURANT_FIELDS = ('eat_name', 'eat_addr', 'open_time', 'menu')
+
+def video_key(entry):
+    """Primary key of a video entry: its postPage, falling back to usn_time"""
+    return entry.get('postPage') or entry.get('usn_time')
+
+class PipelineStore:
+    """
+    Embedded SQLite store of videos, restaurants, media paths and comments
+
+    The JSON files stay the inputs and outputs of the stages; every stage writes
+    what it produces through to this store as well. Only the media paths are read
+    back (by the comments stage, instead of re-parsing the processed files), so the
+    store only indexes what its writes and that lookup need. A video found for
+    several restaurants is kept once per restaurant. One connection is shared by
+    all threads of a process and guarded by a lock; WAL mode lets separate
+    processes read while another writes.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        with self._lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self._migrate()
+            self.conn.executescript(SCHEMA)
+            self.conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def _migrate(self):
+        """Bring a store written by an older version up to SCHEMA_VERSION (caller holds the lock)"""
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 2:
+            # Videos used to be keyed by postPage alone; the table only mirrors the
+            # JSON files, so it is rebuilt as the stages write them again
+            self.conn.execute("DROP TABLE IF EXISTS videos")
+        if version < 3:
+            for index in DROPPED_INDEXES:
+                self.conn.execute(f"DROP INDEX IF EXISTS {index}")
+
+    def _write(self, sql, rows):
+        """Run one statement for many rows in a single transaction"""
+        with self._lock, self.conn:
+            self.conn.executemany(sql, rows)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    # ---------------------------------------------------------------- videos
+
+    def _stored(self, table, column, keys):
+        """Return key -> stored JSON data for the given primary keys (caller holds the lock)"""
+        stored = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ", ".join("?" * len(chunk))
+            for row in self.conn.execute(
+                    f"SELECT {column}, data FROM {table} WHERE {column} IN ({placeholders})", chunk):
+                stored[row[0]] = json.loads(row[1])
+        return stored
+
+    def _stored_videos(self, keys):
+        """Return (video_key, eat_name) -> stored JSON data for the given keys (caller holds the lock)"""
+        stored = {}
+        video_keys = list(dict.fromkeys(key for key, _ in keys))
+        for start in range(0, len(video_keys), 500):
+            chunk = video_keys[start:start + 500]
+            placeholders = ", ".join("?" * len(chunk))
+            for row in self.conn.execute(
+                    f"SELECT video_key, eat_name, data FROM videos WHERE video_key IN ({placeholders})", chunk):
+                stored[(row[0], row[1])] = json.loads(row[2])
+        return stored
+
+    def upsert_videos(self, entries, source=None):
+        """
+        Insert or update video entries, merging new fields into stored ones
+
+        Entries are keyed by (postPage, eat_name), so the same video found for two
+        restaurants is stored twice; entries without an eat_name share the '' row.
+        """
+        entries = {
+            (video_key(entry), entry.get('eat_name') or ''): entry
+            for entry in entries if video_key(entry)
+        }
+        now = time.time()
+        with self._lock, self.conn:
+            stored = self._stored_videos(list(entries))
+            rows = []
+            for (key, eat_name), entry in entries.items():
+                data = {**stored.get((key, eat_name), {}), **entry}
+                rows.append((key, eat_name, data.get('usn_time'), data.get('postPage'),
+                             source, json.dumps(data, ensure_ascii=False), now))
+            self.conn.executemany(
+                """INSERT INTO videos (video_key, eat_name, usn_time, postPage, source, data, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (video_key, eat_name) DO UPDATE SET
+                       usn_time = excluded.usn_time,
+                       postPage = excluded.postPage,
+                       source = COALESCE(excluded.source, videos.source),
+                       data = excluded.data,
+                       updated_at = excluded.updated_at""",
+                rows
+            )
+        return len(rows)
+
+    # ----------------------------------------------------------- restaurants
+
+    def upsert_restaurants(self, restaurant_data):
+        """Store a usn_time -> restaurant details dict as read from Excel"""
+        now = time.time()
+        rows = [
+            (str(usn_time),) + tuple(details.get(field) for field in RESTAURANT_FIELDS) + (now,)
+            for usn_time, details in restaurant_data.items()
+        ]
+        self._write(
+            """INSERT OR REPLACE INTO restaurants (usn_time, eat_name, eat_addr, open_time, menu, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            rows
+        )
+        return len(rows)
+
+    # ----------------------------------------------------------------- media
+
+    def upsert_media(self, usn_time, post_page, fields):
+        """Record the media paths of one item, merged into what is already stored"""
+        with self._lock, self.conn:
+            data = {**self._stored('media', 'usn_time', [usn_time]).get(usn_time, {}), **fields}
+            self.conn.execute(
+                """INSERT INTO media (usn_time, postPage, data, updated_at) VALUES (?, ?, ?, ?)
+                   ON CONFLICT (usn_time) DO UPDATE SET
+                       postPage = COALESCE(excluded.postPage, media.postPage),
+                       data = excluded.data,
+                       updated_at = excluded.updated_at""",
+                (usn_time, post_page, json.dumps(data, ensure_ascii=False), time.time())
+            )
+
+    def get_media(self, usn_time):
+        """Return the stored media fields of an item, or None"""
+        rows = self._query("SELECT data FROM media WHERE usn_time = ?", (usn_time,))
+        return json.loads(rows[0]['data']) if rows else None
+
+    # -------------------------------------------------------------- comments
+
+    def upsert_comments(self, usn_time, post_page, comments, top_ids=()):
+        """
+        Store comments of one video
+
+        Each comment is a (comment_id, comment dict) pair. Comments whose id is
+        in top_ids are flagged as part of the video's top list.
+        """
+        now = time.time()
+        top_ids = set(top_ids)
+        rows = [
+            (comment_id, usn_time, post_page, comment.get('createdAt'), comment.get('engagement_score'),
+             int(comment_id in top_ids), json.dumps(comment, ensure_ascii=False), now)
+            for comment_id, comment in comments
+        ]
+        self._write(
+            """INSERT OR REPLACE INTO comments
+                   (comment_id, usn_time, postPage, createdAt, engagement_score, is_top, data, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+            rows
+        )
+        return len(rows)
+
+    def set_top_comments(self, usn_time, top_ids):
+        """Flag exactly top_ids as the top comments of a video"""
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE comments SET is_top = 0 WHERE usn_time = ? AND is_top = 1", (usn_time,))
+            self.conn.executemany("UPDATE comments SET is_top = 1 WHERE comment_id = ?",
+                                  [(comment_id,) for comment_id in top_ids])
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+# Store shared by every stage of the process
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """Return the process-wide datastore, opening DATASTORE_CONFIG["PATH"] on first use"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = PipelineStore(DATASTORE_CONFIG["PATH"])
+    return _store
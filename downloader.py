@@ -0,0 +1,123 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import metrics
+
+# Downloader configuration
+DOWNLOAD_CONFIG = {
+    "MAX_WORKERS": 8,               # Files downloaded at the same time
+    "POOL_SIZE": 16,                # Keep-alive connections per host in the shared session
+    "CHUNK_SIZE": 1024 * 1024,      # Bytes read from the socket per write
+    "TIMEOUT": (10, 60),            # (connect, read) timeout in seconds
+    "RETRIES": 3,                   # Attempts per file, each resuming from the partial file
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Return the shared connection-pooled requests session"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=DOWNLOAD_CONFIG["POOL_SIZE"],
+                pool_maxsize=DOWNLOAD_CONFIG["POOL_SIZE"]
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+    return _session
+
+def _download_once(url, output_path, part_path, chunk_size, timeout):
+    """One download attempt into part_path, resuming from its current size"""
+    resume_from = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {'Range': f'bytes={resume_from}-'} if resume_from else {}
+
+    with get_session().get(url, stream=True, timeout=timeout, headers=headers) as response:
+        if response.status_code == 416 and resume_from:
+            # Range not satisfiable: either the part file is already complete or it is stale
+            total = response.headers.get('Content-Range', '').rpartition('/')[2]
+            if total.isdigit() and int(total) == resume_from:
+                return True
+            os.remove(part_path)
+            return False
+
+        if response.status_code == 206 and resume_from:
+            mode = 'ab'
+            print(f"Resuming download at byte {resume_from}: {output_path}")
+        elif response.status_code == 200:
+            # Server ignored the Range header, start over
+            mode = 'wb'
+        else:
+            print(f"Failed to download file. Status code: {response.status_code}")
+            return None
+
+        with open(part_path, mode) as file:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    file.write(chunk)
+                    metrics.incr("download_bytes_total", len(chunk), kind="media")
+    return True
+
+def download_file(url, output_path, chunk_size=None, timeout=None):
+    """
+    Download a URL to output_path through the shared session
+
+    Data is written to <output_path>.part and renamed into place only when complete,
+    so output_path never holds a truncated file. A partial file left by an earlier
+    failure is resumed with an HTTP Range request.
+    """
+    chunk_size = chunk_size or DOWNLOAD_CONFIG["CHUNK_SIZE"]
+    timeout = timeout or DOWNLOAD_CONFIG["TIMEOUT"]
+    part_path = f"{output_path}.part"
+
+    with metrics.timed("download_seconds"):
+        for attempt in range(DOWNLOAD_CONFIG["RETRIES"]):
+            if attempt:
+                metrics.incr("download_retries_total")
+            try:
+                result = _download_once(url, output_path, part_path, chunk_size, timeout)
+            except requests.exceptions.RequestException as e:
+                print(f"Download attempt {attempt + 1}/{DOWNLOAD_CONFIG['RETRIES']} failed for {output_path}: {e}")
+                continue
+
+            if result is None:
+                # Non-retryable HTTP status
+                metrics.incr("download_failures_total")
+                return False
+            if result:
+                os.replace(part_path, output_path)
+                print(f"Download completed: {output_path}")
+                return True
+
+    print(f"Giving up on {output_path} after {DOWNLOAD_CONFIG['RETRIES']} attempts")
+    metrics.incr("download_failures_total")
+    return False
+
+def download_many(jobs, max_workers=None):
+    """
+    Download many files in parallel through a bounded worker pool
+
+    Each job is a tuple starting with (url, output_path); any extra fields are
+    passed through untouched. Yields (job, success) as downloads complete.
+    """
+    max_workers = max_workers or DOWNLOAD_CONFIG["MAX_WORKERS"]
+    if not jobs:
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(download_file, job[0], job[1]): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                success = future.result()
+            except Exception as e:
+                print(f"Error downloading {job[1]}: {e}")
+                success = False
+            yield job, success
@@ -0,0 +1,118 @@
+import glob
+import hashlib
+import json
+import os
+from datetime import date, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Excel ingest configuration
+EXCEL_CACHE_CONFIG = {
+    "CACHE_DIR": "./.excel_cache",  # Parsed workbooks, one JSON file per (path, mtime, size, parser)
+    "PATTERN": "*_v2.xlsx",         # Workbooks picked up when a folder is given
+}
+
+def iter_excel_records(xlsx_file):
+    """
+    Stream the rows of the first sheet as dicts keyed by the header row
+
+    The workbook is opened read-only so rows are parsed lazily straight from the
+    XML instead of loading every cell into memory. Empty cells come back as None,
+    dates and times as ISO strings so records stay JSON-serialisable.
+    """
+    # Imported here: a run served entirely from the parse cache never loads openpyxl
+    import openpyxl
+    workbook = openpyxl.load_workbook(xlsx_file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        headers = next(rows, None)
+        if not headers:
+            return
+        columns = [(index, str(header).strip()) for index, header in enumerate(headers) if header is not None]
+        for values in rows:
+            record = {}
+            for index, header in columns:
+                value = values[index] if index < len(values) else None
+                if isinstance(value, (date, time)):
+                    value = value.isoformat()
+                record[header] = value
+            yield record
+    finally:
+        workbook.close()
+
+def cache_path(xlsx_file, parser):
+    """Cache file for a workbook, keyed by its path, mtime and size and the parser used"""
+    stat = os.stat(xlsx_file)
+    raw = f"{os.path.abspath(xlsx_file)}|{stat.st_mtime_ns}|{stat.st_size}|{parser.__qualname__}"
+    return os.path.join(EXCEL_CACHE_CONFIG["CACHE_DIR"], hashlib.sha1(raw.encode('utf-8')).hexdigest() + ".json")
+
+def load_cached(xlsx_file, parser):
+    """
+    Return parser(xlsx_file), reusing the cached result while the file is unchanged
+
+    parser must return JSON-serialisable data. Editing or replacing the workbook
+    changes its mtime or size and therefore its cache key.
+    """
+    path = cache_path(xlsx_file, parser)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    result = parser(xlsx_file)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return result
+
+def expand_excel_paths(spec, pattern=None):
+    """
+    Resolve a workbook spec into a sorted list of files
+
+    spec may be a file, a folder (searched for pattern, *_v2.xlsx by default),
+    a glob, or a list of any of these.
+    """
+    pattern = pattern or EXCEL_CACHE_CONFIG["PATTERN"]
+    specs = [spec] if isinstance(spec, str) else list(spec)
+
+    paths = []
+    for item in specs:
+        if os.path.isdir(item):
+            paths.extend(glob.glob(os.path.join(item, pattern)))
+        elif glob.has_magic(item):
+            paths.extend(glob.glob(item))
+        else:
+            paths.append(item)
+    # Skip Excel lock files left by open workbooks
+    return sorted(set(p for p in paths if not os.path.basename(p).startswith('~$')))
+
+def parse_excel_files(paths, parser, max_workers=None):
+    """
+    Parse many workbooks in parallel, each through the cache
+
+    Workbooks are parsed in a process pool since parsing is CPU-bound. Yields
+    (path, result or None) as files complete; errors are printed and give None.
+    """
+    if not paths:
+        return
+
+    # A single workbook is not worth starting a pool for
+    if len(paths) == 1:
+        try:
+            yield paths[0], load_cached(paths[0], parser)
+        except Exception as e:
+            print(f"Error reading Excel file {paths[0]}: {e}")
+            yield paths[0], None
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(load_cached, path, parser): path for path in paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Error reading Excel file {path}: {e}")
+                result = None
+            yield path, result
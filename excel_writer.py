@@ -0,0 +1,77 @@
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from metrics import metrics
+
+# openpyxl is imported inside the functions so that importing this module stays cheap
+
+def header_style(color):
+    """Bold, centered header cells on a solid fill of the given hex color"""
+    from openpyxl.styles import Font, Alignment, PatternFill
+    return {
+        "font": Font(bold=True),
+        "fill": PatternFill(start_color=color, end_color=color, fill_type="solid"),
+        "alignment": Alignment(horizontal="center", vertical="center"),
+    }
+
+def write_excel_rows(filename, headers, rows, sheet_title="Sheet", header_format=None,
+                     column_width=lambda length: length + 2):
+    """
+    Stream rows into a write-only workbook, sizing every column to its longest value
+
+    rows is any iterable of row value lists and is consumed exactly once. openpyxl
+    writes column widths before the first row, so rows are spooled to a temporary
+    JSONL file while the widths are measured, then streamed from it into the
+    workbook. Memory use stays constant however many rows there are.
+
+    column_width maps the longest value length in a column (header included) to
+    the column width. header_format is a dict of cell style attributes, as returned
+    by header_style(). Returns the number of data rows written.
+    """
+    import openpyxl
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter
+
+    start = time.perf_counter()
+    max_lengths = [len(str(header)) for header in headers]
+    row_count = 0
+
+    with tempfile.TemporaryFile('w+', encoding='utf-8', suffix='.jsonl') as spool:
+        for row in rows:
+            row = list(row)
+            for col, value in enumerate(row):
+                if value:
+                    max_lengths[col] = max(max_lengths[col], len(str(value)))
+            spool.write(json.dumps(row, ensure_ascii=False) + "\n")
+            row_count += 1
+        spool.seek(0)
+
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet(sheet_title)
+        for col, length in enumerate(max_lengths, 1):
+            sheet.column_dimensions[get_column_letter(col)].width = column_width(length)
+
+        header_cells = []
+        for header in headers:
+            cell = WriteOnlyCell(sheet, value=header)
+            for attribute, style in (header_format or {}).items():
+                setattr(cell, attribute, style)
+            header_cells.append(cell)
+        sheet.append(header_cells)
+
+        for line in spool:
+            sheet.append(json.loads(line))
+
+        output_path = Path(filename)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        # Save next to the target and move it into place so readers never see a partial workbook
+        tmp_path = output_path.with_name(f"{output_path.stem}.tmp{output_path.suffix}")
+        workbook.save(str(tmp_path))
+        os.replace(tmp_path, output_path)
+
+    metrics.observe("excel_write_seconds", time.perf_counter() - start)
+    metrics.incr("excel_rows_total", row_count)
+    return row_count
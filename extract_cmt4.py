@@ -1,14 +1,21 @@
-from apify_client import ApifyClient
+from apify_limiter import make_client
+from apify_cache import iterate_actor_items
+from journal import StageJournal
+from avatar_store import AvatarStore
+from excel_writer import write_excel_rows
+from datastore import get_store
+from metrics import metrics
+from records import iter_batches, load_records, record_globs
 from datetime import datetime
-import openpyxl
 import json
 import os
 import sys
-import requests
-import hashlib
 from pathlib import Path
 import glob
-from operator import itemgetter
+import hashlib
+import heapq
+import tempfile
+import threading
 
 # Configuration settings
 CONFIG = {
@@ -20,69 +27,44 @@ CONFIG = {
     "COMMENT_ACTOR_ID": "XomSRf7d0qf3mVj1y",  # TikTok comment extraction actor ID
     "REPLY_WEIGHT": 2.0,        # Weight for reply count in engagement score (higher priority)
     "LIKE_WEIGHT": 1.0,         # Weight for like count in engagement score
+    "BYPASS_CACHE": False,      # True to always call the actor instead of reusing cached runs
+    "RESUME": True,             # Skip videos whose comments are already recorded in the journal
+    "AVATAR_STORE_DIR": "./processed_data/_avatars",  # Content-addressed avatar store shared by all restaurants
+    "AVATAR_WORKERS": 8,        # Avatars downloaded in parallel
+    "INCREMENTAL": False,       # Only fetch comments newer than each video's watermark and merge them
+    "INCREMENTAL_MAX_COMMENTS": 50,  # Comments requested in the first window of an incremental refresh
+    "NEWEST_FIRST_INPUT": {"sortBy": "newest"},  # Comment actor input that returns the newest comments first
+    "STORE_BATCH_SIZE": 500,    # Comments written to the datastore per transaction
+    "SORT_RUN_SIZE": 10000,     # Comments sorted in memory at a time when ordering the _all file
 }
 
-def download_avatar(avatar_url, save_dir, username):
-    """Download avatar image from URL"""
-    try:
-        # Basic URL validation
-        if not avatar_url or not avatar_url.startswith(('http://', 'https://')):
-            print(f"  Invalid avatar URL for {username}")
-            return None
-            
-        url_hash = hashlib.md5(avatar_url.encode()).hexdigest()[:8]
-        safe_username = ''.join(c for c in username if c.isalnum())[:20]
-        
-        # Initially create path without extension
-        base_path = Path(save_dir) / f"{safe_username}_{url_hash}"
-        
-        # Check if any version of the file exists
-        existing_files = list(Path(save_dir).glob(f"{safe_username}_{url_hash}.*"))
-        if existing_files:
-            print(f"  Avatar already exists for {username}")
-            return str(existing_files[0])
-            
-        # Download with timeout
-        response = requests.get(avatar_url, stream=True, timeout=10)
-        response.raise_for_status()  # Raise exception for bad status codes
-        
-        # Get content type and determine extension
-        content_type = response.headers.get('content-type', '').lower()
-        if 'image' not in content_type:
-            print(f"  Invalid content type for {username}: {content_type}")
-            return None
-            
-        # Map content type to extension
-        extension_map = {
-            'image/jpeg': '.jpg',
-            'image/png': '.png',
-            'image/webp': '.webp',
-            'image/gif': '.gif'
-        }
-        extension = extension_map.get(content_type, '.jpg')
-        save_path = base_path.with_suffix(extension)
-        
-        # Ensure directory exists
-        save_path.parent.mkdir(parents=True, exist_ok=True)
-        
-        # Download and save the file
-        with open(save_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-                    
-        print(f"  Downloaded avatar for {username}")
-        return str(save_path)
-        
-    except requests.exceptions.Timeout:
-        print(f"  Timeout downloading avatar for {username}")
-        return None
-    except requests.exceptions.RequestException as e:
-        print(f"  Network error downloading avatar for {username}: {str(e)}")
-        return None
-    except Exception as e:
-        print(f"  Error downloading avatar for {username}: {str(e)}")
-        return None
+# Excel header -> comment field, in column order
+COMMENT_COLUMNS = {
+    "Text": "text",
+    "Created At": "createdAt",
+    "Like Count": "likeCount",
+    "Reply Count": "replyCount",
+    "Is Author Liked": "isAuthorLiked",
+    "Username": "username",
+    "Display Name": "displayName",
+    "Bio": "bio",
+    "Avatar URL": "avatarUrl",
+    "Avatar Local Path": "avatar_local_path",
+    "Engagement Score": "engagement_score",
+}
+
+# Avatar store shared by every restaurant and video processed in this run; the lock
+# keeps concurrent comment workers from opening it twice
+_avatar_store = None
+_avatar_store_lock = threading.Lock()
+
+def get_avatar_store():
+    """Open the shared content-addressed avatar store on first use"""
+    global _avatar_store
+    with _avatar_store_lock:
+        if _avatar_store is None:
+            _avatar_store = AvatarStore(CONFIG["AVATAR_STORE_DIR"])
+    return _avatar_store
 
 def calculate_engagement_score(comment):
     """
@@ -96,130 +78,367 @@ def calculate_engagement_score(comment):
     score = (reply_count * CONFIG["REPLY_WEIGHT"]) + (like_count * CONFIG["LIKE_WEIGHT"])
     return score
 
-def extract_tiktok_comments(api_key, url, max_items=80, top_comments=5, output_file=None, avatar_dir=None):
-    """Extract comments from a TikTok video and filter top comments by engagement"""
-    client = ApifyClient(api_key)
+def filter_comment(item):
+    """Keep the fields of interest of a comment actor item and score its engagement"""
+    created_at = item.get("createdAt", "")
+    formatted_date = ""
+    if created_at:
+        date_obj = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+        formatted_date = date_obj.strftime('%d-%m-%Y')
+    
+    filtered_item = {
+        "text": item.get("text"),
+        "createdAt": formatted_date,
+        "likeCount": item.get("likeCount", 0),
+        "replyCount": item.get("replyCount", 0),
+        "isAuthorLiked": item.get("isAuthorLiked")
+    }
+    
+    if "user" in item and item["user"]:
+        user_data = item["user"]
+        filtered_item["username"] = user_data.get("username")
+        filtered_item["displayName"] = user_data.get("displayName")
+        filtered_item["bio"] = user_data.get("bio")
+        filtered_item["avatarUrl"] = user_data.get("avatarUrl")
+    
+    # Calculate engagement score
+    filtered_item["engagement_score"] = calculate_engagement_score(filtered_item)
+    return filtered_item
+
+def comment_identity(item):
+    """Stable identity of a raw comment actor item, used to recognise comments already seen"""
+    for field in ("cid", "id", "commentId"):
+        if item.get(field):
+            return str(item[field])
+    user = item.get("user") or {}
+    raw = f"{user.get('username', '')}|{item.get('createdAt', '')}|{item.get('text', '')}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def watermark_path(output_file):
+    """Path of the per-video watermark file stored next to the top comments Excel"""
+    output_path = Path(output_file)
+    return output_path.with_name(f"{output_path.stem}_watermark.json")
+
+def load_watermark(path):
+    """Load a per-video watermark, or None if the video has not been scraped yet"""
+    if not path.exists():
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_watermark(path, latest_created_at, seen, top_comments_data, total_count):
+    """Save the latest createdAt, the seen comment identities and the current top list"""
+    watermark = {
+        "latest_created_at": latest_created_at,
+        "seen": sorted(seen),
+        "top": top_comments_data,
+        "total_count": total_count,
+        "updated_at": datetime.now().isoformat(timespec='seconds'),
+    }
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(watermark, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
 
+def comment_run_input(url, max_items, newest_first=False):
+    """Comment actor input for one video"""
     run_input = {
         "startUrls": [url],
         "includeReplies": True,
         "maxItems": max_items,
         "customMapFunction": "(object) => { return {...object} }",
     }
+    if newest_first:
+        run_input.update(CONFIG["NEWEST_FIRST_INPUT"])
+    return run_input
 
-    print(f"Extracting up to {max_items} comments from {url}...")
-    run = client.actor(CONFIG["COMMENT_ACTOR_ID"]).call(run_input=run_input)
+def iter_incremental_items(client, url, max_items, latest_created_at, seen):
+    """
+    Stream the comments posted after the watermark, newest first
 
-    all_comments = []
-    print("Processing comments...")
-    
-    if avatar_dir:
-        Path(avatar_dir).mkdir(parents=True, exist_ok=True)
-
-    for item in client.dataset(run["defaultDatasetId"]).iterate_items():
-        created_at = item.get("createdAt", "")
-        formatted_date = ""
-        if created_at:
-            date_obj = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-            formatted_date = date_obj.strftime('%d-%m-%Y')
-        
-        filtered_item = {
-            "text": item.get("text"),
-            "createdAt": formatted_date,
-            "likeCount": item.get("likeCount", 0),
-            "replyCount": item.get("replyCount", 0),
-            "isAuthorLiked": item.get("isAuthorLiked")
-        }
-        
-        if "user" in item and item["user"]:
-            user_data = item["user"]
-            filtered_item["username"] = user_data.get("username")
-            filtered_item["displayName"] = user_data.get("displayName")
-            filtered_item["bio"] = user_data.get("bio")
-            filtered_item["avatarUrl"] = user_data.get("avatarUrl")
-            
-            if avatar_dir and filtered_item["avatarUrl"] and filtered_item["username"]:
-                # Add retry logic for failed downloads
-                max_retries = 3
-                avatar_path = None
-                for retry in range(max_retries):
-                    avatar_path = download_avatar(
-                        filtered_item["avatarUrl"],
-                        avatar_dir,
-                        filtered_item["username"]
-                    )
-                    if avatar_path:
-                        break
-                    print(f"  Retry {retry + 1}/{max_retries} for {filtered_item['username']}")
-                filtered_item["avatar_local_path"] = avatar_path
+    A window of INCREMENTAL_MAX_COMMENTS comments is requested newest first and read
+    until the first comment at or before latest_created_at (or one already in seen).
+    When the whole window is newer than the watermark, the thread is requested again
+    with max_items so new comments past the window are not skipped.
 
-        # Calculate engagement score
-        filtered_item["engagement_score"] = calculate_engagement_score(filtered_item)
-        all_comments.append(filtered_item)
+    The actor is not trusted to honour NEWEST_FIRST_INPUT: if createdAt goes up
+    between comments, or the read stops at an older comment that is not in seen,
+    the order is not newest first and up to max_items comments are scraped in full
+    instead. Comments in seen (or already yielded) come back again and are skipped
+    by the caller.
+    """
+    window = min(max_items, CONFIG["INCREMENTAL_MAX_COMMENTS"])
+    while True:
+        items = iterate_actor_items(client, CONFIG["COMMENT_ACTOR_ID"],
+                                    comment_run_input(url, window, newest_first=True), bypass=True)
+        count = 0
+        previous_created_at = None
+        ordered = True
+        for item in items:
+            count += 1
+            created_at = item.get("createdAt") or ""
+            identity = comment_identity(item)
+            if created_at and previous_created_at and created_at > previous_created_at:
+                print(f"WARNING: comments of {url} are not newest first "
+                      f"({created_at} after {previous_created_at})")
+                ordered = False
+                break
+            if identity in seen:
+                print(f"Reached the watermark after {count - 1} comments")
+                return
+            if created_at and created_at <= latest_created_at:
+                # Newest first, the first old comment should be the latest one already seen
+                print(f"WARNING: comments of {url} reached the watermark at a comment not seen before")
+                ordered = False
+                break
+            previous_created_at = created_at or previous_created_at
+            yield item
+        if not ordered:
+            break
+        if count < window or window >= max_items:
+            return
+        print(f"All {window} comments are new, requesting up to {max_items}")
+        window = max_items
+
+    print(f"Falling back to a full scrape of up to {max_items} comments, merged against the watermark")
+    metrics.incr("comment_incremental_fallbacks_total")
+    yield from iterate_actor_items(client, CONFIG["COMMENT_ACTOR_ID"], comment_run_input(url, max_items),
+                                   bypass=True)
+
+def extract_tiktok_comments(api_key, url, max_items=80, top_comments=5, output_file=None, avatar_dir=None,
+                            incremental=False, usn_time=None):
+    """
+    Extract comments from a TikTok video and filter top comments by engagement
+
+    Comments are streamed from the dataset: only a heap of the top_comments best is
+    kept in memory, and every comment is spooled to disk for the _all file.
+    When avatar_dir is given, avatars of the top commenters are fetched concurrently
+    into the shared avatar store (CONFIG["AVATAR_STORE_DIR"]) rather than into avatar_dir.
+
+    A watermark (latest createdAt, seen comment identities, current top list) is saved
+    next to output_file. With incremental=True the newest comments are read down to the
+    watermark (see iter_incremental_items) and only comments missing from it are kept:
+    they are merged into the stored top list and into the _all file, which stays
+    ordered by engagement score.
+
+    With usn_time, every new comment is also written to the datastore under that
+    video, in batches of CONFIG["STORE_BATCH_SIZE"], and the top list is flagged there.
+    """
+    client = make_client(api_key)
+    
+    state_path = watermark_path(output_file) if output_file else None
+    state = load_watermark(state_path) if incremental and state_path else None
+    if incremental and state is None:
+        print("No watermark found for this video, doing a full scrape")
+        incremental = False
+    
+    seen = set(state["seen"]) if state else set()
+    latest_created_at = state.get("latest_created_at", "") if state else ""
+    
+    # A refresh reads the newest comments only, down to the watermark, and never reuses a cached run
+    if incremental:
+        print(f"Extracting comments newer than {latest_created_at or 'the watermark'} from {url} (incremental)...")
+        items = iter_incremental_items(client, url, max_items, latest_created_at, frozenset(seen))
+    else:
+        print(f"Extracting up to {max_items} comments from {url}...")
+        items = iterate_actor_items(client, CONFIG["COMMENT_ACTOR_ID"], comment_run_input(url, max_items),
+                                    bypass=CONFIG["BYPASS_CACHE"])
 
-    # Sort comments by engagement score (descending)
-    all_comments.sort(key=itemgetter("engagement_score"), reverse=True)
+    print("Processing comments...")
     
-    # Get top comments based on engagement score
-    top_comments_data = all_comments[:top_comments] if top_comments < len(all_comments) else all_comments
+    previous_count = state.get("total_count", 0) if state else 0
     
-    print(f"Found {len(all_comments)} comments, keeping top {len(top_comments_data)} by engagement score")
+    # Bounded min-heap of the best comments so far: (score, -arrival order, comment)
+    # Comments already in the stored top list count as the earliest arrivals
+    top_heap = []
+    seq = 0
+    for comment in (state.get("top", []) if state else []):
+        heapq.heappush(top_heap, (comment["engagement_score"], -seq, comment))
+        seq += 1
+    while len(top_heap) > max(top_comments, 0):
+        heapq.heappop(top_heap)
+    new_count = 0
     
-    # Create a folder for all comments too
+    # Every comment is spooled to disk as it arrives and streamed into the _all file later
+    spool = None
     if output_file:
-        all_comments_file = Path(output_file).with_name(f"{Path(output_file).stem}_all.xlsx")
-        save_comments_to_excel(all_comments, str(all_comments_file))
-        print(f"All {len(all_comments)} comments saved to {all_comments_file}")
+        spool = tempfile.NamedTemporaryFile('w+', encoding='utf-8', suffix='.jsonl', delete=False)
+    
+    store = get_store() if usn_time else None
+    store_batch = []
+    
+    try:
+        for item in items:
+            identity = comment_identity(item)
+            if identity in seen:
+                continue
+            seen.add(identity)
+            latest_created_at = max(latest_created_at, item.get("createdAt") or "")
+            
+            filtered_item = filter_comment(item)
+            filtered_item["cid"] = identity
+            new_count += 1
+            
+            if store:
+                store_batch.append((identity, filtered_item))
+                if len(store_batch) >= CONFIG["STORE_BATCH_SIZE"]:
+                    store.upsert_comments(usn_time, url, store_batch)
+                    store_batch = []
+            
+            if spool:
+                spool.write(json.dumps(filtered_item, ensure_ascii=False) + "\n")
+            
+            # Ties keep the earlier comment, as a stable sort would
+            entry = (filtered_item["engagement_score"], -seq, filtered_item)
+            seq += 1
+            if len(top_heap) < top_comments:
+                heapq.heappush(top_heap, entry)
+            elif top_comments > 0 and entry > top_heap[0]:
+                heapq.heapreplace(top_heap, entry)
+        
+        total_count = previous_count + new_count
+        if store and store_batch:
+            store.upsert_comments(usn_time, url, store_batch)
+        
+        # Top comments by engagement score (descending)
+        top_comments_data = [comment for _, _, comment in sorted(top_heap, reverse=True)]
+        
+        if incremental:
+            print(f"Found {new_count} new comments ({total_count} in total), keeping top {len(top_comments_data)} by engagement score")
+        else:
+            print(f"Found {total_count} comments, keeping top {len(top_comments_data)} by engagement score")
+        
+        # Only the commenters that made the top set need their avatars
+        if avatar_dir:
+            with_avatar = [c for c in top_comments_data if c.get("avatarUrl") and c.get("username")]
+            avatar_paths = get_avatar_store().fetch_many(
+                [(c["username"], c["avatarUrl"]) for c in with_avatar],
+                max_workers=CONFIG["AVATAR_WORKERS"]
+            )
+            for comment in with_avatar:
+                comment["avatar_local_path"] = avatar_paths.get(comment["avatarUrl"])
+        
+        # Create a file with all comments too
+        if spool:
+            spool.flush()
+            spool.seek(0)
+            all_comments_file = Path(output_file).with_name(f"{Path(output_file).stem}_all.xlsx")
+            if incremental and all_comments_file.exists():
+                if new_count:
+                    # Stream the existing rows followed by the new comments into a fresh workbook
+                    previous_file = all_comments_file.with_name(f"{all_comments_file.stem}.prev.xlsx")
+                    os.replace(all_comments_file, previous_file)
+                    save_comments_to_excel(
+                        heapq.merge(read_comments_from_excel(previous_file),
+                                    iter_sorted_comments(iter_spooled_comments(spool, avatar_dir)),
+                                    key=engagement_key, reverse=True),
+                        str(all_comments_file)
+                    )
+                    os.remove(previous_file)
+                    print(f"Merged {new_count} comments into {all_comments_file}")
+            else:
+                save_comments_to_excel(iter_sorted_comments(iter_spooled_comments(spool, avatar_dir)),
+                                       str(all_comments_file))
+                print(f"All {total_count} comments saved to {all_comments_file}")
+    finally:
+        if spool:
+            spool.close()
+            os.remove(spool.name)
     
     # Save top comments to the main Excel file
     if top_comments_data and output_file:
         save_comments_to_excel(top_comments_data, output_file)
     
-    return len(top_comments_data), top_comments_data, len(all_comments)
+    if store:
+        # Top comments now carry their avatar paths
+        top_ids = [c["cid"] for c in top_comments_data if c.get("cid")]
+        store.upsert_comments(usn_time, url, [(c["cid"], c) for c in top_comments_data if c.get("cid")], top_ids)
+        store.set_top_comments(usn_time, top_ids)
+    
+    if state_path:
+        save_watermark(state_path, latest_created_at, seen, top_comments_data, total_count)
+    
+    return len(top_comments_data), top_comments_data, total_count
+
+def iter_spooled_comments(spool, with_avatars=False):
+    """Stream comments back from a JSONL spool, filling in avatars already in the store"""
+    store = get_avatar_store() if with_avatars else None
+    for line in spool:
+        comment = json.loads(line)
+        if store and comment.get("avatarUrl") and comment.get("username"):
+            comment["avatar_local_path"] = store.lookup(comment["avatarUrl"])
+        yield comment
+
+def engagement_key(comment):
+    return comment.get("engagement_score") or 0
+
+def iter_sorted_comments(comments):
+    """
+    Stream comments by engagement score (descending), ties kept in arrival order
+
+    External sort: runs of CONFIG["SORT_RUN_SIZE"] comments are sorted in memory and
+    spilled to temporary files, which are then merged, so the _all file is ordered
+    like a full sort without holding every comment.
+    """
+    runs = []
+    try:
+        for batch in iter_batches(comments, CONFIG["SORT_RUN_SIZE"]):
+            batch.sort(key=engagement_key, reverse=True)
+            run = tempfile.TemporaryFile('w+', encoding='utf-8')
+            run.writelines(json.dumps(comment, ensure_ascii=False) + "\n" for comment in batch)
+            run.seek(0)
+            runs.append(run)
+        # heapq.merge takes equal scores from earlier runs first, so the order is stable
+        yield from heapq.merge(*[map(json.loads, run) for run in runs], key=engagement_key, reverse=True)
+    finally:
+        for run in runs:
+            run.close()
+
+def read_comments_from_excel(excel_file):
+    """Stream comments back from a workbook written by save_comments_to_excel"""
+    import openpyxl
+    workbook = openpyxl.load_workbook(excel_file, read_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        headers = next(rows, None)
+        if not headers:
+            return
+        keys = [COMMENT_COLUMNS.get(header) for header in headers]
+        for values in rows:
+            comment = {key: value for key, value in zip(keys, values) if key}
+            comment["isAuthorLiked"] = comment.get("isAuthorLiked") == "Yes"
+            yield comment
+    finally:
+        workbook.close()
 
 def save_comments_to_excel(comments_data, output_file):
-    """Save comments data to an Excel file"""
-    workbook = openpyxl.Workbook()
-    sheet = workbook.active
-    sheet.title = "TikTok Comments"
-
-    headers = ["Text", "Created At", "Like Count", "Reply Count", "Is Author Liked", 
-              "Username", "Display Name", "Bio", "Avatar URL", "Avatar Local Path", "Engagement Score"]
-
-    for col, header in enumerate(headers, 1):
-        sheet.cell(row=1, column=col).value = header
-
-    for row, data in enumerate(comments_data, 2):
-        sheet.cell(row=row, column=1).value = data.get("text", "")
-        sheet.cell(row=row, column=2).value = data.get("createdAt", "")
-        sheet.cell(row=row, column=3).value = data.get("likeCount", 0)
-        sheet.cell(row=row, column=4).value = data.get("replyCount", 0)
-        sheet.cell(row=row, column=5).value = "Yes" if data.get("isAuthorLiked") else "No"
-        sheet.cell(row=row, column=6).value = data.get("username", "")
-        sheet.cell(row=row, column=7).value = data.get("displayName", "")
-        sheet.cell(row=row, column=8).value = data.get("bio", "")
-        sheet.cell(row=row, column=9).value = data.get("avatarUrl", "")
-        sheet.cell(row=row, column=10).value = data.get("avatar_local_path", "")
-        sheet.cell(row=row, column=11).value = data.get("engagement_score", 0)
-
-    for column in sheet.columns:
-        max_length = 0
-        column_letter = column[0].column_letter
-        for cell in column:
-            if cell.value:
-                cell_length = len(str(cell.value))
-                if cell_length > max_length:
-                    max_length = cell_length
-        adjusted_width = max_length + 2
-        sheet.column_dimensions[column_letter].width = min(adjusted_width, 50)
-
-    # Use pathlib for output file
-    output_path = Path(output_file)
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    
+    """Save comments data to an Excel file, streaming rows from any iterable of comments"""
+    rows = (
+        [
+            data.get("text", ""),
+            data.get("createdAt", ""),
+            data.get("likeCount", 0),
+            data.get("replyCount", 0),
+            "Yes" if data.get("isAuthorLiked") else "No",
+            data.get("username", ""),
+            data.get("displayName", ""),
+            data.get("bio", ""),
+            data.get("avatarUrl", ""),
+            data.get("avatar_local_path", ""),
+            data.get("engagement_score", 0),
+        ]
+        for data in comments_data
+    )
+
     try:
-        workbook.save(output_path)
-        print(f"Data saved to {output_path}")
+        write_excel_rows(
+            output_file,
+            list(COMMENT_COLUMNS),
+            rows,
+            sheet_title="TikTok Comments",
+            column_width=lambda length: min(length + 2, 50)
+        )
+        print(f"Data saved to {output_file}")
     except Exception as e:
         print(f"ERROR SAVING EXCEL FILE: {str(e)}")
         raise
@@ -229,126 +448,164 @@ def get_parent_folder_name(folder_path):
     path = Path(folder_path)
     return path.name
 
+@metrics.timed("item_seconds", stage="comments")
+def process_item_comments(item, api_key, max_comments=80, top_comments=5, output_base_folder=None, journal=None):
+    """
+    Extract the comments of one restaurant video item
+
+    The journal, when given, records the video as done and lets a later run skip it.
+    Returns True if the comments were extracted (or already were), False on failure.
+    """
+    restaurant_name = item.get('eat_name', 'Unknown')
+    try:
+        usn_time = item.get('usn_time', '')
+        journal_key = usn_time or restaurant_name
+        
+        print(f"Restaurant: {restaurant_name}")
+        print(f"USN_TIME: {usn_time}")
+        
+        # An incremental refresh revisits every video; its watermark decides what is new
+        if journal and journal.is_done(journal_key, 'comments') and not CONFIG["INCREMENTAL"]:
+            print(f"  Comments already extracted in a previous run, skipping")
+            return True
+        
+        # Determine comment paths based on output_base_folder or from JSON
+        if output_base_folder:
+            # If we have an output base folder, construct paths using usn_time
+            # Create a sanitized folder name
+            base_folder = Path(output_base_folder)
+        
+            # Handle both cases - with or without usn_time
+            if usn_time:
+                safe_folder_name = ''.join(c for c in usn_time if c.isalnum() or c in ('_', '-'))[:50]
+            else:
+                safe_folder_name = ''.join(c for c in restaurant_name if c.isalnum() or c in ('_', '-'))[:50]
+        
+            restaurant_folder = base_folder / safe_folder_name
+            comments_path = restaurant_folder / "comments"
+            user_cover_img = restaurant_folder / "comments" / "user_cover_img"
+        
+            # Use the parent folder name (usn_time or restaurant name folder)
+            excel_filename = f"{restaurant_folder.name}.xlsx"
+        
+            print(f"  Using output folder structure at: {restaurant_folder}")
+        else:
+            # Items from a file without folder paths take them from the media stage's record
+            if not item.get('comments_path') and usn_time:
+                item.update(get_store().get_media(usn_time) or {})
+        
+            # Use paths from JSON
+            comments_path = Path(item.get('comments_path', ''))
+            user_cover_img = Path(item.get('user_cover_img', ''))
+        
+            if not comments_path.is_absolute():
+                comments_path = Path.cwd() / comments_path
+            
+            if not user_cover_img.is_absolute():
+                user_cover_img = Path.cwd() / user_cover_img
+        
+            # Get the parent folder name (the folder above comments)
+            parent_folder = comments_path.parent
+            excel_filename = f"{parent_folder.name}.xlsx"
+        
+            print(f"  Using JSON-defined paths")
+        
+        print(f"  Comments path: {comments_path}")
+        print(f"  Avatar path: {user_cover_img}")
+        
+        # Create directories if they don't exist
+        comments_path.mkdir(parents=True, exist_ok=True)
+        user_cover_img.mkdir(parents=True, exist_ok=True)
+        
+        post_page = item.get('postPage')
+        if not post_page:
+            print(f"  ERROR: TikTok URL (postPage) not found for {restaurant_name}")
+            return False
+        
+        print(f"  TikTok URL: {post_page}")
+        
+        # Create Excel path with the parent folder name
+        excel_path = comments_path / excel_filename
+        
+        print(f"  Will save top comments to: {excel_path}")
+        
+        # Extract comments and save to Excel, also download avatars
+        top_count, _, total_count = extract_tiktok_comments(
+            api_key=api_key,
+            url=post_page,
+            max_items=max_comments,
+            top_comments=top_comments,
+            output_file=str(excel_path),
+            avatar_dir=str(user_cover_img),
+            incremental=CONFIG["INCREMENTAL"],
+            usn_time=journal_key
+        )
+        
+        print(f"  SUCCESS: Extracted {total_count} comments, saved top {top_count} for {restaurant_name}")
+        if journal:
+            journal.mark_done(journal_key, 'comments', {
+                'excel_path': str(excel_path),
+                'top_count': top_count,
+                'total_count': total_count
+            })
+        return True
+    
+    except Exception as e:
+        print(f"  ERROR processing restaurant {restaurant_name}: {str(e)}")
+        return False
+
 def process_json_file(json_file, api_key, max_comments=80, top_comments=5, output_base_folder=None):
-    """Process all restaurants in the JSON file"""
+    """Process all restaurants in the JSON file, returning False if the file or any restaurant failed"""
     try:
         json_path = Path(json_file)
         if not json_path.exists():
             print(f"ERROR: JSON file not found: {json_path}")
-            return
+            return False
             
-        with open(json_path, 'r', encoding='utf-8') as file:
-            data = json.load(file)
+        data = load_records(json_path)
         
         print(f"Found {len(data)} restaurants in the JSON file")
         print(f"Will extract up to {max_comments} comments per restaurant and keep top {top_comments} by engagement")
         
+        # Per-input-file journal of scraped videos, so a crashed run resumes where it stopped
+        journal = StageJournal(json_path.with_name(f"{json_path.stem}.journal.jsonl"), resume=CONFIG["RESUME"])
+        
+        failed = 0
         for index, item in enumerate(data):
             print(f"\nProcessing restaurant {index+1}/{len(data)}")
-            
-            try:
-                restaurant_name = item.get('eat_name', 'Unknown')
-                usn_time = item.get('usn_time', '')
-                
-                print(f"Restaurant: {restaurant_name}")
-                print(f"USN_TIME: {usn_time}")
-                
-                # Determine comment paths based on output_base_folder or from JSON
-                if output_base_folder:
-                    # If we have an output base folder, construct paths using usn_time
-                    # Create a sanitized folder name
-                    base_folder = Path(output_base_folder)
-                    
-                    # Handle both cases - with or without usn_time
-                    if usn_time:
-                        safe_folder_name = ''.join(c for c in usn_time if c.isalnum() or c in ('_', '-'))[:50]
-                    else:
-                        safe_folder_name = ''.join(c for c in restaurant_name if c.isalnum() or c in ('_', '-'))[:50]
-                    
-                    restaurant_folder = base_folder / safe_folder_name
-                    comments_path = restaurant_folder / "comments"
-                    user_cover_img = restaurant_folder / "comments" / "user_cover_img"
-                    
-                    # Use the parent folder name (usn_time or restaurant name folder)
-                    excel_filename = f"{restaurant_folder.name}.xlsx"
-                    
-                    print(f"  Using output folder structure at: {restaurant_folder}")
-                else:
-                    # Use paths from JSON
-                    comments_path = Path(item.get('comments_path', ''))
-                    user_cover_img = Path(item.get('user_cover_img', ''))
-                    
-                    if not comments_path.is_absolute():
-                        comments_path = Path.cwd() / comments_path
-                        
-                    if not user_cover_img.is_absolute():
-                        user_cover_img = Path.cwd() / user_cover_img
-                    
-                    # Get the parent folder name (the folder above comments)
-                    parent_folder = comments_path.parent
-                    excel_filename = f"{parent_folder.name}.xlsx"
-                    
-                    print(f"  Using JSON-defined paths")
-                
-                print(f"  Comments path: {comments_path}")
-                print(f"  Avatar path: {user_cover_img}")
-                
-                # Create directories if they don't exist
-                comments_path.mkdir(parents=True, exist_ok=True)
-                user_cover_img.mkdir(parents=True, exist_ok=True)
-                
-                post_page = item.get('postPage')
-                if not post_page:
-                    print(f"  ERROR: TikTok URL (postPage) not found for {restaurant_name}")
-                    continue
-                
-                print(f"  TikTok URL: {post_page}")
-                
-                # Create Excel path with the parent folder name
-                excel_path = comments_path / excel_filename
-                
-                print(f"  Will save top comments to: {excel_path}")
-                
-                # Extract comments and save to Excel, also download avatars
-                top_count, _, total_count = extract_tiktok_comments(
-                    api_key=api_key,
-                    url=post_page,
-                    max_items=max_comments,
-                    top_comments=top_comments,
-                    output_file=str(excel_path),
-                    avatar_dir=str(user_cover_img)
-                )
-                
-                print(f"  SUCCESS: Extracted {total_count} comments, saved top {top_count} for {restaurant_name}")
-            
-            except Exception as e:
-                print(f"  ERROR processing restaurant {restaurant_name}: {str(e)}")
-                continue  # Added continue to process next restaurant even if one fails
+            # A failed restaurant is reported and the next one is processed
+            if not process_item_comments(item, api_key, max_comments, top_comments, output_base_folder, journal):
+                failed += 1
         
-        print("\nProcessing complete!")
+        print(f"\nProcessing complete! {failed} restaurants failed" if failed else "\nProcessing complete!")
+        return not failed
     
     except Exception as e:
         print(f"ERROR: Failed to process JSON file: {str(e)}")
+        return False
 
 def process_folder_structure(output_base_folder):
-    """Find all JSON files in the folder structure and process them"""
+    """Find all JSON files in the folder structure and process them, returning False if any failed"""
     try:
         # Ensure the folder exists
         base_folder = Path(output_base_folder)
         if not base_folder.exists():
             print(f"ERROR: Base folder not found: {base_folder}")
-            return
+            return False
             
         # Search recursively for JSON files that might have the right structure
-        json_files = glob.glob(str(base_folder / "**" / "*_processed.json"), recursive=True)
-        json_files.extend(glob.glob(str(base_folder / "**" / "*_addurl.json"), recursive=True))
+        json_files = []
+        for suffix in ("*_processed", "*_addurl"):
+            for json_pattern in record_globs(str(base_folder / "**" / suffix)):
+                json_files.extend(glob.glob(json_pattern, recursive=True))
         
         if not json_files:
             print(f"No suitable JSON files found in {base_folder}")
-            return
+            return True
             
         print(f"Found {len(json_files)} JSON files to process")
         
+        ok = True
         for json_file in json_files:
             print(f"\n{'='*60}")
             print(f"Processing file: {json_file}")
@@ -357,26 +614,40 @@ def process_folder_structure(output_base_folder):
             # Get the parent folder of this JSON file to use as the output base
             json_parent = Path(json_file).parent
             
-            process_json_file(
+            ok = process_json_file(
                 json_file=json_file,
                 api_key=CONFIG["API_KEY"],
                 max_comments=CONFIG["MAX_COMMENTS"],
                 top_comments=CONFIG["TOP_COMMENTS"],
                 output_base_folder=json_parent  # Use the JSON's parent folder
-            )
+            ) and ok
+        return ok
     
     except Exception as e:
         print(f"ERROR processing folder structure: {str(e)}")
+        return False
 
 def main():
+    # --no-cache can appear anywhere and forces fresh actor runs
+    if '--no-cache' in sys.argv:
+        sys.argv.remove('--no-cache')
+        CONFIG["BYPASS_CACHE"] = True
+    
+    # --incremental only fetches comments newer than each video's watermark
+    if '--incremental' in sys.argv:
+        sys.argv.remove('--incremental')
+        CONFIG["INCREMENTAL"] = True
+    
     # Check if we have command line arguments
     if len(sys.argv) > 1:
         if sys.argv[1] == '--help' or sys.argv[1] == '-h':
-            print("Usage: python script.py [json_file] [output_folder] [max_comments] [top_comments]")
+            print("Usage: python script.py [json_file] [output_folder] [max_comments] [top_comments] [--no-cache] [--incremental]")
             print("  json_file:     Path to a specific JSON file to process")
             print("  output_folder: Base folder containing JSON files and subfolders")
             print("  max_comments:  Maximum comments to extract per video (default: 20)")
             print("  top_comments:  Top comments to keep after sorting by engagement (default: 5)")
+            print("  --no-cache:    Always call the comment actor instead of reusing cached runs")
+            print("  --incremental: Only fetch new comments and merge them into the existing Excel files")
             sys.exit(0)
         
         # First argument is the JSON file
@@ -407,7 +678,7 @@ def main():
     # If output folder is provided, process all JSON files in the structure
     if CONFIG["OUTPUT_BASE_FOLDER"]:
         print(f"Processing folder structure: {CONFIG['OUTPUT_BASE_FOLDER']}")
-        process_folder_structure(CONFIG["OUTPUT_BASE_FOLDER"])
+        ok = process_folder_structure(CONFIG["OUTPUT_BASE_FOLDER"])
     else:
         # Otherwise, process the single JSON file
         json_path = Path(CONFIG["DEFAULT_JSON_FILE"])
@@ -418,12 +689,18 @@ def main():
         else:
             print(f"JSON file found: {json_path.absolute()}")
         
-        process_json_file(
+        ok = process_json_file(
             json_file=str(json_path),
             api_key=CONFIG["API_KEY"],
             max_comments=CONFIG["MAX_COMMENTS"],
             top_comments=CONFIG["TOP_COMMENTS"]
         )
+    if not ok:
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    try:
+        with metrics.timed("stage_seconds", stage="comments"):
+            main()
+    finally:
+        metrics.write_report("comments")
\ No newline at end of file
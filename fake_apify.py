@@ -0,0 +1,354 @@
+import argparse
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from apify_cache import cache_key
+
+# apify-client releases the fake API is tested against: from 1.12 up to, not including,
+# 3.0 (3.x returns models instead of the dicts the stages read)
+SUPPORTED_CLIENT_VERSIONS = ((1, 12), (3, 0))
+
+# Fake Apify API configuration
+FAKE_APIFY_CONFIG = {
+    "MODE": "synthetic",               # "synthetic", "record" (proxy to the real API and save) or "replay"
+    "FIXTURES_DIR": "./bench_fixtures",  # Recorded actor responses, one JSON file per actor input
+    "UPSTREAM_URL": "https://api.apify.com",
+    "UPSTREAM_TOKEN": os.environ.get("APIFY_TOKEN", ""),  # Token used to record real responses
+    "RUN_LATENCY": 0.0,                # Seconds each fake actor run takes before its dataset is ready
+    "MEDIA_BASE_URL": "http://127.0.0.1:8766",  # Where synthetic media items point (media_server.py)
+    "SEARCH_ACTOR_ID": "5K30i8aFccKNF5ICs",
+    "MEDIA_ACTOR_ID": "S5h7zRLfKFEr8pdj7",
+    "COMMENT_ACTOR_ID": "XomSRf7d0qf3mVj1y",
+}
+
+# Base time of synthetic uploads, so generated usn_time values are stable between runs
+_EPOCH = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp())
+
+def _seed(*parts):
+    """Deterministic integer seed of the given values"""
+    return int(hashlib.sha1("|".join(str(part) for part in parts).encode('utf-8')).hexdigest()[:12], 16)
+
+def video_id(post_page):
+    """Numeric video ID at the end of a TikTok post URL"""
+    return post_page.rstrip('/').rsplit('/', 1)[-1]
+
+def check_client_version():
+    """Return the installed apify-client version, raising RuntimeError if it is not supported"""
+    from importlib.metadata import PackageNotFoundError, version
+    try:
+        installed = version("apify-client")
+    except PackageNotFoundError:
+        raise RuntimeError("apify-client is not installed")
+    numbers = tuple(int(part) for part in installed.split('.')[:2] if part.isdigit())
+    low, high = SUPPORTED_CLIENT_VERSIONS
+    if not low <= numbers < high:
+        raise RuntimeError(f"apify-client {installed} is not supported by the fake Apify API "
+                           f"(need >={'.'.join(map(str, low))},<{'.'.join(map(str, high))})")
+    return installed
+
+def synthetic_search_items(run_input):
+    """Search results for each keyword: one video per distinct channel"""
+    items = []
+    max_items = int(run_input.get("maxItems") or 10)
+    for keyword in run_input.get("keywords") or [""]:
+        seed = _seed(keyword)
+        for n in range(max_items):
+            username = f"user{seed % 100000:05d}_{n}"
+            vid = str(7000000000000000000 + (seed * 1000 + n) % 10 ** 18)
+            uploaded_at = _EPOCH + (seed + n * 86400) % (365 * 86400)
+            items.append({
+                "title": f"{keyword} review #{n + 1} #food #saigon",
+                "views": (seed >> n) % 1000000,
+                "likes": (seed >> n) % 50000,
+                "comments": (seed >> n) % 2000,
+                "shares": (seed >> n) % 500,
+                "bookmarks": (seed >> n) % 800,
+                "hashtags": ["food", "saigon"],
+                "uploadedAt": uploaded_at,
+                "uploadedAtFormatted": datetime.fromtimestamp(uploaded_at, timezone.utc).isoformat(),
+                "channel": {"name": f"User {n}", "username": username},
+                "postPage": f"https://www.tiktok.com/@{username}/video/{vid}",
+            })
+    return items
+
+def synthetic_media_items(run_input, media_base_url):
+    """Media download results: a video and a cover on the local media server per post URL"""
+    items = []
+    for post_url in run_input.get("postURLs") or []:
+        vid = video_id(post_url)
+        items.append({
+            "id": vid,
+            "submittedVideoUrl": post_url,
+            "postPage": post_url,
+            "mediaUrls": [f"{media_base_url}/video/{vid}.mp4"],
+            "cover": f"{media_base_url}/cover/{vid}.jpg",
+        })
+    return items
+
+def synthetic_comment_items(run_input, media_base_url):
+    """Comments for each start URL, with avatars on the local media server"""
+    items = []
+    max_items = int(run_input.get("maxItems") or 20)
+    for start_url in run_input.get("startUrls") or []:
+        url = start_url.get("url") if isinstance(start_url, dict) else start_url
+        seed = _seed(url)
+        for n in range(max_items):
+            # A few commenters recur across videos, like regulars in a real thread
+            username = f"fan{(seed + n) % 400 if n % 3 else n}"
+            created = _EPOCH + (seed + n * 3600) % (365 * 86400)
+            items.append({
+                "cid": f"{seed % 10 ** 9}{n:04d}",
+                "text": f"Comment {n + 1} on {video_id(url)}",
+                "createdAt": datetime.fromtimestamp(created, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                "likeCount": (seed >> (n % 32)) % 300,
+                "replyCount": (seed >> (n % 16)) % 20,
+                "isAuthorLiked": n % 7 == 0,
+                "user": {
+                    "username": username,
+                    "displayName": username.title(),
+                    "bio": "",
+                    "avatarUrl": f"{media_base_url}/avatar/{username}.jpg",
+                },
+            })
+    return items
+
+def synthetic_items(actor_id, run_input, media_base_url):
+    """Dataset items for an actor run, by actor ID or, for unknown actors, by the shape of run_input"""
+    if actor_id == FAKE_APIFY_CONFIG["SEARCH_ACTOR_ID"] or "keywords" in run_input:
+        return synthetic_search_items(run_input)
+    if actor_id == FAKE_APIFY_CONFIG["MEDIA_ACTOR_ID"] or "postURLs" in run_input:
+        return synthetic_media_items(run_input, media_base_url)
+    if actor_id == FAKE_APIFY_CONFIG["COMMENT_ACTOR_ID"] or "startUrls" in run_input:
+        return synthetic_comment_items(run_input, media_base_url)
+    return []
+
+def fixture_path(fixtures_dir, actor_id, run_input):
+    """Recorded response of an actor run, keyed like the Apify cache"""
+    return os.path.join(fixtures_dir, actor_id, f"{cache_key(actor_id, run_input)}.json")
+
+def record_items(actor_id, run_input, fixtures_dir, upstream_url, token):
+    """Run the real actor synchronously, save its dataset items as a fixture and return them"""
+    if not token:
+        raise RuntimeError("Recording needs a real API token in APIFY_TOKEN")
+    request = urllib.request.Request(
+        f"{upstream_url}/v2/acts/{actor_id}/run-sync-get-dataset-items?token={token}",
+        data=json.dumps(run_input).encode('utf-8'),
+        headers={"Content-Type": "application/json"},
+        method="POST"
+    )
+    with urllib.request.urlopen(request, timeout=600) as response:
+        items = json.loads(response.read().decode('utf-8'))
+
+    path = fixture_path(fixtures_dir, actor_id, run_input)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"actor_id": actor_id, "run_input": run_input, "items": items}, f, ensure_ascii=False)
+    print(f"[fake-apify] recorded {len(items)} items for {actor_id} -> {path}")
+    return items
+
+def load_fixture(fixtures_dir, actor_id, run_input):
+    """Items of a recorded run, or None when the run was never recorded"""
+    path = fixture_path(fixtures_dir, actor_id, run_input)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)["items"]
+
+class FakeApifyServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the parts of the Apify API the pipeline uses
+
+    Serves GET /v2/acts/<actor>, POST /v2/acts/<actor>/runs (also under the
+    /v2/actors/ alias), GET /v2/actor-runs/<run> and GET /v2/datasets/<dataset>/items,
+    which is what ApifyClient needs to start, call and wait for actor runs and to
+    page through their datasets. Run logs and other storages answer with the API's
+    record-not-found error. Dataset items are synthetic, recorded from the real API
+    on first use ("record") or served only from recordings ("replay").
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, mode=None, fixtures_dir=None, run_latency=None, media_base_url=None):
+        super().__init__(address, FakeApifyHandler)
+        self.mode = mode or FAKE_APIFY_CONFIG["MODE"]
+        self.fixtures_dir = fixtures_dir or FAKE_APIFY_CONFIG["FIXTURES_DIR"]
+        self.run_latency = FAKE_APIFY_CONFIG["RUN_LATENCY"] if run_latency is None else run_latency
+        self.media_base_url = media_base_url or FAKE_APIFY_CONFIG["MEDIA_BASE_URL"]
+        self.runs = {}
+        self.datasets = {}
+        self.calls = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def items_for(self, actor_id, run_input):
+        if self.mode == "synthetic":
+            return synthetic_items(actor_id, run_input, self.media_base_url)
+        items = load_fixture(self.fixtures_dir, actor_id, run_input)
+        if items is None:
+            if self.mode == "replay":
+                raise LookupError(f"No recording for actor {actor_id} with this input")
+            items = record_items(actor_id, run_input, self.fixtures_dir,
+                                 FAKE_APIFY_CONFIG["UPSTREAM_URL"], FAKE_APIFY_CONFIG["UPSTREAM_TOKEN"])
+        return items
+
+    def start_run(self, actor_id, run_input):
+        items = self.items_for(actor_id, run_input)
+        if self.run_latency:
+            time.sleep(self.run_latency)
+        with self._lock:
+            number = next(self._ids)
+            self.calls += 1
+            now = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+            run = {
+                "id": f"run{number:08d}",
+                "actId": actor_id,
+                "status": "SUCCEEDED",
+                "startedAt": now,
+                "finishedAt": now,
+                "defaultDatasetId": f"ds{number:08d}",
+                "defaultKeyValueStoreId": f"kv{number:08d}",
+            }
+            self.runs[run["id"]] = run
+            self.datasets[run["defaultDatasetId"]] = items
+        return run
+
+class FakeApifyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message, error_type="fake-apify-error"):
+        self._send_json(status, {"error": {"type": error_type, "message": message}})
+
+    def _not_found(self, message):
+        # The client turns this error type into None for get() calls instead of raising
+        self._error(404, message, "record-not-found")
+
+    def _path_parts(self):
+        """Path segments of the request, with the /v2/actors/ alias mapped to /v2/acts/"""
+        parts = urlparse(self.path).path.strip('/').split('/')
+        if parts[:2] == ["v2", "actors"]:
+            parts[1] = "acts"
+        return parts
+
+    def _read_body(self):
+        """Request body, decompressed when the client gzipped it (apify-client does for run inputs)"""
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if body and self.headers.get("Content-Encoding", "").lower() == "gzip":
+            body = gzip.decompress(body)
+        return body
+
+    def do_POST(self):
+        parts = self._path_parts()
+        try:
+            body = self._read_body()
+        except OSError as e:
+            return self._error(400, f"Unreadable request body: {e}")
+
+        if len(parts) == 4 and parts[:2] == ["v2", "acts"] and parts[3] == "runs":
+            actor_id = parts[2].replace('~', '/')
+            try:
+                run_input = json.loads(body.decode('utf-8')) if body else {}
+                run = self.server.start_run(actor_id, run_input)
+            except LookupError as e:
+                return self._error(404, str(e))
+            except urllib.error.HTTPError as e:
+                return self._error(e.code, f"Upstream error: {e}")
+            except Exception as e:
+                return self._error(500, str(e))
+            return self._send_json(201, {"data": run})
+        self._not_found(f"Unsupported endpoint: POST {self.path}")
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = self._path_parts()
+        query = parse_qs(url.query)
+
+        if len(parts) == 3 and parts[:2] == ["v2", "acts"]:
+            actor_id = parts[2].replace('~', '/')
+            return self._send_json(200, {"data": {
+                "id": actor_id,
+                "name": actor_id.rsplit('/', 1)[-1],
+                "defaultRunOptions": {"build": "latest", "memoryMbytes": 1024, "timeoutSecs": 3600},
+            }})
+
+        if len(parts) == 3 and parts[:2] == ["v2", "actor-runs"]:
+            run = self.server.runs.get(parts[2])
+            if run is None:
+                return self._not_found(f"Run {parts[2]} not found")
+            return self._send_json(200, {"data": run})
+
+        if len(parts) == 4 and parts[:2] == ["v2", "datasets"] and parts[3] == "items":
+            items = self.server.datasets.get(parts[2])
+            if items is None:
+                return self._not_found(f"Dataset {parts[2]} not found")
+            offset = int(query.get("offset", ["0"])[0] or 0)
+            limit = int(query.get("limit", [str(len(items))])[0] or len(items))
+            page = items[offset:offset + limit]
+            return self._send_json(200, page, {
+                "x-apify-pagination-total": len(items),
+                "x-apify-pagination-offset": offset,
+                "x-apify-pagination-count": len(page),
+                "x-apify-pagination-limit": limit,
+                "x-apify-pagination-desc": "",
+            })
+        # Run logs, key-value stores and anything else the client may probe
+        self._not_found(f"Unsupported endpoint: GET {self.path}")
+
+def start_server(host="127.0.0.1", port=0, **options):
+    """Start a FakeApifyServer in a daemon thread and return it (port 0 picks a free port)"""
+    server = FakeApifyServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, name="fake-apify", daemon=True).start()
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a local fake of the Apify actor/dataset API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--mode", choices=["synthetic", "record", "replay"], default=FAKE_APIFY_CONFIG["MODE"])
+    parser.add_argument("--fixtures", default=FAKE_APIFY_CONFIG["FIXTURES_DIR"], help="Recorded responses folder")
+    parser.add_argument("--latency", type=float, default=FAKE_APIFY_CONFIG["RUN_LATENCY"],
+                        help="Seconds each actor run takes")
+    parser.add_argument("--media-url", default=FAKE_APIFY_CONFIG["MEDIA_BASE_URL"],
+                        help="Base URL of media_server.py for synthetic media and avatars")
+    args = parser.parse_args(argv)
+
+    server = FakeApifyServer((args.host, args.port), mode=args.mode, fixtures_dir=args.fixtures,
+                             run_latency=args.latency, media_base_url=args.media_url)
+    print(f"Fake Apify API ({args.mode}) on {server.url} - set APIFY_API_URL={server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,23 @@
-import json
 import os
 import cv2
-import requests
 import re
 import glob
+import multiprocessing
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pprint import pprint
-from apify_client import ApifyClient
+from apify_limiter import make_client
+from apify_cache import run_actor
+from journal import StageJournal
+from datastore import get_store
+from metrics import metrics
+from downloader import download_file, download_many
+from image_hash import phash, phash_file, is_near_duplicate, PHashIndex
+from reencode import compact_path, reencode_many
+from records import RECORDS_CONFIG, RecordWriter, load_records, output_path, record_globs
 
 # Configuration - put all variables in one place
 CONFIG = {
@@ -13,75 +25,184 @@ CONFIG = {
     "INPUT_FOLDER": "./cac_quanan_q10/json_xlsx",  # Folder containing JSON files
     "OUTPUT_BASE_FOLDER": "./processed_data",  # Base output folder
     "FRAME_INTERVAL": 3,  # Extract frames every 3 seconds
-    "SUBFOLDERS": ["vid", "img", "final_imgs", "cover_img", "comments", 
+    "FRAME_SAMPLING": "interval",  # "interval", "scene" (on scene change) or "budget" (FRAME_BUDGET spread evenly)
+    "FRAME_BUDGET": None,  # Max frames kept per video (None = no limit)
+    "SCENE_STEP": 0.5,  # Seconds between candidate frames in "scene" mode
+    "PHASH_THRESHOLD": None,  # Drop frames within this many hash bits of a kept frame (None = keep all)
+    "SCENE_PHASH_THRESHOLD": 6,  # Hash bits that count as a scene change in "scene" mode when PHASH_THRESHOLD is None
+    "MEDIA_ACTOR_ID": "S5h7zRLfKFEr8pdj7",  # TikTok video/cover download actor ID
+    "MEDIA_BATCH_SIZE": 20,  # postURLs submitted per actor run (1 = one run per video)
+    "BYPASS_CACHE": False,  # True to always call the actor instead of reusing cached runs
+    "RESUME": True,  # Skip items/stages already recorded in the per-file journal
+    "DOWNLOAD_WORKERS": 8,  # Covers and videos downloaded in parallel
+    "FRAME_WORKERS": os.cpu_count() or 2,  # Videos decoded in parallel (processes)
+    "STREAM_FRAMES": False,  # Decode frames straight from the video URL while it downloads
+    "KEEP_VIDEO": False,  # With STREAM_FRAMES, also save the MP4 to vid/ (downloads each video a second time)
+    "CROSS_VIDEO_DEDUP": True,  # Replace frames/covers already ingested from other videos by references
+    "CROSS_DEDUP_THRESHOLD": 4,  # Max hash bits apart for two images to count as the same
+    "PHASH_INDEX_PATH": "./processed_data/phash_index.npz",  # Persistent index of ingested images
+    "REENCODE_IMAGES": True,  # Re-encode frames and covers into compact_imgs/
+    "REENCODE_FORMAT": "webp",  # "webp" or "jpeg"
+    "REENCODE_QUALITY": 80,  # Output quality (0-100)
+    "REENCODE_MAX_DIM": 1080,  # Longest side in pixels after re-encoding (None = keep size)
+    "REENCODE_WORKERS": os.cpu_count() or 2,  # Images re-encoded in parallel (processes)
+    "SUBFOLDERS": ["vid", "img", "final_imgs", "cover_img", "compact_imgs", "comments", 
                    "comments/filter_cmt", "comments/user_cover_img"]
 }
 
-def extract_frames(video_path, output_folder, interval=3):
-    """Extract frames from a video at specified interval (seconds)"""
-    # Create a temporary folder for extraction
-    import tempfile
-    temp_dir = tempfile.mkdtemp()
-    print(f"Created temporary directory for frame extraction: {temp_dir}")
-    
-    # Create the output folder if it doesn't exist
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
+# Folder paths added to every item when its folders are created
+MEDIA_PATH_FIELDS = ['quanan_folder_path', 'vid_path', 'img_path', 'final_imgs_path', 'cover_img_path',
+                     'compact_imgs_path', 'comments_path', 'filter_comments_path', 'user_cover_img',
+                     'parent_folder_name']
+
+# Item fields written by the media stage, restored from the journal on resume
+MEDIA_FIELDS = ['cover_img', 'downloadUrl', 'video_file', 'frames', 'comments_excel',
+                'final_imgs', 'image_refs']
+
+# Perceptual-hash index shared by every JSON file processed in this run; the lock
+# serialises its use when several files are processed concurrently (pipeline runner)
+_phash_index = None
+_phash_lock = threading.RLock()
+
+def get_phash_index():
+    """Load the persistent perceptual-hash index on first use"""
+    global _phash_index
+    with _phash_lock:
+        if _phash_index is None:
+            _phash_index = PHashIndex(CONFIG["PHASH_INDEX_PATH"])
+    return _phash_index
+
+# Process pools shared by every batch, JSON file and pipeline thread: name -> executor
+_process_pools = {}
+_process_pools_lock = threading.Lock()
+
+def get_process_pool(name, max_workers):
+    """
+    Return the shared process pool called name, starting it on first use
+
+    Workers are started with forkserver (spawn where it is unavailable) instead of
+    being forked from this process, whose other threads may hold SQLite, HTTP
+    session or print locks that a forked child would inherit in a locked state.
+    A pool broken by a crashed worker is replaced.
+    """
+    with _process_pools_lock:
+        pool = _process_pools.get(name)
+        if pool is None or getattr(pool, "_broken", False):
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+            _process_pools[name] = pool
+        return pool
+
+def extract_frames(video_path, output_folder, interval=3, sampling="interval",
+                   max_frames=None, dedup_threshold=None, scene_step=0.5):
+    """
+    Extract frames from a video at specified interval (seconds)
+
+    The video is decoded in a single forward pass: grab() advances through every
+    frame cheaply and retrieve() only decodes the candidate frames, which are
+    written straight to output_folder. video_path may also be an HTTP(S) URL, in
+    which case frames are decoded from the stream as it downloads.
+
+    sampling:
+        "interval" - a candidate every `interval` seconds
+        "scene"    - a candidate every `scene_step` seconds, kept only when the
+                     scene has changed (requires dedup_threshold)
+        "budget"   - max_frames candidates spread evenly over the video
+    A candidate whose perceptual hash is within dedup_threshold bits of an already
+    kept frame is dropped. At most max_frames frames are kept. Returns the frame
+    paths, or None when the video cannot be opened.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    start = time.perf_counter()
 
     # Open the video file
     video_capture = cv2.VideoCapture(video_path)
 
     # Get the frames per second (fps) of the video
-    fps = int(video_capture.get(cv2.CAP_PROP_FPS))
+    fps = video_capture.get(cv2.CAP_PROP_FPS)
     total_frames = int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
-    duration = total_frames // fps
+    if not fps or fps <= 0:
+        print(f"Could not read FPS from {video_path}")
+        video_capture.release()
+        return None
+    # Whole seconds covered by the video; unknown for streams without a frame count
+    duration = total_frames // int(fps) if total_frames > 0 and int(fps) > 0 else None
     
-    # Track the frame paths
+    # Seconds between candidate frames
+    step = interval
+    if sampling == "scene":
+        step = scene_step
+    elif sampling == "budget" and max_frames and duration:
+        step = max(duration / max_frames, scene_step)
+    
+    # Track the frame paths and the hashes of the kept frames
     frame_paths = []
+    kept_hashes = []
+    frame_index = 0
+    next_second = 0
+    next_frame = 0
 
-    # Loop through the video at specified intervals
-    for i in range(0, duration, interval):
-        # Set the video position to the i-th second
-        video_capture.set(cv2.CAP_PROP_POS_MSEC, i * 1000)
-        success, frame = video_capture.read()
-        if success:
-            # Save the frame as an image file in temp directory
-            frame_filename = f"frame_{i}.jpg"
-            temp_frame_path = os.path.join(temp_dir, frame_filename)
-            cv2.imwrite(temp_frame_path, frame)
+    while duration is None or next_second < duration:
+        if max_frames and len(frame_paths) >= max_frames:
+            break
+        if not video_capture.grab():
+            break
+        if frame_index == next_frame:
+            success, frame = video_capture.retrieve()
+            if not success:
+                break
             
-            # Copy the frame to the output folder
-            final_frame_path = os.path.join(output_folder, frame_filename)
-            import shutil
-            shutil.copy2(temp_frame_path, final_frame_path)
+            keep = True
+            if dedup_threshold is not None:
+                frame_hash = phash(frame)
+                keep = not is_near_duplicate(frame_hash, kept_hashes, dedup_threshold)
             
-            frame_paths.append(final_frame_path)
-        else:
-            break
+            if keep:
+                # Save the frame directly in the output folder
+                frame_path = os.path.join(output_folder, f"frame_{next_second:g}.jpg")
+                cv2.imwrite(frame_path, frame)
+                frame_paths.append(frame_path)
+                if dedup_threshold is not None:
+                    kept_hashes.append(frame_hash)
+            
+            next_second = round(next_second + step, 3)
+            next_frame = int(round(next_second * fps))
+        frame_index += 1
 
     # Release the video capture object
     video_capture.release()
     
-    # Clean up the temporary directory
-    import shutil
-    shutil.rmtree(temp_dir)
-    print(f"Removed temporary directory: {temp_dir}")
-    
+    metrics.observe("frame_extraction_seconds", time.perf_counter() - start)
+    metrics.incr("frames_decoded_total", frame_index)
+    metrics.incr("frames_kept_total", len(frame_paths))
     return frame_paths
 
+def extract_frames_in_worker(video_path, output_folder, **options):
+    """Run extract_frames in a pool process and return (frame_paths, metrics recorded by this call)"""
+    # Drop whatever the registry held before this task (a forked worker starts with a
+    # copy of the parent's counters), so only this call's metrics are merged back
+    metrics.drain()
+    frame_paths = extract_frames(video_path, output_folder, **options)
+    return frame_paths, metrics.drain()
+
+def frame_options():
+    """Keyword arguments for extract_frames taken from CONFIG"""
+    threshold = CONFIG["PHASH_THRESHOLD"]
+    if threshold is None and CONFIG["FRAME_SAMPLING"] == "scene":
+        # Scene sampling needs a threshold to tell scenes apart
+        threshold = CONFIG["SCENE_PHASH_THRESHOLD"]
+    return {
+        'interval': CONFIG["FRAME_INTERVAL"],
+        'sampling': CONFIG["FRAME_SAMPLING"],
+        'max_frames': CONFIG["FRAME_BUDGET"],
+        'dedup_threshold': threshold,
+        'scene_step': CONFIG["SCENE_STEP"],
+    }
+
 def download_mp4(url, output_path):
-    """Download MP4 file from URL"""
-    response = requests.get(url, stream=True)
-    if response.status_code == 200:
-        with open(output_path, 'wb') as file:
-            for chunk in response.iter_content(chunk_size=1024):
-                if chunk:
-                    file.write(chunk)
-        print(f"Download completed: {output_path}")
-        return True
-    else:
-        print(f"Failed to download file. Status code: {response.status_code}")
-        return False
+    """Download MP4 (or any) file from URL through the shared pooled session"""
+    return download_file(url, output_path)
 
 def sanitize_filename(name):
     """Convert a string to a valid filename"""
@@ -117,6 +238,384 @@ def create_folder_structure(base_path, usn_time):
     
     return paths
 
+def media_url_key(url):
+    """Reduce a TikTok post URL to a stable key (the numeric video ID when present)"""
+    match = re.search(r'/(?:video|photo)/(\d+)', url)
+    if match:
+        return match.group(1)
+    return url.split('?')[0].rstrip('/').lower()
+
+def media_item_keys(dataset_item):
+    """Collect every key a media actor dataset item can be matched back by"""
+    keys = set()
+    for field in ('submittedVideoUrl', 'webVideoUrl', 'postPage', 'inputUrl', 'url'):
+        value = dataset_item.get(field)
+        if isinstance(value, str) and value:
+            keys.add(media_url_key(value))
+    if dataset_item.get('id'):
+        keys.add(str(dataset_item['id']))
+    return keys
+
+def fetch_media_items(client, post_urls):
+    """Run the media actor once for a batch of postURLs and map the dataset items back by URL"""
+    run_input = {
+        "postURLs": post_urls,
+        "shouldDownloadVideos": True,
+        "shouldDownloadCovers": True,
+        "shouldDownloadSubtitles": False,
+        "shouldDownloadSlideshowImages": False,
+    }
+    
+    print(f"Calling Apify API to download {len(post_urls)} videos...")
+    dataset_items = run_actor(client, CONFIG["MEDIA_ACTOR_ID"], run_input, bypass=CONFIG["BYPASS_CACHE"])
+    print(f"Dataset contains {len(dataset_items)} items")
+    
+    media_items = {}
+    for dataset_item in dataset_items:
+        for key in media_item_keys(dataset_item):
+            media_items.setdefault(key, dataset_item)
+    
+    # A single-URL run needs no matching, its first item belongs to that URL
+    if len(post_urls) == 1 and dataset_items:
+        media_items.setdefault(media_url_key(post_urls[0]), dataset_items[0])
+    
+    return media_items
+
+def resolve_media_urls(media_item):
+    """Find the media URLs, the video URL and the cover URL in a media actor dataset item"""
+    print(f"Dataset item structure: {list(media_item.keys())}")
+    media_urls = None
+    
+    # Look for media URLs in different possible field names
+    possible_fields = ['mediaUrls', 'videoUrl', 'videoUrls', 'urls', 'video']
+    
+    for field in possible_fields:
+        if field in media_item:
+            media_urls = media_item[field]
+            print(f"Found media URLs in field '{field}': {type(media_urls)}")
+            break
+            
+    if not media_urls and 'video' in media_item:
+        media_urls = [media_item['video']]
+    
+    # Handle different formats of mediaUrls
+    video_url = ''
+    if isinstance(media_urls, dict):
+        video_url = media_urls.get('video', '')
+    elif isinstance(media_urls, list):
+        for url in media_urls:
+            if isinstance(url, str) and (url.endswith('.mp4') or 'video' in url):
+                video_url = url
+                break
+        if not video_url and media_urls:
+            video_url = media_urls[0]
+    elif isinstance(media_urls, str):
+        video_url = media_urls
+    
+    return media_urls, video_url, media_item.get('cover')
+
+def create_comments_placeholder(item, paths, clip_url):
+    """Create the placeholder comments Excel file named after the usn_time folder"""
+    # Create Excel file for comments with parent folder name
+    # Name the file after the parent folder (usn_time folder)
+    comments_excel_filename = f"{paths['parent_folder_name']}.xlsx"
+    comments_excel_path = os.path.join(paths['comments_path'], comments_excel_filename)
+    
+    # Create an empty Excel file as a placeholder
+    try:
+        import openpyxl
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.title = "Comments Placeholder"
+        ws['A1'] = "This is a placeholder for TikTok comments."
+        ws['A2'] = f"TikTok URL: {clip_url}"
+        ws['A3'] = "Comments will be extracted in a separate process."
+        wb.save(comments_excel_path)
+        print(f"Created comments placeholder Excel file: {comments_excel_path}")
+        
+        # Add comments Excel file path to JSON
+        item['comments_excel'] = comments_excel_path.replace('\\', '/')
+    except Exception as e:
+        print(f"Error creating comments Excel placeholder: {e}")
+
+def record_frames(item, usn_time, paths, frame_paths, journal=None):
+    """Store extracted frame paths on the item and in the journal"""
+    if frame_paths is None:
+        # Nothing is journaled, so the next run tries this video again
+        raise RuntimeError(f"Could not open the video of {usn_time}")
+    item['frames'] = [path.replace('\\', '/') for path in frame_paths]
+    print(f"Extracted {len(frame_paths)} frames to {paths['img_path']}")
+    if journal:
+        journal.mark_done(usn_time, 'frames', {'frames': item['frames']})
+
+def finish_video_item(item, usn_time, paths, clip_url, video_path, success, journal=None, frame_pool=None):
+    """
+    Extract frames from a downloaded video and create the comments placeholder
+
+    With a frame_pool the extraction is submitted to it and the future is returned,
+    otherwise it runs here and None is returned.
+    """
+    future = None
+    if success and journal and journal.is_done(usn_time, 'frames'):
+        item.update(journal.get(usn_time, 'frames'))
+        print(f"Frames already extracted to {paths['img_path']}")
+    elif success and frame_pool:
+        future = frame_pool.submit(extract_frames_in_worker, video_path, paths['img_path'], **frame_options())
+    elif success:
+        # Extract frames and save paths
+        frame_paths = extract_frames(
+            video_path, 
+            paths['img_path'], 
+            **frame_options()
+        )
+        record_frames(item, usn_time, paths, frame_paths, journal)
+    
+    create_comments_placeholder(item, paths, clip_url)
+    return future
+
+def process_media_items(entries, journal=None):
+    """
+    Download covers and videos for a batch of items in parallel, then extract frames
+
+    Each entry is (item, media_item, usn_time, paths, clip_url). Frame extraction for
+    each video is submitted to a process pool as soon as its download finishes,
+    while the other downloads keep running. With STREAM_FRAMES the extraction
+    starts immediately and decodes from the video URL instead of a local file.
+    Stages already recorded in the journal are restored instead of redone.
+    Returns the usn_times whose video was downloaded or streamed.
+    """
+    download_jobs = []
+    ready_videos = []
+    
+    for entry in entries:
+        item, media_item, usn_time, paths, clip_url = entry
+        print(f"\nProcessing media for usn_time: {usn_time}")
+        media_urls, video_url, cover_url = resolve_media_urls(media_item)
+        
+        # Try to get cover image URL
+        if cover_url and journal and journal.is_done(usn_time, 'cover'):
+            item.update(journal.get(usn_time, 'cover'))
+        elif cover_url:
+            cover_filename = f"{sanitize_filename(usn_time)}_cover.jpg"
+            cover_path = os.path.join(paths['cover_img_path'], cover_filename)
+            download_jobs.append((cover_url, cover_path, 'cover', entry))
+        
+        if not media_urls:
+            print(f"No media URLs found for {usn_time}. Skipping...")
+            continue
+        
+        # Update the item with download URL
+        item['downloadUrl'] = media_urls
+        
+        if not video_url:
+            continue
+        
+        video_filename = f"{sanitize_filename(usn_time)}.mp4"
+        video_path = os.path.join(paths['vid_path'], video_filename)
+        
+        if journal and journal.is_done(usn_time, 'video') and os.path.exists(video_path):
+            print(f"Video already downloaded: {video_path}")
+            item['video_file'] = video_path.replace('\\', '/')
+            ready_videos.append((entry, video_path))
+        elif CONFIG["STREAM_FRAMES"]:
+            # The decoder reads the HTTP stream itself, so frames come out while the
+            # video is still arriving; the MP4 is only written to disk when kept
+            ready_videos.append((entry, video_url))
+            if CONFIG["KEEP_VIDEO"]:
+                item['video_file'] = video_path.replace('\\', '/')
+                download_jobs.append((video_url, video_path, 'kept_video', entry))
+        else:
+            item['video_file'] = video_path.replace('\\', '/')
+            download_jobs.append((video_url, video_path, 'video', entry))
+    
+    downloaded = []
+    frame_futures = {}
+    
+    # Frames are extracted in the process pool shared by every batch
+    frame_pool = get_process_pool("frames", CONFIG["FRAME_WORKERS"])
+    
+    # Videos finished by an earlier run (or streamed from their URL) go straight to frame extraction
+    for entry, video_path in ready_videos:
+        item, _, usn_time, paths, clip_url = entry
+        try:
+            future = finish_video_item(item, usn_time, paths, clip_url, video_path, True, journal, frame_pool)
+            if future:
+                frame_futures[future] = (entry, video_path)
+            downloaded.append(usn_time)
+        except Exception as e:
+            print(f"Error processing {usn_time}: {e}")
+    
+    # Download every cover and video of the batch through the shared pool
+    print(f"\nDownloading {len(download_jobs)} files with up to {CONFIG['DOWNLOAD_WORKERS']} workers")
+    for job, success in download_many(download_jobs, max_workers=CONFIG["DOWNLOAD_WORKERS"]):
+        _, output_path, kind, entry = job
+        item, _, usn_time, paths, clip_url = entry
+        
+        try:
+            if kind == 'cover':
+                if success:
+                    item['cover_img'] = output_path.replace('\\', '/')
+                    if journal:
+                        journal.mark_done(usn_time, 'cover', {'cover_img': item['cover_img']})
+                continue
+            
+            if success and journal:
+                journal.mark_done(usn_time, 'video', {'video_file': item['video_file']})
+            if kind == 'kept_video':
+                # Frames for this video are already being decoded from the stream
+                if not success:
+                    item.pop('video_file', None)
+                continue
+            future = finish_video_item(item, usn_time, paths, clip_url, output_path, success, journal, frame_pool)
+            if future:
+                frame_futures[future] = (entry, output_path)
+            if success:
+                downloaded.append(usn_time)
+        except Exception as e:
+            print(f"Error processing {usn_time}: {e}")
+    
+    # Collect frames from the process pool
+    for future in as_completed(frame_futures):
+        (item, _, usn_time, paths, _), video_path = frame_futures[future]
+        try:
+            frame_paths, worker_metrics = future.result()
+            metrics.merge(worker_metrics)
+            if frame_paths is None and os.path.isfile(video_path):
+                # An unreadable download is removed so the next run fetches it again
+                os.remove(video_path)
+            record_frames(item, usn_time, paths, frame_paths, journal)
+        except Exception as e:
+            print(f"Error extracting frames for {usn_time}: {e}")
+            downloaded.remove(usn_time)
+    
+    return downloaded
+
+def dedup_item_images(item, usn_time, paths, index, threshold, journal=None):
+    """
+    Deduplicate an item's frames and cover against every image ingested before
+
+    An image whose hash matches a stored one is deleted and its entry in the item
+    points to the stored image instead (recorded in item['image_refs']). Unique
+    images are indexed and linked into the item's final_imgs folder. They are only
+    indexed once the whole item is done, so frames of the same video never match
+    each other here (within-video dedup is PHASH_THRESHOLD's job).
+    """
+    if journal and journal.is_done(usn_time, 'dedup'):
+        item.update(journal.get(usn_time, 'dedup'))
+        return
+    
+    refs = {}
+    final_imgs = []
+    new_hashes = []
+    
+    def ingest(image_path):
+        image_hash = phash_file(image_path)
+        if image_hash is None:
+            return image_path
+        
+        match = index.find(image_hash, threshold)
+        if match and os.path.abspath(match) != os.path.abspath(image_path):
+            os.remove(image_path)
+            refs[image_path] = match
+            return match
+        
+        new_hashes.append((image_hash, image_path))
+        final_path = os.path.join(paths['final_imgs_path'], os.path.basename(image_path))
+        if not os.path.exists(final_path):
+            try:
+                os.link(image_path, final_path)
+            except OSError:
+                shutil.copy2(image_path, final_path)
+        final_imgs.append(final_path.replace('\\', '/'))
+        return image_path
+    
+    if item.get('cover_img'):
+        item['cover_img'] = ingest(item['cover_img'])
+    if item.get('frames'):
+        item['frames'] = [ingest(frame_path) for frame_path in item['frames']]
+    for image_hash, image_path in new_hashes:
+        index.add(image_hash, image_path)
+    
+    item['final_imgs'] = final_imgs
+    item['image_refs'] = refs
+    if refs:
+        print(f"{usn_time}: {len(refs)} images already ingested from other videos, stored as references")
+    
+    if journal:
+        journal.mark_done(usn_time, 'dedup', {
+            field: item[field] for field in ('cover_img', 'frames', 'final_imgs', 'image_refs') if field in item
+        })
+
+def reencode_item_images(entries, journal=None):
+    """
+    Re-encode the frames and covers of processed items into compact_imgs/
+
+    Each entry is (item, usn_time). Images referenced from other videos are
+    re-encoded once, in their owner's folder. Every item records the compact
+    paths in item['compact_cover_img'] and item['compact_frames'].
+    """
+    fmt = CONFIG["REENCODE_FORMAT"]
+    compact_paths = {}
+    pending_items = []
+    
+    for item, usn_time in entries:
+        if journal and journal.is_done(usn_time, 'reencode'):
+            item.update(journal.get(usn_time, 'reencode'))
+            continue
+        images = ([item['cover_img']] if item.get('cover_img') else []) + list(item.get('frames', []))
+        if not images:
+            continue
+        for image_path in images:
+            compact_paths.setdefault(image_path, compact_path(image_path, fmt))
+        pending_items.append((item, usn_time))
+    
+    # Images re-encoded by an earlier item (shared references) are not done twice
+    encoded = {src for src, dst in compact_paths.items() if os.path.exists(dst)}
+    jobs = [(src, dst) for src, dst in compact_paths.items() if src not in encoded]
+    
+    print(f"\nRe-encoding {len(jobs)} images to {fmt} with up to {CONFIG['REENCODE_WORKERS']} workers")
+    for (src, dst), result in reencode_many(
+        jobs,
+        max_dim=CONFIG["REENCODE_MAX_DIM"],
+        fmt=fmt,
+        quality=CONFIG["REENCODE_QUALITY"],
+        executor=get_process_pool("reencode", CONFIG["REENCODE_WORKERS"])
+    ):
+        if result:
+            encoded.add(src)
+        else:
+            print(f"Could not re-encode {src}")
+    
+    for item, usn_time in pending_items:
+        if item.get('cover_img') in encoded:
+            item['compact_cover_img'] = compact_paths[item['cover_img']]
+        item['compact_frames'] = [compact_paths[path] for path in item.get('frames', []) if path in encoded]
+        if journal:
+            journal.mark_done(usn_time, 'reencode', {
+                field: item[field] for field in ('compact_cover_img', 'compact_frames') if field in item
+            })
+
+def complete_items(entries, writer, written, journal=None):
+    """
+    Re-encode the images of finished (item, usn_time) entries and write the items out
+
+    The id() of every written item is added to written.
+    """
+    if CONFIG["REENCODE_IMAGES"] and entries:
+        try:
+            with metrics.timed("reencode_seconds"):
+                reencode_item_images(entries, journal)
+        except Exception as e:
+            print(f"Error re-encoding images: {e}")
+    for item, _ in entries:
+        writer.write(item)
+        written.add(id(item))
+
+def process_media_item(item, media_item, usn_time, paths, clip_url, journal=None):
+    """Process a single item's media actor result; returns True when the video was downloaded"""
+    return bool(process_media_items([(item, media_item, usn_time, paths, clip_url)], journal))
+
+@metrics.timed("item_seconds", stage="media")
 def process_json_file(api_key, json_file_path):
     """Process a single JSON file to download videos and extract frames"""
     print(f"\n{'='*60}")
@@ -132,19 +631,26 @@ def process_json_file(api_key, json_file_path):
     os.makedirs(json_output_folder, exist_ok=True)
     
     # Initialize Apify client
-    client = ApifyClient(api_key)
+    client = make_client(api_key)
     
-    # Load JSON data
+    # Load JSON data (an array or JSONL)
     try:
-        with open(json_file_path, 'r', encoding='utf-8') as f:
-            loaded_list = json.load(f)
+        loaded_list = load_records(json_file_path)
     except Exception as e:
         print(f"Error loading JSON file: {e}")
         return
     
     print(f"Loaded {len(loaded_list)} items from JSON file")
     
-    # Process each item in the JSON file
+    # Per-input-file journal of completed stages, so a crashed run resumes where it stopped
+    journal = StageJournal(
+        os.path.join(json_output_folder, f"{json_name_no_ext}.journal.jsonl"),
+        resume=CONFIG["RESUME"]
+    )
+    
+    # Prepare folders for every item and collect the ones that have a TikTok URL
+    prepared = []
+    pending = []
     for idx, item in enumerate(loaded_list):
         # Get usn_time as the identifier for folder structure
         usn_time = item.get('usn_time', '')
@@ -153,7 +659,7 @@ def process_json_file(api_key, json_file_path):
             print(f"Warning: No usn_time found for item {idx+1}. Using index as identifier.")
             usn_time = f"item_{idx+1}"
         
-        print(f"\nProcessing item {idx+1}/{len(loaded_list)} with usn_time: {usn_time}")
+        print(f"\nPreparing item {idx+1}/{len(loaded_list)} with usn_time: {usn_time}")
         
         # Create folder structure based on usn_time
         paths = create_folder_structure(json_output_folder, usn_time)
@@ -165,12 +671,14 @@ def process_json_file(api_key, json_file_path):
             'img_path': paths['img_path'],
             'final_imgs_path': paths['final_imgs_path'],
             'cover_img_path': paths['cover_img_path'],
+            'compact_imgs_path': paths['compact_imgs_path'],
             'comments_path': paths['comments_path'],
             'filter_comments_path': paths['comments_filter_cmt_path'],
             'user_cover_img': paths['comments_user_cover_img_path'],
             # Store parent folder name for Excel files
             'parent_folder_name': paths['parent_folder_name']
         })
+        prepared.append((item, usn_time))
         
         # Get TikTok URL from postPage field
         clip_url = item.get('postPage', '')
@@ -179,143 +687,99 @@ def process_json_file(api_key, json_file_path):
             print(f"Warning: No URL found for {usn_time}. Skipping...")
             continue
         
-        print(f"TikTok URL: {clip_url}")
-        
-        # Download the video using Apify
-        run_input = {
-            "postURLs": [clip_url],
-            "shouldDownloadVideos": True,
-            "shouldDownloadCovers": True,
-            "shouldDownloadSubtitles": False,
-            "shouldDownloadSlideshowImages": False,
-        }
+        # Items finished by an earlier run only need their media fields restored
+        if journal.is_done(usn_time, 'media'):
+            item.update(journal.get(usn_time, 'media'))
+            print(f"Already processed in a previous run: {usn_time}")
+            continue
         
-        try:
-            print(f"Calling Apify API to download video...")
-            run = client.actor("S5h7zRLfKFEr8pdj7").call(run_input=run_input)
-            print(f"Apify run completed, dataset ID: {run['defaultDatasetId']}")
-            media_urls = None
+        pending.append((item, usn_time, paths, clip_url))
+    
+    # Save updated JSON with download URLs and media paths, in the configured format
+    output_json = output_path(os.path.join(json_output_folder, f"{json_name_no_ext}_processed.json"))
+    stream_output = RECORDS_CONFIG["FORMAT"] == "jsonl"
+    written = set()
+    
+    with RecordWriter(output_json) as writer:
+        # Submit the postURLs in batches, one actor run per batch
+        batch_size = max(1, int(CONFIG["MEDIA_BATCH_SIZE"]))
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            print(f"\nMedia batch {start // batch_size + 1}: items {start + 1}-{start + len(batch)} of {len(pending)}")
             
-            # Get download URLs from the dataset
-            dataset_items = list(client.dataset(run["defaultDatasetId"]).iterate_items())
-            print(f"Dataset contains {len(dataset_items)} items")
+            try:
+                media_items = fetch_media_items(client, [clip_url for _, _, _, clip_url in batch])
+            except Exception as e:
+                print(f"Error calling Apify for media batch: {e}")
+                continue
             
-            if dataset_items:
-                first_item = dataset_items[0]
-                print(f"Dataset item structure: {list(first_item.keys())}")
-                
-                # Look for media URLs in different possible field names
-                possible_fields = ['mediaUrls', 'videoUrl', 'videoUrls', 'urls', 'video']
-                
-                for field in possible_fields:
-                    if field in first_item:
-                        media_urls = first_item[field]
-                        print(f"Found media URLs in field '{field}': {type(media_urls)}")
-                        break
-                        
-                if not media_urls and 'video' in first_item:
-                    media_urls = [first_item['video']]
-                
-                # Try to get cover image URL
-                if 'cover' in first_item:
-                    cover_url = first_item['cover']
-                    cover_filename = f"{sanitize_filename(usn_time)}_cover.jpg"
-                    cover_path = os.path.join(paths['cover_img_path'], cover_filename)
-                    
-                    try:
-                        success = download_mp4(cover_url, cover_path)
-                        if success:
-                            item['cover_img'] = cover_path.replace('\\', '/')
-                    except Exception as e:
-                        print(f"Error downloading cover image: {e}")
+            entries = []
+            for item, usn_time, paths, clip_url in batch:
+                media_item = media_items.get(media_url_key(clip_url))
+                if media_item is None:
+                    print(f"No media actor result for {usn_time} ({clip_url}). Skipping...")
+                    continue
+                entries.append((item, media_item, usn_time, paths, clip_url))
             
-            if not media_urls:
-                print(f"No media URLs found for {usn_time}. Skipping...")
-                continue
+            downloaded = process_media_items(entries, journal)
             
-            # Update the item with download URL
-            loaded_list[idx]['downloadUrl'] = media_urls
+            # Swap images already ingested from other videos for references
+            if CONFIG["CROSS_VIDEO_DEDUP"]:
+                with _phash_lock:
+                    index = get_phash_index()
+                    for item, _, usn_time, paths, _ in entries:
+                        if usn_time not in downloaded:
+                            continue
+                        try:
+                            dedup_item_images(item, usn_time, paths, index, CONFIG["CROSS_DEDUP_THRESHOLD"], journal)
+                        except Exception as e:
+                            print(f"Error deduplicating images for {usn_time}: {e}")
+                    index.save()
             
-            # Handle different formats of mediaUrls
-            video_url = ''
-            if isinstance(media_urls, dict):
-                video_url = media_urls.get('video', '')
-            elif isinstance(media_urls, list):
-                for url in media_urls:
-                    if isinstance(url, str) and (url.endswith('.mp4') or 'video' in url):
-                        video_url = url
-                        break
-                if not video_url and media_urls:
-                    video_url = media_urls[0]
-            elif isinstance(media_urls, str):
-                video_url = media_urls
+            # Items are only complete once every download of the batch has finished
+            for item, _, usn_time, _, _ in entries:
+                if usn_time in downloaded:
+                    journal.mark_done(usn_time, 'media', {
+                        field: item[field] for field in MEDIA_FIELDS if field in item
+                    })
             
-            if video_url:
-                video_filename = f"{sanitize_filename(usn_time)}.mp4"
-                video_path = os.path.join(paths['vid_path'], video_filename)
-                
-                success = download_mp4(video_url, video_path)
-                item['video_file'] = video_path.replace('\\', '/')
-                
-                if success:
-                    # Extract frames and save paths
-                    frame_paths = extract_frames(
-                        video_path, 
-                        paths['img_path'], 
-                        CONFIG["FRAME_INTERVAL"]
-                    )
-                    item['frames'] = [path.replace('\\', '/') for path in frame_paths]
-                    print(f"Extracted {len(frame_paths)} frames to {paths['img_path']}")
-                
-                # Create Excel file for comments with parent folder name
-                # Name the file after the parent folder (usn_time folder)
-                comments_excel_filename = f"{paths['parent_folder_name']}.xlsx"
-                comments_excel_path = os.path.join(paths['comments_path'], comments_excel_filename)
-                
-                # Create an empty Excel file as a placeholder
-                try:
-                    import openpyxl
-                    wb = openpyxl.Workbook()
-                    ws = wb.active
-                    ws.title = "Comments Placeholder"
-                    ws['A1'] = "This is a placeholder for TikTok comments."
-                    ws['A2'] = f"TikTok URL: {clip_url}"
-                    ws['A3'] = "Comments will be extracted in a separate process."
-                    wb.save(comments_excel_path)
-                    print(f"Created comments placeholder Excel file: {comments_excel_path}")
-                    
-                    # Add comments Excel file path to JSON
-                    item['comments_excel'] = comments_excel_path.replace('\\', '/')
-                except Exception as e:
-                    print(f"Error creating comments Excel placeholder: {e}")
-                
-        except Exception as e:
-            print(f"Error processing {usn_time}: {e}")
-    
-    # Save updated JSON with download URLs and media paths
-    output_json = os.path.join(
-        json_output_folder, 
-        f"{os.path.basename(json_file_path).replace('.json', '')}_processed.json"
-    )
+            # In JSONL mode the batch is appended to the output as soon as it is complete
+            if stream_output:
+                complete_items([(item, usn_time) for item, _, usn_time, _, _ in entries], writer, written, journal)
+        
+        # Everything not written yet: the whole file in JSON mode (compacted in one process
+        # pool), otherwise the items that were resumed, skipped or had no media result
+        complete_items([(item, usn_time) for item, usn_time in prepared if id(item) not in written],
+                       writer, written, journal)
     
-    with open(output_json, 'w', encoding='utf-8') as f:
-        json.dump(loaded_list, f, ensure_ascii=False, indent=4)
+    # Record folder and media paths per item so later stages can look them up by usn_time
+    store = get_store()
+    store.upsert_videos(loaded_list, source=output_json)
+    for item, usn_time in prepared:
+        store.upsert_media(usn_time, item.get('postPage'), {
+            field: item[field] for field in MEDIA_PATH_FIELDS + MEDIA_FIELDS if field in item
+        })
     
     print(f"Updated JSON saved to {output_json}")
     return output_json
 
 def batch_process_json_files(input_folder):
-    """Process all JSON files in the input folder"""
+    """Process all JSON files in the input folder, returning False if any of them failed"""
+    if not os.path.isdir(input_folder):
+        print(f"ERROR: Input folder not found: {input_folder}")
+        return False
+    
     # Ensure output base folder exists
     os.makedirs(CONFIG["OUTPUT_BASE_FOLDER"], exist_ok=True)
     
     # Find all JSON files in the input folder and its subfolders
-    json_pattern = os.path.join(input_folder, "**", "*.json")
-    json_files = glob.glob(json_pattern, recursive=True)
+    json_files = []
+    for json_pattern in record_globs(os.path.join(input_folder, "**", "*")):
+        json_files.extend(glob.glob(json_pattern, recursive=True))
     
     if not json_files:
         print(f"No JSON files found in {input_folder}")
-        return
+        return True
     
     print(f"Found {len(json_files)} JSON files to process")
     
@@ -330,13 +794,23 @@ def batch_process_json_files(input_folder):
     print(f"\nBatch processing complete. Processed {len(processed_files)} JSON files.")
     for file in processed_files:
         print(f"- {file}")
+    failed = len(json_files) - len(processed_files)
+    if failed:
+        print(f"{failed} JSON files failed")
+    return not failed
 
 def main():
     print("Starting batch processing of JSON files")
     print(f"Input folder: {CONFIG['INPUT_FOLDER']}")
     print(f"Output base folder: {CONFIG['OUTPUT_BASE_FOLDER']}")
     
-    batch_process_json_files(CONFIG["INPUT_FOLDER"])
+    try:
+        with metrics.timed("stage_seconds", stage="media"):
+            ok = batch_process_json_files(CONFIG["INPUT_FOLDER"])
+    finally:
+        metrics.write_report("media")
+    if not ok:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,10 +1,15 @@
-from apify_client import ApifyClient
-from typing import Dict, List, Any
+from apify_limiter import make_client
+from apify_cache import iterate_actor_items
+from datastore import get_store, video_key
+from metrics import metrics
+from typing import Dict, Iterable, List, Any
 import json
 from datetime import datetime
 import os
-import openpyxl
-from openpyxl.styles import Font, Alignment, PatternFill
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from excel_writer import write_excel_rows, header_style
+from records import RecordWriter, iter_batches, iter_records, output_path
 
 # Centralized configuration dictionary
 CONFIG = {
@@ -21,23 +26,72 @@ CONFIG = {
     "PROJECT_FOLDER": "QUANAN_new_150",
     "PROJECT_DIST": "q11",
     
+    # Batch search (--batch): one actor run per keyword x district shard
+    "DISTRICTS": {            # District folder -> name used in the keywords
+        "q5": "quận 5",
+        "q10": "quận 10",
+        "q11": "quận 11",
+    },
+    "KEYWORD_TEMPLATES": ["quán ngon {district}"],  # {district} is replaced by each district's name
+    "BATCH_CONCURRENCY": 4,   # Shards (actor runs) in flight at once
+    
     # Excel configuration
     "EXCEL_HEADERS": ["usn_time", "postPage", "eat_name", "eat_addr", "open_time", "menu"],
     "HEADER_COLOR": "DDEBF7",
     
     # Actor configuration
-    "TIKTOK_SEARCH_ACTOR_ID": "5K30i8aFccKNF5ICs"
+    "TIKTOK_SEARCH_ACTOR_ID": "5K30i8aFccKNF5ICs",
+    
+    # Datastore configuration
+    "STORE_BATCH_SIZE": 500,  # Videos written to the datastore per transaction
+    
+    # Cache configuration
+    "BYPASS_CACHE": False  # True to always call the actor instead of reusing cached runs
 }
 
-def search_tiktok_videos() -> List[Dict[str, Any]]:
+def extract_video(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Keep the fields used downstream from one search actor item and add its usn_time"""
+    # Extract only the requested fields
+    extracted_data = {
+        "title": item.get("title"),
+        "views": item.get("views"),
+        "likes": item.get("likes"),
+        "comments": item.get("comments"),
+        "shares": item.get("shares"),
+        "bookmarks": item.get("bookmarks"),
+        "hashtags": item.get("hashtags"),
+        "uploadedAt": item.get("uploadedAt"),
+        "uploadedAtFormatted": item.get("uploadedAtFormatted"),
+        "channel": {
+            "name": item.get("channel", {}).get("name"),
+            "username": item.get("channel", {}).get("username")
+        },
+        "postPage": item.get("postPage")
+    }
+    
+    # Format date and create identifier (similar to author_time in original code)
+    upload_time = item.get("uploadedAt")
+    if upload_time:
+        dt = datetime.fromtimestamp(upload_time)
+        formatted_date = dt.strftime('%Y_%d_%m')
+        channel_name = extracted_data["channel"]["username"]
+        extracted_data["usn_time"] = f"{channel_name}_{formatted_date}"
+    
+    return extracted_data
+
+@metrics.timed("stage_seconds", stage="district_search")
+def search_tiktok_videos() -> tuple:
     """
     Search TikTok videos based on keywords using Apify API and extract specific fields
     
+    Videos are written to the output file and the datastore as they are read, so
+    memory does not grow with the number of results.
+    
     Returns:
-        List[Dict]: List of dictionaries containing extracted video information
+        tuple: (number of videos, JSON file, Excel file)
     """
     # Initialize the ApifyClient
-    client = ApifyClient(CONFIG["API_KEY"])
+    client = make_client(CONFIG["API_KEY"])
     
     # Format the search term for the filename
     search_term = " ".join(CONFIG["SEARCH_KEYWORDS"])
@@ -46,7 +100,7 @@ def search_tiktok_videos() -> List[Dict[str, Any]]:
     # Setup directories
     json_data_dir = f"{CONFIG['PROJECT_FOLDER']}/{CONFIG['PROJECT_DIST']}"
     os.makedirs(json_data_dir, exist_ok=True)
-    output_file = f"{json_data_dir}/{search_slug}.json"
+    output_file = output_path(f"{json_data_dir}/{search_slug}.json")
     
     # Prepare the Actor input
     run_input = {
@@ -60,111 +114,183 @@ def search_tiktok_videos() -> List[Dict[str, Any]]:
     print(f"Searching TikTok for: {search_term}")
     print(f"Maximum items: {CONFIG['MAX_ITEMS']}")
     
-    # Run the Actor and wait for it to finish
-    run = client.actor(CONFIG["TIKTOK_SEARCH_ACTOR_ID"]).call(run_input=run_input)
-    
-    results = []
-    
-    # Fetch and process Actor results
+    # Run the Actor (or reuse a cached run) and process its results
     print("Processing search results...")
-    for item in client.dataset(run["defaultDatasetId"]).iterate_items():
-        # Extract only the requested fields
-        extracted_data = {
-            "title": item.get("title"),
-            "views": item.get("views"),
-            "likes": item.get("likes"),
-            "comments": item.get("comments"),
-            "shares": item.get("shares"),
-            "bookmarks": item.get("bookmarks"),
-            "hashtags": item.get("hashtags"),
-            "uploadedAt": item.get("uploadedAt"),
-            "uploadedAtFormatted": item.get("uploadedAtFormatted"),
-            "channel": {
-                "name": item.get("channel", {}).get("name"),
-                "username": item.get("channel", {}).get("username")
-            },
-            "postPage": item.get("postPage")
-        }
-        
-        # Format date and create identifier (similar to author_time in original code)
-        upload_time = item.get("uploadedAt")
-        if upload_time:
-            dt = datetime.fromtimestamp(upload_time)
-            formatted_date = dt.strftime('%Y_%d_%m')
-            channel_name = extracted_data["channel"]["username"]
-            extracted_data["usn_time"] = f"{channel_name}_{formatted_date}"
-        
-        results.append(extracted_data)
-    
-    # Save to JSON file
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=4)
+    items = iterate_actor_items(client, CONFIG["TIKTOK_SEARCH_ACTOR_ID"], run_input,
+                                bypass=CONFIG["BYPASS_CACHE"])
+    store = get_store()
+    # Each video is saved as it is read, so JSONL output survives an interrupted search,
+    # and recorded in the shared datastore for the later stages a batch at a time
+    with RecordWriter(output_file) as writer:
+        batch = []
+        for item in items:
+            extracted_data = extract_video(item)
+            writer.write(extracted_data)
+            batch.append(extracted_data)
+            if len(batch) >= CONFIG["STORE_BATCH_SIZE"]:
+                store.upsert_videos(batch, source=output_file)
+                batch = []
+        if batch:
+            store.upsert_videos(batch, source=output_file)
     
     print(f"Data has been saved to {output_file}")
-    print(f"Retrieved {len(results)} results")
+    print(f"Retrieved {writer.count} results")
     
     # Create Excel file
     excel_file = f"{json_data_dir}/{search_slug}.xlsx"
-    create_excel_file(results, excel_file)
+    create_excel_file(iter_records(output_file), excel_file)
     print(f"Excel file has been created: {excel_file}")
     
-    return results, output_file, excel_file
+    return writer.count, output_file, excel_file
+
+def search_shard(keywords: List[str], max_items: int) -> List[Dict[str, Any]]:
+    """Run one search actor run for keywords and return its videos"""
+    client = make_client(CONFIG["API_KEY"])
+    run_input = {
+        "maxItems": max_items,
+        "keywords": keywords,
+        "dateRange": CONFIG["DATE_RANGE"],
+        "location": CONFIG["LOCATION"],
+        "customMapFunction": "(object) => { return {...object} }"
+    }
+    items = iterate_actor_items(client, CONFIG["TIKTOK_SEARCH_ACTOR_ID"], run_input,
+                                bypass=CONFIG["BYPASS_CACHE"])
+    return [extract_video(item) for item in items]
+
+def plan_shards(districts: Dict[str, str], templates: List[str]) -> List[tuple]:
+    """(district folder, keyword) for every district x keyword template combination"""
+    shards = []
+    for district, name in districts.items():
+        for template in templates:
+            keyword = template.replace("{district}", name)
+            if (district, keyword) not in shards:
+                shards.append((district, keyword))
+    return shards
 
-def create_excel_file(data: List[Dict], filename: str):
+def save_district_results(district: str, keywords: List[str], shard_results: List[List[Dict]]):
+    """
+    Merge the shard results of one district and save them as JSON and Excel
+
+    Videos are deduplicated by postPage (falling back to usn_time); the first
+    shard, in keyword order, that found a video wins. The files are named after
+    the district's first keyword, as a single-keyword search would name them.
+    Returns (videos saved, JSON file, Excel file).
+    """
+    json_data_dir = f"{CONFIG['PROJECT_FOLDER']}/{district}"
+    os.makedirs(json_data_dir, exist_ok=True)
+    search_slug = keywords[0].replace(" ", "_")
+    output_file = output_path(f"{json_data_dir}/{search_slug}.json")
+    
+    seen = set()
+    duplicates = 0
+    with RecordWriter(output_file) as writer:
+        for videos in shard_results:
+            for video in videos:
+                key = video_key(video)
+                if key in seen:
+                    duplicates += 1
+                    continue
+                if key:
+                    seen.add(key)
+                writer.write(video)
+    metrics.incr("search_duplicates_total", duplicates, district=district)
+    
+    # Record the videos in the shared datastore for the later stages
+    store = get_store()
+    for batch in iter_batches(iter_records(output_file), CONFIG["STORE_BATCH_SIZE"]):
+        store.upsert_videos(batch, source=output_file)
+    
+    excel_file = f"{json_data_dir}/{search_slug}.xlsx"
+    create_excel_file(iter_records(output_file), excel_file)
+    print(f"{district}: {writer.count} videos saved to {output_file} and {excel_file} "
+          f"({duplicates} duplicates across {len(keywords)} keywords dropped)")
+    return writer.count, output_file, excel_file
+
+@metrics.timed("stage_seconds", stage="district_batch_search")
+def search_districts(districts: Dict[str, str] = None, templates: List[str] = None,
+                     max_items: int = None, concurrency: int = None) -> tuple:
+    """
+    Search every keyword x district combination and save one merged output per district
+
+    Each (district, keyword) shard is its own actor run; up to concurrency shards
+    run at once, within the shared Apify rate and concurrency limits. A district
+    is merged and saved as soon as its last shard finishes. A district with a
+    failed shard is not saved, so its files from an earlier search are kept
+    rather than overwritten with partial results.
+
+    Returns ({district: (videos saved, JSON file, Excel file)}, [failed districts]).
+    """
+    districts = districts or CONFIG["DISTRICTS"]
+    templates = templates or CONFIG["KEYWORD_TEMPLATES"]
+    max_items = max_items or CONFIG["MAX_ITEMS"]
+    concurrency = max(1, int(concurrency or CONFIG["BATCH_CONCURRENCY"]))
+    
+    shards = plan_shards(districts, templates)
+    keywords = {district: [keyword for d, keyword in shards if d == district] for district in districts}
+    print(f"Batch search: {len(shards)} shards ({len(districts)} districts x {len(templates)} keywords), "
+          f"up to {concurrency} actor runs at once")
+    
+    # Results of each district's shards, in keyword order, filled in as shards finish
+    results = {district: [None] * len(keywords[district]) for district in districts}
+    remaining = {district: len(keywords[district]) for district in districts}
+    saved = {}
+    failed = set()
+    
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(search_shard, [keyword], max_items): (district, keyword)
+            for district, keyword in shards
+        }
+        for future in as_completed(futures):
+            district, keyword = futures[future]
+            position = keywords[district].index(keyword)
+            try:
+                results[district][position] = future.result()
+                print(f"Shard {district} / {keyword}: {len(results[district][position])} videos")
+            except Exception as e:
+                print(f"Error searching {district} / {keyword}: {e}")
+                metrics.incr("search_shard_failures_total", district=district)
+                failed.add(district)
+                results[district][position] = []
+            
+            remaining[district] -= 1
+            if remaining[district] == 0:
+                shard_results = results.pop(district)
+                if district in failed:
+                    print(f"{district}: not saved because a shard failed; existing files are kept")
+                    continue
+                saved[district] = save_district_results(district, keywords[district], shard_results)
+    
+    total = sum(count for count, _, _ in saved.values())
+    print(f"\nBatch search finished: {total} unique videos across {len(saved)} districts")
+    if failed:
+        print(f"Districts not saved because of failed shards: {', '.join(sorted(failed))}")
+    return saved, sorted(failed)
+
+def create_excel_file(data: Iterable[Dict], filename: str):
     """
     Create an Excel file with specific fields from the TikTok data
     
     Args:
-        data (List[Dict]): List of dictionaries containing video data
+        data (Iterable[Dict]): Video data, streamed into the workbook row by row
         filename (str): Path to save the Excel file
     """
-    # Create a new workbook and select the active sheet
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "TikTok Data"
-    
-    # Get headers from config
     headers = CONFIG["EXCEL_HEADERS"]
     
-    # Style for header row
-    header_font = Font(bold=True)
-    header_fill = PatternFill(start_color=CONFIG["HEADER_COLOR"], 
-                             end_color=CONFIG["HEADER_COLOR"], 
-                             fill_type="solid")
-    header_alignment = Alignment(horizontal="center", vertical="center")
-    
-    # Write headers
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_num, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
-    
-    # Write data rows
-    for row_num, video in enumerate(data, 2):
-        # Fill in fields from the JSON data
-        ws.cell(row=row_num, column=1, value=video.get("usn_time", ""))
-        ws.cell(row=row_num, column=2, value=video.get("postPage", ""))
-        
-        # Leave other fields empty for manual filling
-        # eat_name (column 3), eat_addr (column 4), open_time (column 5), menu (column 6)
-    
-    # Adjust column widths
-    for col in ws.columns:
-        max_length = 0
-        column = col[0].column_letter  # Get the column letter
-        
-        for cell in col:
-            if cell.value:
-                cell_length = len(str(cell.value))
-                if cell_length > max_length:
-                    max_length = cell_length
-        
-        adjusted_width = (max_length + 2) * 1.2
-        ws.column_dimensions[column].width = adjusted_width
-    
-    # Save the workbook
-    wb.save(filename)
+    # Fill in fields from the JSON data; eat_name, eat_addr, open_time and menu
+    # are left empty for manual filling
+    rows = (
+        [video.get("usn_time", ""), video.get("postPage", "")] + [None] * (len(headers) - 2)
+        for video in data
+    )
+    write_excel_rows(
+        filename,
+        headers,
+        rows,
+        sheet_title="TikTok Data",
+        header_format=header_style(CONFIG["HEADER_COLOR"]),
+        column_width=lambda length: (length + 2) * 1.2
+    )
 
 def save_to_json(data: List[Dict], filename: str = None) -> str:
     """
@@ -208,19 +334,32 @@ def print_search_results(videos):
 
 def main():
     """Main function to execute the TikTok search"""
+    # --batch searches every CONFIG["KEYWORD_TEMPLATES"] x CONFIG["DISTRICTS"] combination
+    if '--batch' in sys.argv:
+        saved, failed = search_districts()
+        print("\nResults have been saved to:")
+        for district, (count, json_file, excel_file) in saved.items():
+            print(f"- {district}: {json_file}, {excel_file} ({count} videos)")
+        if failed:
+            sys.exit(1)
+        return
+    
     print(f"Starting TikTok search for: {' '.join(CONFIG['SEARCH_KEYWORDS'])}")
     print(f"Project folder: {CONFIG['PROJECT_FOLDER']}/{CONFIG['PROJECT_DIST']}")
     print(f"Max items: {CONFIG['MAX_ITEMS']}")
     
     # Search for TikTok videos
-    videos, json_file, excel_file = search_tiktok_videos()
+    count, json_file, excel_file = search_tiktok_videos()
     
-    # Print the results
-    print_search_results(videos)
+    # Print the results, streamed back from the saved file
+    print_search_results(iter_records(json_file))
     
     print(f"\nResults have been saved to:")
     print(f"- JSON: {json_file}")
     print(f"- Excel: {excel_file}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    try:
+        main()
+    finally:
+        metrics.write_report("search_district")
\ No newline at end of file
@@ -0,0 +1,93 @@
+import os
+import cv2
+import numpy as np
+
+def phash(image, hash_size=8, highfreq_factor=4):
+    """
+    Perceptual hash of an image (BGR or grayscale array) as a 64-bit int
+
+    The image is shrunk to 32x32 grayscale, transformed with a DCT and the
+    8x8 low-frequency block is thresholded at its median.
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    size = hash_size * highfreq_factor
+    small = cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_freq = cv2.dct(small)[:hash_size, :hash_size]
+    bits = (low_freq > np.median(low_freq)).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+def phash_file(path):
+    """Perceptual hash of an image file, or None if it cannot be read"""
+    image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return None
+    return phash(image)
+
+def hamming(hash_a, hash_b):
+    """Number of differing bits between two hashes"""
+    return bin(hash_a ^ hash_b).count('1')
+
+def is_near_duplicate(image_hash, kept_hashes, threshold):
+    """Check whether a hash lies within threshold bits of any kept hash"""
+    return any(hamming(image_hash, kept) <= threshold for kept in kept_hashes)
+
+# Number of set bits for every byte value, used to popcount whole arrays at once
+_POPCOUNT8 = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+class PHashIndex:
+    """
+    Persistent perceptual-hash index of every image ingested so far
+
+    Hashes live in a NumPy uint64 array so a lookup is one vectorized XOR and
+    popcount over the whole index. The index is stored as an .npz file.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._hashes = np.empty(0, dtype=np.uint64)
+        self._pending = []
+        self.paths = []
+
+        if os.path.exists(self.path):
+            with np.load(self.path, allow_pickle=False) as data:
+                self._hashes = data['hashes'].astype(np.uint64)
+                self.paths = data['paths'].tolist()
+            print(f"Loaded perceptual-hash index with {len(self.paths)} images from {self.path}")
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _all_hashes(self):
+        """Merge hashes added since the last lookup into the array"""
+        if self._pending:
+            self._hashes = np.concatenate([self._hashes, np.array(self._pending, dtype=np.uint64)])
+            self._pending = []
+        return self._hashes
+
+    def find(self, image_hash, threshold):
+        """Return the stored path closest to image_hash if within threshold bits, else None"""
+        hashes = self._all_hashes()
+        if not len(hashes):
+            return None
+        xor = np.bitwise_xor(hashes, np.uint64(image_hash))
+        distances = _POPCOUNT8[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+        candidates = np.flatnonzero(distances <= threshold)
+        for best in candidates[np.argsort(distances[candidates], kind='stable')]:
+            # Skip entries whose file has been removed since it was indexed
+            if os.path.exists(self.paths[best]):
+                return self.paths[best]
+        return None
+
+    def add(self, image_hash, path):
+        """Add an image to the index"""
+        self._pending.append(image_hash)
+        self.paths.append(path)
+
+    def save(self):
+        """Write the index to disk atomically"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, hashes=self._all_hashes(), paths=np.array(self.paths, dtype=str))
+        os.replace(tmp_path, self.path)
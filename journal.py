@@ -0,0 +1,64 @@
+import json
+import os
+import threading
+import time
+
+class StageJournal:
+    """
+    Append-only journal recording which stages each usn_time has completed
+
+    Every completed stage is one JSON line: {"usn_time", "stage", "data", "ts"}.
+    The data dict holds whatever the stage wrote into the item (paths, counts) so
+    a restarted run can restore it without redoing the work.
+    """
+
+    def __init__(self, path, resume=True):
+        self.path = str(path)
+        self.entries = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        if not resume and os.path.exists(self.path):
+            os.remove(self.path)
+        self._load()
+
+    def _load(self):
+        """Replay the journal file into memory"""
+        if not os.path.exists(self.path):
+            return
+        complete = 0
+        with open(self.path, 'rb') as f:
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    # A crash left a partially written last line
+                    break
+                complete += len(raw)
+                try:
+                    entry = json.loads(raw.decode('utf-8'))
+                except ValueError:
+                    continue
+                self.entries[(entry["usn_time"], entry["stage"])] = entry.get("data") or {}
+        if complete < os.path.getsize(self.path):
+            # Cut the fragment off so the next record starts on a line of its own
+            with open(self.path, 'r+b') as f:
+                f.truncate(complete)
+        if self.entries:
+            print(f"Journal {self.path}: {len(self.entries)} completed stages found, resuming")
+
+    def is_done(self, usn_time, stage):
+        """Check whether a stage has been completed for a usn_time"""
+        return (usn_time, stage) in self.entries
+
+    def get(self, usn_time, stage):
+        """Return the data recorded for a completed stage, or None"""
+        return self.entries.get((usn_time, stage))
+
+    def mark_done(self, usn_time, stage, data=None):
+        """Record a completed stage and flush it to disk immediately"""
+        entry = {"usn_time": usn_time, "stage": stage, "data": data or {}, "ts": time.time()}
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.entries[(usn_time, stage)] = entry["data"]
@@ -0,0 +1,192 @@
+import argparse
+import os
+import re
+import shutil
+import tempfile
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import cv2
+import numpy as np
+
+# Synthetic media configuration
+MEDIA_SERVER_CONFIG = {
+    "VARIANTS": 8,          # Distinct videos generated; each requested video ID maps to one of them
+    "WIDTH": 360,
+    "HEIGHT": 640,
+    "FPS": 24,
+    "SECONDS": 8,           # Length of each video
+    "SCENE_SECONDS": 2,     # A new scene (colour and shapes) every this many seconds
+    "AVATAR_SIZE": 100,
+}
+
+def _scene(rng, width, height):
+    """Background colour and shapes of one scene"""
+    colour = tuple(int(c) for c in rng.integers(0, 256, 3))
+    shapes = [
+        (tuple(int(v) for v in rng.integers(0, [width, height])), int(rng.integers(20, width // 3)),
+         tuple(int(c) for c in rng.integers(0, 256, 3)))
+        for _ in range(4)
+    ]
+    return colour, shapes
+
+def render_video(path, seed, width=360, height=640, fps=24, seconds=8, scene_seconds=2):
+    """Write an MP4 whose scenes change every scene_seconds, with moving shapes inside each scene"""
+    rng = np.random.default_rng(seed)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError("OpenCV cannot write MP4 files (mp4v codec missing)")
+    scene = None
+    for index in range(fps * seconds):
+        if index % (fps * scene_seconds) == 0:
+            scene = _scene(rng, width, height)
+        colour, shapes = scene
+        frame = np.full((height, width, 3), colour, dtype=np.uint8)
+        for (x, y), radius, shape_colour in shapes:
+            cv2.circle(frame, ((x + index * 3) % width, y), radius, shape_colour, -1)
+        cv2.putText(frame, f"{seed}:{index}", (10, height - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+        writer.write(frame)
+    writer.release()
+
+def render_image(seed, width, height):
+    """JPEG bytes of a random gradient with a circle, distinct per seed"""
+    rng = np.random.default_rng(seed)
+    start, end = rng.integers(0, 256, (2, 3))
+    ramp = np.linspace(0, 1, height)[:, None, None]
+    image = np.broadcast_to(start + (end - start) * ramp, (height, width, 3)).astype(np.uint8).copy()
+    centre = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+    cv2.circle(image, centre, min(width, height) // 3, tuple(int(c) for c in rng.integers(0, 256, 3)), -1)
+    ok, encoded = cv2.imencode('.jpg', image)
+    if not ok:
+        raise RuntimeError("OpenCV cannot encode JPEG images")
+    return encoded.tobytes()
+
+def _seed(name):
+    return zlib.crc32(name.encode('utf-8'))
+
+class MediaServer(ThreadingHTTPServer):
+    """
+    Local HTTP server for synthetic TikTok media
+
+    GET /video/<id>.mp4 serves one of VARIANTS pre-rendered MP4s (with Range
+    support, so resumed downloads and streamed decoding behave as against a CDN),
+    /cover/<id>.jpg and /avatar/<name>.jpg serve JPEGs generated from the name.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, workdir=None, variants=None):
+        super().__init__(address, MediaHandler)
+        self.owns_workdir = workdir is None
+        self.workdir = workdir or tempfile.mkdtemp(prefix="bench_media_")
+        os.makedirs(self.workdir, exist_ok=True)
+        self.videos = []
+        for variant in range(variants or MEDIA_SERVER_CONFIG["VARIANTS"]):
+            path = os.path.join(self.workdir, f"variant_{variant}.mp4")
+            if not os.path.exists(path):
+                render_video(path, variant, MEDIA_SERVER_CONFIG["WIDTH"], MEDIA_SERVER_CONFIG["HEIGHT"],
+                             MEDIA_SERVER_CONFIG["FPS"], MEDIA_SERVER_CONFIG["SECONDS"],
+                             MEDIA_SERVER_CONFIG["SCENE_SECONDS"])
+            self.videos.append(path)
+        self.images = {}
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def image(self, kind, name):
+        key = (kind, name)
+        with self._lock:
+            if key not in self.images:
+                if kind == "avatar":
+                    size = MEDIA_SERVER_CONFIG["AVATAR_SIZE"]
+                    self.images[key] = render_image(_seed(name), size, size)
+                else:
+                    self.images[key] = render_image(_seed(name), MEDIA_SERVER_CONFIG["WIDTH"],
+                                                    MEDIA_SERVER_CONFIG["HEIGHT"])
+            return self.images[key]
+
+    def video_path(self, name):
+        return self.videos[_seed(name) % len(self.videos)]
+
+    def close(self):
+        self.server_close()
+        if self.owns_workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+class MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Accept-Ranges", "bytes")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+            with self.server._lock:
+                self.server.bytes_sent += len(body)
+
+    def do_GET(self):
+        match = re.fullmatch(r'/(video|cover|avatar)/([^/]+)\.(mp4|jpg)', urlparse(self.path).path)
+        if not match:
+            return self._send(404, "text/plain", b"not found")
+        kind, name, _ = match.groups()
+
+        if kind != "video":
+            return self._send(200, "image/jpeg", self.server.image(kind, name))
+
+        with open(self.server.video_path(name), 'rb') as f:
+            data = f.read()
+        range_header = self.headers.get("Range")
+        if range_header:
+            range_match = re.fullmatch(r'bytes=(\d+)-(\d*)', range_header.strip())
+            if not range_match:
+                return self._send(416, "text/plain", b"", {"Content-Range": f"bytes */{len(data)}"})
+            start = int(range_match.group(1))
+            end = int(range_match.group(2)) if range_match.group(2) else len(data) - 1
+            if start >= len(data):
+                return self._send(416, "text/plain", b"", {"Content-Range": f"bytes */{len(data)}"})
+            end = min(end, len(data) - 1)
+            return self._send(206, "video/mp4", data[start:end + 1],
+                              {"Content-Range": f"bytes {start}-{end}/{len(data)}"})
+        self._send(200, "video/mp4", data)
+
+    do_HEAD = do_GET
+
+def start_server(host="127.0.0.1", port=0, **options):
+    """Start a MediaServer in a daemon thread and return it (port 0 picks a free port)"""
+    server = MediaServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, name="media-server", daemon=True).start()
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve synthetic MP4s, covers and avatars over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--workdir", default=None, help="Folder for the rendered videos (default: temp folder)")
+    parser.add_argument("--variants", type=int, default=MEDIA_SERVER_CONFIG["VARIANTS"])
+    args = parser.parse_args(argv)
+
+    server = MediaServer((args.host, args.port), workdir=args.workdir, variants=args.variants)
+    print(f"Synthetic media server on {server.url} ({len(server.videos)} videos in {server.workdir})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+if __name__ == "__main__":
+    main()
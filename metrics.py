@@ -0,0 +1,196 @@
+import json
+import os
+import re
+import threading
+import time
+from contextlib import ContextDecorator
+from datetime import datetime
+
+# Metrics configuration
+METRICS_CONFIG = {
+    "REPORT_DIR": "./run_reports",  # Run reports are written here as <name>_<timestamp>.json/.prom
+    "PREFIX": "quanan_",            # Prefix of every Prometheus metric name
+}
+
+class Metrics:
+    """
+    Thread-safe registry of counters and timers for one process
+
+    Counters are plain sums. Timers keep count, sum, min and max of the observed
+    durations. Both are keyed by a metric name and a set of labels, e.g.
+    ("actor_run_seconds", {"actor": "..."}).
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {}
+        self.timers = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def incr(self, name, value=1, **labels):
+        """Add value to a counter"""
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """Record one duration in a timer"""
+        key = self._key(name, labels)
+        with self._lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                self.timers[key] = [1, seconds, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = min(timer[2], seconds)
+                timer[3] = max(timer[3], seconds)
+
+    def timed(self, name, **labels):
+        """Context manager and decorator that observes the wall time of a block"""
+        return _Timed(self, name, labels)
+
+    def drain(self):
+        """Return a picklable snapshot of everything recorded so far and reset the registry"""
+        with self._lock:
+            snapshot = (dict(self.counters), {key: list(value) for key, value in self.timers.items()})
+            self.counters.clear()
+            self.timers.clear()
+        return snapshot
+
+    def merge(self, snapshot):
+        """Add a snapshot taken with drain() (e.g. in a worker process) into this registry"""
+        counters, timers = snapshot
+        with self._lock:
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, (count, total, low, high) in timers.items():
+                timer = self.timers.get(key)
+                if timer is None:
+                    self.timers[key] = [count, total, low, high]
+                else:
+                    timer[0] += count
+                    timer[1] += total
+                    timer[2] = min(timer[2], low)
+                    timer[3] = max(timer[3], high)
+
+    def _total(self, counters, name):
+        return sum(value for (metric, _), value in counters.items() if metric == name)
+
+    def _seconds(self, timers, name):
+        return sum(timer[1] for (metric, _), timer in timers.items() if metric == name)
+
+    def report(self):
+        """Return the run report as a JSON-serialisable dict"""
+        with self._lock:
+            counters = dict(self.counters)
+            timers = {key: list(value) for key, value in self.timers.items()}
+
+        def labelled(key):
+            return {"name": key[0], "labels": dict(key[1])}
+
+        # Throughput figures that are easier to compare between runs than raw sums
+        frame_seconds = self._seconds(timers, "frame_extraction_seconds")
+        download_seconds = self._seconds(timers, "download_seconds")
+        derived = {
+            "frames_per_second": self._total(counters, "frames_decoded_total") / frame_seconds if frame_seconds else None,
+            "download_mb_per_second": (self._total(counters, "download_bytes_total") / 1048576 / download_seconds
+                                       if download_seconds else None),
+            "actor_runs": self._total(counters, "actor_runs_total"),
+            "cache_hits": self._total(counters, "actor_cache_hits_total"),
+            "retries": self._total(counters, "actor_retries_total") + self._total(counters, "download_retries_total"),
+            "failures": sum(value for (metric, _), value in counters.items() if metric.endswith("_failures_total")),
+        }
+
+        return {
+            "started": datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            "elapsed_seconds": time.time() - self.started,
+            "derived": derived,
+            "counters": [dict(labelled(key), value=value) for key, value in sorted(counters.items())],
+            "timers": [
+                dict(labelled(key), count=count, sum=total, min=low, max=high, avg=total / count)
+                for key, (count, total, low, high) in sorted(timers.items())
+            ],
+        }
+
+    def prometheus(self):
+        """Return the metrics in the Prometheus text exposition format"""
+        prefix = METRICS_CONFIG["PREFIX"]
+        with self._lock:
+            counters = sorted(self.counters.items())
+            timers = sorted(self.timers.items())
+
+        def series(name, labels, suffix=""):
+            name = re.sub(r'[^a-zA-Z0-9_]', '_', prefix + name) + suffix
+            if not labels:
+                return name
+            rendered = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+            return f"{name}{{{rendered}}}"
+
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {prefix}{name} counter")
+                typed.add(name)
+            lines.append(f"{series(name, labels)} {value}")
+        for (name, labels), (count, total, _, high) in timers:
+            if name not in typed:
+                lines.append(f"# TYPE {prefix}{name} summary")
+                typed.add(name)
+            lines.append(f"{series(name, labels, '_count')} {count}")
+            lines.append(f"{series(name, labels, '_sum')} {total:.6f}")
+            lines.append(f"{series(name, labels + (('quantile', '1'),))} {high:.6f}")
+        lines.append(f"# TYPE {prefix}run_elapsed_seconds gauge")
+        lines.append(f"{prefix}run_elapsed_seconds {time.time() - self.started:.3f}")
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, name, report_dir=None):
+        """
+        Write <name>_<timestamp>.json and .prom to the report folder and return their paths
+
+        Nothing is written (and None is returned) when nothing was recorded.
+        """
+        with self._lock:
+            if not self.counters and not self.timers:
+                return None
+        report_dir = report_dir or METRICS_CONFIG["REPORT_DIR"]
+        os.makedirs(report_dir, exist_ok=True)
+        stem = os.path.join(report_dir, f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+
+        with open(f"{stem}.json", 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=4)
+        with open(f"{stem}.prom", 'w', encoding='utf-8') as f:
+            f.write(self.prometheus())
+
+        print(f"Run report written to {stem}.json and {stem}.prom")
+        return f"{stem}.json", f"{stem}.prom"
+
+def _escape(value):
+    """Escape a Prometheus label value"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class _Timed(ContextDecorator):
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self._starts = threading.local()
+
+    def __enter__(self):
+        stack = getattr(self._starts, "stack", None)
+        if stack is None:
+            stack = self._starts.stack = []
+        stack.append(time.perf_counter())
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, time.perf_counter() - self._starts.stack.pop(), **self.labels)
+        return False
+
+# Registry shared by everything running in this process
+metrics = Metrics()
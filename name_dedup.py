@@ -0,0 +1,118 @@
+import random
+import re
+import unicodedata
+import zlib
+from collections import Counter, defaultdict
+
+# Generic words that open many restaurant names and say nothing about which place it is
+GENERIC_PREFIXES = ("quan an", "quan", "nha hang", "tiem", "cua hang")
+
+# Shortest rest of a name, after a generic prefix, that is distinctive enough to
+# stand on its own; shorter or all-digit rests ("Quán 5") keep their prefix
+MIN_CORE_LENGTH = 3
+
+# Modulus of the MinHash permutations (a Mersenne prime above the 32-bit hash range)
+_PRIME = (1 << 61) - 1
+
+def normalize_name(name):
+    """
+    Comparison form of a restaurant name
+
+    Vietnamese diacritics are removed (đ becomes d), case and punctuation are
+    dropped, runs of whitespace collapse to one space and a leading generic word
+    such as "Quán" or "Nhà hàng" is stripped, unless what remains is shorter than
+    MIN_CORE_LENGTH or only digits.
+
+    >>> normalize_name("Quán Ốc Đào"), normalize_name("Nhà hàng Ốc Đào")
+    ('oc dao', 'oc dao')
+    >>> normalize_name("Quán 5"), normalize_name("Nhà hàng 5")
+    ('quan 5', 'nha hang 5')
+    >>> group_names(["Quán 5", "Nhà hàng 5", "Quán Ốc Đào", "Ốc Đào"])
+    [['Quán 5'], ['Nhà hàng 5'], ['Quán Ốc Đào', 'Ốc Đào']]
+    """
+    text = unicodedata.normalize('NFD', str(name).replace('đ', 'd').replace('Đ', 'D'))
+    text = ''.join(c for c in text if not unicodedata.combining(c)).casefold()
+    text = ' '.join(re.sub(r'[^0-9a-z]+', ' ', text).split())
+    for prefix in GENERIC_PREFIXES:
+        if text.startswith(prefix + ' '):
+            core = text[len(prefix) + 1:]
+            if len(core) >= MIN_CORE_LENGTH and re.search(r'[a-z]', core):
+                text = core
+            break
+    return text
+
+def trigrams(text):
+    """Character trigrams of a normalized name, padded so short names still have some"""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+def _minhash_signature(grams, coefficients):
+    hashes = [zlib.crc32(gram.encode('utf-8')) for gram in grams]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in coefficients]
+
+class _UnionFind:
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, x):
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, x, y):
+        root_x, root_y = self.find(x), self.find(y)
+        if root_x != root_y:
+            self.parent[max(root_x, root_y)] = min(root_x, root_y)
+
+def group_names(names, threshold=0.8, num_perm=16, bands=8, max_bucket=50):
+    """
+    Group restaurant names that refer to the same place
+
+    Names are first grouped by their normalized form. Distinct normalized forms
+    are then blocked with MinHash LSH over character trigrams: only names sharing
+    a band bucket are compared, by trigram Jaccard similarity against threshold,
+    so the cost grows with the number of names rather than its square. Each
+    bucket compares a new name against at most max_bucket earlier ones.
+
+    Returns a list of groups, each a list of the distinct original names with the
+    most frequent spelling first, in order of first appearance.
+    """
+    counts = Counter(name for name in names if name)
+    spellings = defaultdict(list)
+    for name in counts:
+        spellings[normalize_name(name)].append(name)
+
+    keys = [key for key in spellings if key]
+    grams = [trigrams(key) for key in keys]
+    union_find = _UnionFind(len(keys))
+
+    rows = max(1, num_perm // bands)
+    # Fixed seed so the same names always land in the same buckets
+    rng = random.Random(0)
+    coefficients = [(rng.randrange(1, _PRIME), rng.randrange(_PRIME)) for _ in range(rows * bands)]
+    buckets = defaultdict(list)
+    for index, key_grams in enumerate(grams):
+        signature = _minhash_signature(key_grams, coefficients)
+        for band in range(bands):
+            bucket = buckets[(band, tuple(signature[band * rows:(band + 1) * rows]))]
+            for other in bucket[-max_bucket:]:
+                if union_find.find(index) != union_find.find(other) and jaccard(key_grams, grams[other]) >= threshold:
+                    union_find.union(index, other)
+            bucket.append(index)
+
+    members = defaultdict(list)
+    for index, key in enumerate(keys):
+        members[union_find.find(index)].extend(spellings[key])
+
+    order = {name: position for position, name in enumerate(counts)}
+    groups = [
+        sorted(group, key=lambda name: (-counts[name], order[name]))
+        for group in members.values()
+    ]
+    # Names that normalize to nothing (only punctuation) are kept as their own groups
+    groups.extend([name] for name in spellings.get('', []))
+    return sorted(groups, key=lambda group: min(order[name] for name in group))
@@ -0,0 +1,221 @@
+import queue
+import sys
+import threading
+import time
+import traceback
+
+import upd_orig_json_get_all_quanan2 as search_stage
+import get_img_vid_each_quanan3 as media_stage
+import extract_cmt4 as comments_stage
+from journal import StageJournal
+from metrics import metrics
+from records import iter_records
+
+# Pipeline configuration; each stage's own settings stay in its script's CONFIG
+PIPELINE_CONFIG = {
+    "SEARCH_WORKERS": search_stage.CONFIG["SEARCH_CONCURRENCY"],  # Restaurant searches in flight
+    "MEDIA_WORKERS": 2,       # JSON files going through the media stage at once
+    "COMMENT_WORKERS": 4,     # Videos whose comments are extracted at once
+    "QUEUE_SIZE": 32,         # Items buffered between two stages before upstream waits
+}
+
+# Marks the end of a stage's input
+_DONE = object()
+
+class Stage:
+    """
+    One pipeline stage: fn(item) returns an iterable of items for the next stage
+
+    Items are processed by a pool of worker threads reading a bounded input queue.
+    A failing item is reported and dropped; the other items keep flowing.
+    """
+
+    def __init__(self, name, fn, workers=1):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, int(workers))
+        self.processed = 0
+        self.emitted = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _record(self, emitted, failed, seconds):
+        with self._lock:
+            self.processed += 1
+            self.emitted += emitted
+            self.failed += int(failed)
+            self.busy_seconds += seconds
+
+def _run_source(source, output, stage):
+    start = time.perf_counter()
+    emitted = 0
+    failed = False
+    try:
+        for item in source:
+            emitted += 1
+            output.put(item)
+    except Exception as e:
+        failed = True
+        print(f"[pipeline] source failed: {e}")
+        print(traceback.format_exc())
+        metrics.incr("stage_failures_total", stage=stage.name)
+    finally:
+        stage._record(emitted, failed, time.perf_counter() - start)
+        output.put(_DONE)
+
+def _run_worker(stage, input_queue, output_queue, remaining):
+    while True:
+        item = input_queue.get()
+        if item is _DONE:
+            # Let the sibling workers see the end marker too
+            input_queue.put(_DONE)
+            break
+
+        start = time.perf_counter()
+        emitted = 0
+        failed = False
+        try:
+            for result in stage.fn(item) or ():
+                emitted += 1
+                if output_queue is not None:
+                    output_queue.put(result)
+        except Exception as e:
+            failed = True
+            print(f"[pipeline] {stage.name} failed: {e}")
+            metrics.incr("stage_failures_total", stage=stage.name)
+        stage._record(emitted, failed, time.perf_counter() - start)
+        metrics.observe("pipeline_item_seconds", time.perf_counter() - start, stage=stage.name)
+
+    # The last worker of the stage closes the next queue
+    with remaining["lock"]:
+        remaining["count"] -= 1
+        last = remaining["count"] == 0
+    if last:
+        # Time from pipeline start until the stage drained its last item
+        metrics.observe("stage_seconds", time.perf_counter() - remaining["start"], stage=stage.name)
+        if output_queue is not None:
+            output_queue.put(_DONE)
+
+def run_pipeline(source, stages, queue_size=32):
+    """
+    Run stages connected by bounded queues, each with its own worker pool
+
+    source is an iterable of items for the first stage. Every stage starts on an
+    item as soon as the upstream stage emits it, and a full queue makes the
+    upstream stage wait, so memory stays bounded. Returns a "source" stage
+    followed by the stages, with their counters filled in; the source counts as
+    failed if iterating it raised.
+    """
+    source_stage = Stage("source", None)
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    threads = [threading.Thread(target=_run_source, args=(source, queues[0], source_stage),
+                                name="source", daemon=True)]
+
+    for position, stage in enumerate(stages):
+        output_queue = queues[position + 1] if position + 1 < len(stages) else None
+        remaining = {"count": stage.workers, "lock": threading.Lock(), "start": time.perf_counter()}
+        for worker in range(stage.workers):
+            threads.append(threading.Thread(
+                target=_run_worker,
+                args=(stage, queues[position], output_queue, remaining),
+                name=f"{stage.name}-{worker + 1}",
+                daemon=True
+            ))
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    print(f"\n===== PIPELINE FINISHED in {elapsed:.1f}s =====")
+    stages = [source_stage] + list(stages)
+    for stage in stages:
+        print(f"{stage.name:<10} workers={stage.workers:<3} processed={stage.processed:<5} "
+              f"emitted={stage.emitted:<5} failed={stage.failed:<4} busy={stage.busy_seconds:.1f}s")
+    return stages
+
+def restaurant_source():
+    """Update the district JSON from Excel and yield one name group per restaurant"""
+    updated_json_path = search_stage.task1_update_json()
+    if not updated_json_path:
+        raise RuntimeError("Cannot start the pipeline because Task 1 failed.")
+
+    _, groups = search_stage.restaurant_groups(search_stage.load_existing_data(updated_json_path))
+    print(f"Streaming {len(groups)} restaurants through the pipeline")
+    yield from groups
+
+def search_restaurant(group):
+    """Search one restaurant and emit the JSON file the media stage reads"""
+    json_files, count = search_stage.search_and_save(group, search_stage.CONFIG["MAX_ITEMS"],
+                                                     search_stage.CONFIG["OUTPUT_DIR"])
+    # Other spellings hold the same videos, so only the first file is processed further
+    if count:
+        yield json_files[0]
+
+def process_media(json_file):
+    """Download the media of one restaurant file and emit its videos for the comment stage"""
+    processed_json = media_stage.process_json_file(media_stage.CONFIG["API_KEY"], json_file)
+    if not processed_json:
+        raise RuntimeError(f"media stage produced no output for {json_file}")
+
+    for item in iter_records(processed_json):
+        if item.get('postPage'):
+            yield processed_json, item
+
+_comment_journals = {}
+_comment_journals_lock = threading.Lock()
+
+def comment_journal(processed_json):
+    """Journal of a processed JSON file, shared by the comment workers"""
+    with _comment_journals_lock:
+        if processed_json not in _comment_journals:
+            path = processed_json.rsplit('.', 1)[0] + ".journal.jsonl"
+            _comment_journals[processed_json] = StageJournal(path, resume=comments_stage.CONFIG["RESUME"])
+        return _comment_journals[processed_json]
+
+def extract_comments(entry):
+    """Extract the comments of one video"""
+    processed_json, item = entry
+    ok = comments_stage.process_item_comments(
+        item,
+        comments_stage.CONFIG["API_KEY"],
+        comments_stage.CONFIG["MAX_COMMENTS"],
+        comments_stage.CONFIG["TOP_COMMENTS"],
+        journal=comment_journal(processed_json)
+    )
+    if not ok:
+        raise RuntimeError(f"comments failed for {item.get('usn_time') or item.get('postPage')}")
+    return ()
+
+def build_stages():
+    """The search -> media -> comments stages with their configured worker counts"""
+    return [
+        Stage("search", search_restaurant, PIPELINE_CONFIG["SEARCH_WORKERS"]),
+        Stage("media", process_media, PIPELINE_CONFIG["MEDIA_WORKERS"]),
+        Stage("comments", extract_comments, PIPELINE_CONFIG["COMMENT_WORKERS"]),
+    ]
+
+def main():
+    # Check if we have command line arguments
+    if len(sys.argv) > 1:
+        if sys.argv[1] == '--help' or sys.argv[1] == '-h':
+            print("Usage: python pipeline.py [input_json] [input_excel]")
+            print("  input_json:  District JSON to update and search restaurants for")
+            print("  input_excel: Filled-in Excel file, folder of *_v2.xlsx files or glob")
+            sys.exit(0)
+        search_stage.CONFIG["INPUT_JSON_PATH"] = sys.argv[1]
+        if len(sys.argv) > 2:
+            search_stage.CONFIG["INPUT_EXCEL_PATH"] = sys.argv[2]
+
+    try:
+        stages = run_pipeline(restaurant_source(), build_stages(), queue_size=PIPELINE_CONFIG["QUEUE_SIZE"])
+    finally:
+        metrics.write_report("pipeline")
+    if any(stage.failed for stage in stages):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
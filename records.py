@@ -0,0 +1,175 @@
+import itertools
+import json
+import os
+
+# Output format of the JSON record files written by every stage
+RECORDS_CONFIG = {
+    # "json" writes an indented array (the original format), "jsonl" one record per line,
+    # appended and flushed as each record is produced so a crashed run keeps its output
+    "FORMAT": os.environ.get("QUANAN_OUTPUT_FORMAT", "json"),
+    "READ_CHUNK_SIZE": 1024 * 1024,  # Characters read at a time when streaming a JSON array
+}
+
+# Extensions of record files, in either format
+RECORD_EXTENSIONS = (".json", ".jsonl")
+
+def output_path(path, fmt=None):
+    """path with the extension of the output format (.json or .jsonl)"""
+    fmt = fmt or RECORDS_CONFIG["FORMAT"]
+    base, _ = os.path.splitext(str(path))
+    return base + (".jsonl" if fmt == "jsonl" else ".json")
+
+def record_globs(stem_pattern):
+    """Glob patterns matching stem_pattern in either record format, e.g. '*_processed'"""
+    return [stem_pattern + extension for extension in RECORD_EXTENSIONS]
+
+def _skip_whitespace(buffer, pos):
+    while pos < len(buffer) and buffer[pos].isspace():
+        pos += 1
+    return pos
+
+def _iter_json_array(f, chunk_size):
+    """Yield the elements of a JSON array one at a time, reading the file in chunks"""
+    decoder = json.JSONDecoder()
+    buffer = f.read(chunk_size)
+    pos = _skip_whitespace(buffer, 0)
+    if buffer[pos:pos + 1] != '[':
+        raise ValueError("Expected a JSON array")
+    pos += 1
+
+    while True:
+        # Move to the start of the next element, reading more input when the buffer runs out
+        while True:
+            pos = _skip_whitespace(buffer, pos)
+            if pos < len(buffer):
+                if buffer[pos] != ',':
+                    break
+                pos += 1
+                continue
+            more = f.read(chunk_size)
+            if not more:
+                raise ValueError("Unexpected end of JSON array")
+            buffer, pos = buffer[pos:] + more, 0
+
+        if buffer[pos] == ']':
+            return
+        try:
+            value, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # The element continues past the end of the buffer
+            more = f.read(chunk_size)
+            if not more:
+                raise
+            buffer, pos = buffer[pos:] + more, 0
+            continue
+        yield value
+        pos = end
+        if pos >= chunk_size:
+            buffer, pos = buffer[pos:], 0
+
+def _iter_json_lines(f, path):
+    """Yield one record per non-empty line; a truncated last line is reported and skipped"""
+    for number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            # A crash can leave a partially written last line
+            print(f"Skipping unreadable line {number} of {path}")
+
+def iter_records(path):
+    """
+    Stream the records of a JSON array file or a JSONL file
+
+    The format is detected from the first character, so readers accept output
+    written in either format. Only one record is held in memory at a time.
+    """
+    chunk_size = RECORDS_CONFIG["READ_CHUNK_SIZE"]
+    with open(path, 'r', encoding='utf-8') as f:
+        start = f.read(chunk_size)
+        first = start.lstrip()[:1]
+        f.seek(0)
+        if not first:
+            return
+        if first == '[':
+            yield from _iter_json_array(f, chunk_size)
+        else:
+            yield from _iter_json_lines(f, path)
+
+def load_records(path):
+    """All records of a JSON array or JSONL file as a list"""
+    return list(iter_records(path))
+
+def iter_batches(iterable, size):
+    """Yield lists of up to size items from iterable"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, max(1, size)))
+        if not batch:
+            return
+        yield batch
+
+class RecordWriter:
+    """
+    Write records to a file as they are produced
+
+    In "jsonl" format every record is appended as one line and flushed, so the
+    file always holds everything produced so far. In "json" format the records
+    are streamed into an indented array in a temporary file that replaces path
+    when the writer is closed without error, so path never holds a partial array.
+    Use as a context manager.
+    """
+
+    def __init__(self, path, fmt=None, append=False):
+        self.fmt = fmt or RECORDS_CONFIG["FORMAT"]
+        self.path = str(path)
+        self.count = 0
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        if self.fmt == "jsonl":
+            self._target = self.path
+            self._file = open(self.path, 'a' if append else 'w', encoding='utf-8')
+        else:
+            self._target = f"{self.path}.tmp"
+            self._file = open(self._target, 'w', encoding='utf-8')
+            self._file.write("[")
+
+    def write(self, record):
+        if self.fmt == "jsonl":
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+        else:
+            # Same layout as json.dump(records, f, indent=4)
+            rendered = json.dumps(record, ensure_ascii=False, indent=4).replace("\n", "\n    ")
+            self._file.write(("," if self.count else "") + "\n    " + rendered)
+        self.count += 1
+
+    def write_many(self, records):
+        for record in records:
+            self.write(record)
+
+    def close(self, discard=False):
+        if self._file.closed:
+            return
+        if self.fmt != "jsonl":
+            self._file.write("\n]" if self.count else "]")
+        self._file.close()
+        if self.fmt != "jsonl":
+            if discard:
+                os.remove(self._target)
+            else:
+                os.replace(self._target, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # A failed JSON array is dropped; JSONL keeps the records written so far
+        self.close(discard=exc_type is not None)
+        return False
+
+def write_records(path, records, fmt=None):
+    """Write an iterable of records to path in the given format and return the record count"""
+    with RecordWriter(path, fmt) as writer:
+        writer.write_many(records)
+    return writer.count
@@ -0,0 +1,80 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+
+# File extension and OpenCV quality flag for each supported output format
+FORMATS = {
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY),
+    "jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY),
+}
+
+def compact_path(image_path, fmt, folder_name="compact_imgs"):
+    """
+    Path of the re-encoded copy of an image
+
+    Images live in <item_folder>/<img|cover_img>/, their compact copies in
+    <item_folder>/<folder_name>/ with the extension of the output format.
+    """
+    extension = FORMATS[fmt][0]
+    item_folder = os.path.dirname(os.path.dirname(image_path))
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(item_folder, folder_name, stem + extension).replace('\\', '/')
+
+def reencode_image(src_path, dst_path, max_dim=None, fmt="webp", quality=80):
+    """
+    Re-encode one image, downscaling it so its longest side is at most max_dim
+
+    The image is decoded from its content, so covers saved with the wrong extension
+    are handled. Returns dst_path, or None if the image could not be read or written.
+    """
+    image = cv2.imread(src_path, cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+
+    height, width = image.shape[:2]
+    if max_dim and max(height, width) > max_dim:
+        scale = max_dim / max(height, width)
+        image = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+
+    extension, quality_flag = FORMATS[fmt]
+    params = [quality_flag, int(quality)]
+    if fmt == "jpeg":
+        params += [cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+
+    # Write to a temporary file with the right extension, then move it into place
+    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+    tmp_path = f"{os.path.splitext(dst_path)[0]}.tmp{extension}"
+    if not cv2.imwrite(tmp_path, image, params):
+        return None
+    os.replace(tmp_path, dst_path)
+    return dst_path
+
+def reencode_many(jobs, max_dim=None, fmt="webp", quality=80, max_workers=None, executor=None):
+    """
+    Re-encode many images in a process pool
+
+    Each job is a (src_path, dst_path) tuple. Yields (job, dst_path or None) as
+    images complete. The jobs run in executor when one is given (and it is left
+    running), otherwise in a pool of max_workers processes started for this call.
+    """
+    if not jobs:
+        return
+
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=max_workers) as own_executor:
+            yield from reencode_many(jobs, max_dim, fmt, quality, executor=own_executor)
+        return
+
+    futures = {
+        executor.submit(reencode_image, src, dst, max_dim, fmt, quality): (src, dst)
+        for src, dst in jobs
+    }
+    for future in as_completed(futures):
+        job = futures[future]
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"Error re-encoding {job[0]}: {e}")
+            result = None
+        yield job, result
@@ -1,12 +1,16 @@
-import json
 import os
-import pandas as pd
 import traceback
-from apify_client import ApifyClient
-from typing import Dict, List, Any
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from apify_limiter import make_client
+from apify_cache import iterate_actor_items
+from datastore import get_store
+from metrics import metrics
+from typing import Dict, Iterable, List, Any
 from datetime import datetime
-import openpyxl
-from openpyxl.styles import Font, Alignment, PatternFill
+from name_dedup import group_names
+from excel_reader import iter_excel_records, expand_excel_paths, parse_excel_files
+from excel_writer import write_excel_rows, header_style
+from records import RecordWriter, iter_records, load_records, iter_batches, output_path
 
 # ============ Configuration Variables (All in one place) ============
 CONFIG = {
@@ -15,12 +19,19 @@ CONFIG = {
     
     # TikTok search parameters
     "MAX_ITEMS": 10,
+    "SEARCH_CONCURRENCY": 5,  # Number of restaurant searches (actor runs) in flight at once
     "SEARCH_LOCATION": "VN",
     "DATE_RANGE": "DEFAULT",
+    "TIKTOK_SEARCH_ACTOR_ID": "5K30i8aFccKNF5ICs",
+    "BYPASS_CACHE": False,  # True to always call the actor instead of reusing cached runs
+    "DEDUP_NAMES": True,  # Search once per group of names referring to the same restaurant
+    "DEDUP_THRESHOLD": 0.8,  # Trigram similarity above which two normalized names are the same place
+    "STORE_BATCH_SIZE": 500,  # Records written to (and looked up in) the datastore per transaction
     
     # File paths
     "INPUT_JSON_PATH": "./QUANAN_alpha/q10/quán_ngon_quận_10.json",
-    "INPUT_EXCEL_PATH": "./QUANAN_alpha/q10/quán_ngon_quận_10_v2.xlsx",
+    "INPUT_EXCEL_PATH": "./QUANAN_alpha/q10/quán_ngon_quận_10_v2.xlsx",  # File, folder of *_v2.xlsx, glob or list
+    "EXCEL_WORKERS": None,  # Processes parsing Excel files in parallel (None = one per CPU)
     "OUTPUT_DIR": "cac_quanan_q10/json_xlsx",
     
     # Excel configuration
@@ -29,14 +40,13 @@ CONFIG = {
 }
 
 def load_existing_data(json_file_path: str) -> List[Dict]:
-    """Load existing restaurant data from JSON file"""
-    with open(json_file_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    """Load existing restaurant data from a JSON or JSONL file"""
+    return load_records(json_file_path)
 
-def search_tiktok_videos(search_term: str, max_items: int) -> List[Dict[str, Any]]:
-    """Search TikTok videos based on a search term using Apify API"""
+def iter_tiktok_videos(search_term: str, max_items: int) -> Iterable[Dict[str, Any]]:
+    """Search TikTok videos for a search term, yielding each video as the actor's dataset is read"""
     # Initialize the ApifyClient
-    client = ApifyClient(CONFIG["API_KEY"])
+    client = make_client(CONFIG["API_KEY"])
     
     # Prepare the Actor input
     run_input = {
@@ -50,14 +60,11 @@ def search_tiktok_videos(search_term: str, max_items: int) -> List[Dict[str, Any
     print(f"Searching TikTok for: {search_term}")
     print(f"Maximum items: {max_items}")
     
-    # Run the Actor and wait for it to finish
-    run = client.actor("5K30i8aFccKNF5ICs").call(run_input=run_input)
-    
-    results = []
-    
-    # Fetch and process Actor results
+    # Run the Actor (or reuse a cached run) and process its results
     print("Processing search results...")
-    for item in client.dataset(run["defaultDatasetId"]).iterate_items():
+    items = iterate_actor_items(client, CONFIG["TIKTOK_SEARCH_ACTOR_ID"], run_input,
+                                bypass=CONFIG["BYPASS_CACHE"])
+    for item in items:
         # Extract only the requested fields
         extracted_data = {
             "title": item.get("title"),
@@ -84,91 +91,86 @@ def search_tiktok_videos(search_term: str, max_items: int) -> List[Dict[str, Any
             channel_name = extracted_data["channel"]["username"]
             extracted_data["usn_time"] = f"{channel_name}_{formatted_date}"
         
-        results.append(extracted_data)
-    
-    return results
+        yield extracted_data
+
+@metrics.timed("item_seconds", stage="search")
+def search_tiktok_videos(search_term: str, max_items: int) -> List[Dict[str, Any]]:
+    """Search TikTok videos based on a search term using Apify API"""
+    return list(iter_tiktok_videos(search_term, max_items))
 
-def create_excel_file(data: List[Dict], filename: str):
+def create_excel_file(data: Iterable[Dict], filename: str):
     """Create an Excel file with TikTok video data"""
-    # Create a new workbook and select the active sheet
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "TikTok Data"
-    
-    # Use headers from config
-    headers = CONFIG["EXCEL_HEADERS"]
-    
-    # Style for header row
-    header_font = Font(bold=True)
-    header_fill = PatternFill(start_color=CONFIG["HEADER_COLOR"], 
-                             end_color=CONFIG["HEADER_COLOR"], 
-                             fill_type="solid")
-    header_alignment = Alignment(horizontal="center", vertical="center")
-    
-    # Write headers
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_num, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
-    
-    # Write data rows
-    for row_num, video in enumerate(data, 2):
-        # Fill in only the requested fields
-        ws.cell(row=row_num, column=1, value=video.get("usn_time", ""))
-        ws.cell(row=row_num, column=2, value=video.get("postPage", ""))
-        ws.cell(row=row_num, column=3, value=video.get("title", ""))
+    # Fill in only the requested fields
+    rows = (
+        [video.get("usn_time", ""), video.get("postPage", ""), video.get("title", "")]
+        for video in data
+    )
+    write_excel_rows(
+        filename,
+        CONFIG["EXCEL_HEADERS"],
+        rows,
+        sheet_title="TikTok Data",
+        header_format=header_style(CONFIG["HEADER_COLOR"]),
+        column_width=lambda length: (length + 2) * 1.2
+    )
+    print(f"Created Excel file: {filename}")
+
+def parse_restaurant_excel(xlsx_file):
+    """Parse one Excel file into a usn_time -> restaurant details dict"""
+    restaurant_data = {}
     
-    # Adjust column widths
-    for col in ws.columns:
-        max_length = 0
-        column = col[0].column_letter  # Get the column letter
+    for row in iter_excel_records(xlsx_file):
+        usn_time = row.get('usn_time')
         
-        for cell in col:
-            if cell.value:
-                cell_length = len(str(cell.value))
-                if cell_length > max_length:
-                    max_length = cell_length
+        if not usn_time:
+            continue
         
-        adjusted_width = (max_length + 2) * 1.2
-        ws.column_dimensions[column].width = adjusted_width
+        # Get eat_name and remove trailing spaces while preserving internal spaces
+        eat_name = row.get('eat_name', '')
+        if isinstance(eat_name, str):
+            eat_name = eat_name.rstrip()
+            
+        restaurant_data[str(usn_time)] = {
+            'eat_name': eat_name,
+            'eat_addr': row.get('eat_addr', ''),
+            'open_time': row.get('open_time', ''),
+            'menu': row.get('menu', '')
+        }
     
-    # Save the workbook
-    wb.save(filename)
-    print(f"Created Excel file: {filename}")
+    return restaurant_data
 
+@metrics.timed("stage_seconds", stage="excel_ingest")
 def extract_excel_data(xlsx_file):
-    """Extract restaurant data from Excel file with usn_time as key"""
+    """
+    Extract restaurant data from Excel with usn_time as key
+
+    xlsx_file may be a single file, a folder of *_v2.xlsx files, a glob or a list
+    of these. Files are parsed in parallel and each parse is cached until the file
+    changes. When several files contain the same usn_time, the last file wins.
+    """
     try:
-        print(f"\nExtracting data from Excel file: {xlsx_file}")
-        if not os.path.exists(xlsx_file):
-            print(f"Error: Excel file '{xlsx_file}' does not exist.")
+        xlsx_files = expand_excel_paths(xlsx_file)
+        print(f"\nExtracting data from {len(xlsx_files)} Excel file(s): {xlsx_file}")
+        
+        missing = [path for path in xlsx_files if not os.path.exists(path)]
+        for path in missing:
+            print(f"Error: Excel file '{path}' does not exist.")
+        xlsx_files = [path for path in xlsx_files if path not in missing]
+        if not xlsx_files:
             return {}
-            
-        df = pd.read_excel(xlsx_file)
-        print(f"DataFrame shape: {df.shape}")
         
-        restaurant_data = {}
+        parsed = dict(parse_excel_files(xlsx_files, parse_restaurant_excel,
+                                        max_workers=CONFIG["EXCEL_WORKERS"]))
         
-        for idx, row in df.iterrows():
-            usn_time = row.get('usn_time')
-            
-            if not usn_time:
+        restaurant_data = {}
+        for path in xlsx_files:
+            if parsed.get(path) is None:
                 continue
-            
-            # Get eat_name and remove trailing spaces while preserving internal spaces
-            eat_name = row.get('eat_name', '')
-            if isinstance(eat_name, str):
-                eat_name = eat_name.rstrip()
-                
-            restaurant_data[usn_time] = {
-                'eat_name': eat_name,
-                'eat_addr': row.get('eat_addr', ''),
-                'open_time': row.get('open_time', ''),
-                'menu': row.get('menu', '')
-            }
+            print(f"  {path}: {len(parsed[path])} entries")
+            restaurant_data.update(parsed[path])
             
         print(f"Total restaurant entries processed: {len(restaurant_data)}")
+        get_store().upsert_restaurants(restaurant_data)
         return restaurant_data
         
     except Exception as e:
@@ -176,33 +178,46 @@ def extract_excel_data(xlsx_file):
         print(traceback.format_exc())
         return {}
 
+@metrics.timed("stage_seconds", stage="update")
 def update_json_data(json_file, restaurant_data):
-    """Update JSON file with restaurant details based on matching usn_time"""
+    """
+    Update JSON file with restaurant details based on matching usn_time
+
+    restaurant_data is the usn_time -> details dict of the current Excel ingest
+    (extract_excel_data), so entries dropped from the Excel files are removed even
+    though earlier ingests remain in the datastore. The updated entries are
+    recorded in the datastore as well (the input videos already are, by the
+    search that wrote them).
+    The input (JSON or JSONL) is streamed in batches of CONFIG["STORE_BATCH_SIZE"]
+    and kept entries are written out as each batch is matched, in the configured
+    output format.
+    """
     try:
         print(f"\nUpdating JSON data from: {json_file}")
-        with open(json_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        store = get_store()
         
         updated_count = 0
         removed_count = 0
-        filtered_data = []
-        
-        for entry in data:
-            usn_time = entry.get('usn_time', '')
-            
-            if usn_time and usn_time in restaurant_data:
-                entry.update(restaurant_data[usn_time])
-                filtered_data.append(entry)
-                updated_count += 1
-            else:
-                removed_count += 1
         
         # Create the updated filename with _upd suffix
         file_name, file_ext = os.path.splitext(json_file)
-        new_file = f"{file_name}_upd{file_ext}"
+        new_file = output_path(f"{file_name}_upd{file_ext}")
         
-        with open(new_file, 'w', encoding='utf-8') as f:
-            json.dump(filtered_data, f, ensure_ascii=False, indent=4)
+        with RecordWriter(new_file) as writer:
+            for batch in iter_batches(iter_records(json_file), CONFIG["STORE_BATCH_SIZE"]):
+                filtered_data = []
+                for entry in batch:
+                    usn_time = entry.get('usn_time', '')
+                    
+                    if usn_time and usn_time in restaurant_data:
+                        entry.update(restaurant_data[usn_time])
+                        filtered_data.append(entry)
+                        updated_count += 1
+                    else:
+                        removed_count += 1
+                
+                writer.write_many(filtered_data)
+                store.upsert_videos(filtered_data, source=new_file)
         
         print(f"Updated and kept {updated_count} entries")
         print(f"Removed {removed_count} entries")
@@ -226,12 +241,11 @@ def task1_update_json():
         print(f"Error: JSON file '{input_json_path}' does not exist.")
         return None
         
-    if not os.path.exists(excel_path):
-        print(f"Error: Excel file '{excel_path}' does not exist.")
+    if not expand_excel_paths(excel_path):
+        print(f"Error: no Excel file found at '{excel_path}'.")
         return None
     
     restaurant_data = extract_excel_data(excel_path)
-    
     if not restaurant_data:
         print("No restaurant data found in Excel file.")
         return None
@@ -240,6 +254,95 @@ def task1_update_json():
     print(f"Task 1 completed. Updated JSON file: {updated_json_path}")
     return updated_json_path
 
+def make_safe_name(eat_name):
+    """Convert a restaurant name into a safe filename"""
+    return eat_name.replace("/", "_").replace("\\", "_").replace(":", "_")\
+                   .replace("*", "_").replace("?", "_").replace("\"", "_")\
+                   .replace("<", "_").replace(">", "_").replace("|", "_")\
+                   .replace(" ", "_")
+
+def restaurant_json_path(eat_name, output_dir):
+    """Path of the video file of one restaurant, in the configured output format"""
+    return output_path(f"{output_dir}/{make_safe_name(eat_name)}.json")
+
+def write_restaurant_videos(eat_name, videos, output_dir):
+    """
+    Save the videos found for one restaurant to <safe_name>.json (or .jsonl) and .xlsx
+
+    videos may be any iterable, such as a search still in progress: each video is
+    written as it arrives, and the Excel file is streamed back from the saved
+    records. Returns (JSON path, number of videos).
+    """
+    json_filename = restaurant_json_path(eat_name, output_dir)
+    store = get_store()
+    
+    # Save all restaurant videos to a single JSON file
+    with RecordWriter(json_filename) as writer:
+        # Index the videos under the restaurant they were found for
+        indexed = []
+        for video in videos:
+            writer.write(video)
+            indexed.append({**video, "eat_name": eat_name})
+            if len(indexed) >= CONFIG["STORE_BATCH_SIZE"]:
+                store.upsert_videos(indexed, source=json_filename)
+                indexed = []
+        if indexed:
+            store.upsert_videos(indexed, source=json_filename)
+    print(f"Created JSON file: {json_filename}")
+    
+    # Create Excel file with the same data
+    excel_filename = f"{output_dir}/{make_safe_name(eat_name)}.xlsx"
+    create_excel_file(iter_records(json_filename), excel_filename)
+    
+    print(f"Processed {writer.count} videos for {eat_name}")
+    return json_filename, writer.count
+
+def save_restaurant_videos(eat_name, videos, output_dir):
+    """Save the videos found for one restaurant to <safe_name>.json and .xlsx, returning the JSON path"""
+    return write_restaurant_videos(eat_name, videos, output_dir)[0]
+
+@metrics.timed("item_seconds", stage="search")
+def search_and_save(group, max_items, output_dir):
+    """
+    Search one restaurant and save the result under every spelling in group
+
+    The first spelling's file is written while the search results stream in; the
+    other spellings are saved from that file. Returns (JSON paths, number of videos).
+    """
+    first_file, count = write_restaurant_videos(group[0], iter_tiktok_videos(group[0], max_items), output_dir)
+    json_files = [first_file]
+    for eat_name in group[1:]:
+        # Spellings that map to the same file name already have it
+        if restaurant_json_path(eat_name, output_dir) == first_file:
+            json_files.append(first_file)
+        else:
+            json_files.append(save_restaurant_videos(eat_name, iter_records(first_file), output_dir))
+    return json_files, count
+
+def restaurant_groups(restaurants):
+    """
+    Return (eat_names, groups) for the restaurants to search
+
+    Only rows with a usable eat_name are kept. Each group lists the spellings of
+    one restaurant, the one to search with first.
+    """
+    # Keep only rows that carry a usable restaurant name
+    eat_names = []
+    for restaurant in restaurants:
+        eat_name = restaurant.get("eat_name")
+        if eat_name and eat_name != "NaN" and not isinstance(eat_name, float):
+            eat_names.append(eat_name)
+    
+    # Names differing only in diacritics, casing or spacing share one search
+    if CONFIG["DEDUP_NAMES"]:
+        groups = group_names(eat_names, threshold=CONFIG["DEDUP_THRESHOLD"])
+    else:
+        groups = [[eat_name] for eat_name in dict.fromkeys(eat_names)]
+    for group in groups:
+        if len(group) > 1:
+            print(f"Same restaurant: {' | '.join(group)}")
+    return eat_names, groups
+
 # Task 2: Search TikTok for restaurants from updated JSON
 def task2_search_tiktok(updated_json_path):
     """Search TikTok for videos related to restaurants from updated JSON"""
@@ -265,32 +368,30 @@ def task2_search_tiktok(updated_json_path):
     
     print(f"Found {len(restaurants)} restaurants in the updated JSON.")
     
-    # Process each restaurant
-    for restaurant in restaurants:
-        eat_name = restaurant.get("eat_name")
-        if eat_name and eat_name != "NaN" and not isinstance(eat_name, float):
-            print(f"\nProcessing restaurant: {eat_name}")
-            
-            # Search TikTok for videos related to this restaurant
-            videos = search_tiktok_videos(eat_name, max_items)
-            
-            # Create safe filename
-            safe_name = eat_name.replace("/", "_").replace("\\", "_").replace(":", "_")\
-                              .replace("*", "_").replace("?", "_").replace("\"", "_")\
-                              .replace("<", "_").replace(">", "_").replace("|", "_")\
-                              .replace(" ", "_")
-            
-            # Save all restaurant videos to a single JSON file
-            json_filename = f"{output_dir}/{safe_name}.json"
-            with open(json_filename, 'w', encoding='utf-8') as f:
-                json.dump(videos, f, ensure_ascii=False, indent=4)
-            print(f"Created JSON file: {json_filename}")
-            
-            # Create Excel file with the same data
-            excel_filename = f"{output_dir}/{safe_name}.xlsx"
-            create_excel_file(videos, excel_filename)
-            
-            print(f"Processed {len(videos)} videos for {eat_name}")
+    eat_names, groups = restaurant_groups(restaurants)
+    
+    concurrency = max(1, int(CONFIG["SEARCH_CONCURRENCY"]))
+    print(f"Searching {len(groups)} restaurants ({len(eat_names)} names) with up to {concurrency} concurrent actor runs")
+    
+    # Run the searches concurrently; each restaurant's file is written while its results stream in
+    # and every spelling of the restaurant gets the result of the group's search
+    failed = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(search_and_save, group, max_items, output_dir): group
+            for group in groups
+        }
+        for future in as_completed(futures):
+            group = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error searching TikTok for {group[0]}: {e}")
+                failed.append(group[0])
+    
+    if failed:
+        print(f"\nTask 2 finished with {len(failed)} failed searches: {', '.join(failed)}")
+        return False
     
     print("\nTask 2 completed. All restaurants processed successfully.")
     return True
@@ -309,4 +410,7 @@ def main():
         print("Cannot proceed to Task 2 because Task 1 failed.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    try:
+        main()
+    finally:
+        metrics.write_report("search_restaurants")
\ No newline at end of file
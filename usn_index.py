@@ -0,0 +1,207 @@
+import argparse
+import glob
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from datastore import DATASTORE_CONFIG
+from records import iter_records, record_globs
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usn_files (
+    path     TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size     INTEGER NOT NULL,
+    count    INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS usn_entries (
+    path     TEXT NOT NULL,
+    usn_time TEXT,
+    postPage TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_usn_entries_path ON usn_entries (path);
+CREATE INDEX IF NOT EXISTS idx_usn_entries_usn_time ON usn_entries (usn_time);
+CREATE INDEX IF NOT EXISTS idx_usn_entries_post_page ON usn_entries (postPage);
+"""
+
+# Files re-parsed in a process pool once there are at least this many to refresh
+PARALLEL_THRESHOLD = 8
+
+# Patterns searched in folders: record files in either output format
+DEFAULT_PATTERNS = tuple(record_globs("*"))
+
+def extract_keys(file_path):
+    """Return the distinct (usn_time, postPage) pairs of one JSON or JSONL file, or [] if it cannot be parsed"""
+    pairs = set()
+    try:
+        for item in iter_records(file_path):
+            if isinstance(item, dict) and (item.get('usn_time') or item.get('postPage')):
+                pairs.add((item.get('usn_time'), item.get('postPage')))
+    except ValueError as e:
+        print(f"Error parsing JSON file {file_path}: {e}")
+        return []
+    except Exception as e:
+        print(f"Error reading file {file_path}: {e}")
+        return []
+    return sorted(pairs, key=lambda pair: (pair[0] or '', pair[1] or ''))
+
+def normalize_path(path):
+    return os.path.normpath(os.path.abspath(path))
+
+class UsnIndex:
+    """
+    Persistent index of the usn_time and postPage of every video in the JSON outputs
+
+    The index lives in SQLite next to the pipeline datastore. refresh() re-reads
+    only files whose mtime or size changed since they were indexed, so keeping
+    thousands of district files indexed costs one stat per file, and set
+    differences between files are answered by indexed queries.
+    """
+
+    def __init__(self, path=None):
+        self.path = str(path or DATASTORE_CONFIG["PATH"])
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        with self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(SCHEMA)
+
+    def refresh(self, roots, patterns=DEFAULT_PATTERNS, max_workers=None):
+        """
+        Bring the index up to date with the JSON and JSONL files under roots
+
+        roots is a list of folders (searched recursively for each of patterns),
+        files or globs. Files that disappeared from a scanned folder are dropped from the
+        index. Returns (files re-indexed, files removed).
+        """
+        found = {}
+        scanned_dirs = []
+        for root in roots:
+            if os.path.isdir(root):
+                scanned_dirs.append(normalize_path(root))
+                paths = [path for pattern in patterns
+                         for path in glob.glob(os.path.join(root, "**", pattern), recursive=True)]
+            elif glob.has_magic(root):
+                paths = glob.glob(root, recursive=True)
+            else:
+                paths = [root]
+            for path in paths:
+                if os.path.isfile(path):
+                    stat = os.stat(path)
+                    found[normalize_path(path)] = (stat.st_mtime_ns, stat.st_size)
+
+        known = {row[0]: (row[1], row[2]) for row in self.conn.execute("SELECT path, mtime_ns, size FROM usn_files")}
+        changed = [path for path, signature in found.items() if known.get(path) != signature]
+        removed = [
+            path for path in known
+            if path not in found and any(path.startswith(folder + os.sep) for folder in scanned_dirs)
+        ]
+
+        if len(changed) >= PARALLEL_THRESHOLD:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                parsed = dict(zip(changed, executor.map(extract_keys, changed, chunksize=16)))
+        else:
+            parsed = {path: extract_keys(path) for path in changed}
+
+        with self.conn:
+            for path in changed + removed:
+                self.conn.execute("DELETE FROM usn_entries WHERE path = ?", (path,))
+                self.conn.execute("DELETE FROM usn_files WHERE path = ?", (path,))
+            for path in changed:
+                mtime_ns, size = found[path]
+                self.conn.executemany(
+                    "INSERT INTO usn_entries (path, usn_time, postPage) VALUES (?, ?, ?)",
+                    [(path, usn_time, post_page) for usn_time, post_page in parsed[path]]
+                )
+                self.conn.execute("INSERT INTO usn_files (path, mtime_ns, size, count) VALUES (?, ?, ?, ?)",
+                                  (path, mtime_ns, size, len(parsed[path])))
+        return len(changed), len(removed)
+
+    def files(self):
+        """Return the indexed file paths"""
+        return [row[0] for row in self.conn.execute("SELECT path FROM usn_files ORDER BY path")]
+
+    def unique(self, target_file, comparison_files=None, key="usn_time"):
+        """
+        Values of key (usn_time or postPage) present in target_file but in no comparison file
+
+        Without comparison_files the target is compared against every other indexed file.
+        """
+        if key not in ("usn_time", "postPage"):
+            raise ValueError(f"Unsupported key: {key}")
+        target = normalize_path(target_file)
+
+        if comparison_files is None:
+            sql = f"""SELECT DISTINCT t.{key} FROM usn_entries t
+                      WHERE t.path = ? AND t.{key} IS NOT NULL AND NOT EXISTS (
+                          SELECT 1 FROM usn_entries o WHERE o.{key} = t.{key} AND o.path != ?)"""
+            params = [target, target]
+        else:
+            others = [normalize_path(path) for path in comparison_files if normalize_path(path) != target]
+            if not others:
+                return {row[0] for row in self.conn.execute(
+                    f"SELECT DISTINCT {key} FROM usn_entries WHERE path = ? AND {key} IS NOT NULL", (target,))}
+            # Comparison lists can exceed SQLite's parameter limit, so stage them in a temp table
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS usn_compare (path TEXT PRIMARY KEY)")
+            self.conn.execute("DELETE FROM usn_compare")
+            self.conn.executemany("INSERT OR IGNORE INTO usn_compare (path) VALUES (?)", [(p,) for p in others])
+            sql = f"""SELECT DISTINCT t.{key} FROM usn_entries t
+                      WHERE t.path = ? AND t.{key} IS NOT NULL AND NOT EXISTS (
+                          SELECT 1 FROM usn_entries o JOIN usn_compare c ON c.path = o.path
+                          WHERE o.{key} = t.{key})"""
+            params = [target]
+        return {row[0] for row in self.conn.execute(sql, params)}
+
+    def close(self):
+        self.conn.close()
+
+def find_unique_usn_times(target_file, comparison_files, index_path=None):
+    """
+    Find usn_time values that exist in the target file but not in any comparison files
+
+    The files are refreshed into the persistent index first, so only files changed
+    since the last call are parsed again.
+    """
+    index = UsnIndex(index_path)
+    try:
+        index.refresh([target_file] + list(comparison_files))
+        return index.unique(target_file, comparison_files)
+    finally:
+        index.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Index usn_time/postPage across JSON outputs and list the videos unique to a file")
+    parser.add_argument("roots", nargs="+", help="Folders (searched recursively), files or globs to index")
+    parser.add_argument("--target", action="append",
+                        help="File to report unique videos for (repeatable; default: every indexed file)")
+    parser.add_argument("--key", choices=["usn_time", "postPage"], default="usn_time", help="Field to compare")
+    parser.add_argument("--pattern", dest="patterns", action="append",
+                        help="File pattern searched in folders (repeatable; default: "
+                             f"{' '.join(DEFAULT_PATTERNS)})")
+    parser.add_argument("--db", default=None, help=f"Index database (default: {DATASTORE_CONFIG['PATH']})")
+    args = parser.parse_args(argv)
+
+    index = UsnIndex(args.db)
+    try:
+        start = time.perf_counter()
+        updated, removed = index.refresh(args.roots + (args.target or []), args.patterns or DEFAULT_PATTERNS)
+        print(f"Index refreshed in {time.perf_counter() - start:.3f}s: "
+              f"{updated} file(s) re-indexed, {removed} removed, {len(index.files())} indexed")
+
+        start = time.perf_counter()
+        targets = args.target or index.files()
+        for target_file in targets:
+            unique_values = index.unique(target_file, key=args.key)
+            if unique_values:
+                print(f"\nUnique {args.key} values in {target_file}:")
+                for value in sorted(unique_values):
+                    print(f"  - {value}")
+        print(f"\nQueried {len(targets)} file(s) in {time.perf_counter() - start:.3f}s")
+    finally:
+        index.close()
+
+if __name__ == "__main__":
+    sys.exit(main())